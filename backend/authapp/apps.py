@@ -5,3 +5,7 @@ class AuthappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "authapp"
     verbose_name = 'Авторизация'
+
+    def ready(self):
+        # Подключаем сигналы сброса кэша токенов
+        from authapp import token_cache  # noqa: F401
@@ -0,0 +1,23 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from authapp.token_cache import TokenUserCache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к таблице токенов на каждый вызов API:
+    пользователь берется из TokenUserCache (память процесса -> Redis -> БД).
+    """
+
+    def authenticate_credentials(self, key):
+        user = TokenUserCache.get_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return user, Token(key=key, user=user)
@@ -0,0 +1,51 @@
+import uuid
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+
+from authapp.models import CustomUser
+from authapp.token_cache import TokenUserCache
+
+
+class TokenUserCacheTests(TestCase):
+    """Пользователь по токену берется из кэша, выход из системы сразу закрывает доступ"""
+
+    def setUp(self):
+        prefix = uuid.uuid4().hex[:8]
+        # bulk_create не вызывает CustomUser.save(), который копирует файл аватара по умолчанию
+        self.user, = CustomUser.objects.bulk_create([
+            CustomUser(username=f'token_{prefix}', email=f'token_{prefix}@test.local', password='secret-hash')
+        ])
+        self.token = Token.objects.create(user=self.user)
+        # id пользователей тестовой БД повторяются между запусками
+        cache.delete(TokenUserCache.user_cache_key(self.user.pk))
+        self.clear_local()
+
+    def clear_local(self):
+        with TokenUserCache._lock:
+            TokenUserCache._local.clear()
+            TokenUserCache._local_keys_by_user.clear()
+
+    def test_logout_invalidates_cached_token(self):
+        key = self.token.key
+        self.assertEqual(TokenUserCache.get_user(key).pk, self.user.pk)
+        with self.assertNumQueries(0):
+            TokenUserCache.get_user(key)
+
+        self.token.delete()
+
+        self.assertIsNone(TokenUserCache.get_local(key))
+        self.assertIsNone(TokenUserCache.get_user(key))
+
+    def test_redis_keeps_only_auth_fields(self):
+        TokenUserCache.get_user(self.token.key)
+        self.assertNotIn('password', cache.get(TokenUserCache.user_cache_key(self.user.pk)))
+
+        # Из Redis пользователь собирается без запросов, остальные поля читаются из БД при обращении
+        self.clear_local()
+        with self.assertNumQueries(0):
+            user = TokenUserCache.get_user(self.token.key)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, self.user.username, True))
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertEqual(user.email, self.user.email)
@@ -0,0 +1,165 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from authapp.models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые меняются при каждом подключении к WebSocket и не влияют на аутентификацию
+PRESENCE_FIELDS = {'is_online', 'last_seen'}
+
+# Поля пользователя в общем кэше Redis: только нужные для аутентификации и прав,
+# без хэша пароля и персональных данных. Остальные поля загружаются из БД при обращении
+AUTH_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _cache_settings():
+    return getattr(settings, 'AUTH_TOKEN_CACHE', {})
+
+
+class TokenUserCache:
+    """
+    Кэш соответствия токен -> пользователь: LRU в памяти процесса перед Redis.
+
+    В Redis хранятся две записи: auth:token:<key> -> id пользователя и
+    auth:user:<id> -> поля AUTH_FIELDS пользователя, чтобы изменение пользователя
+    сбрасывало кэш без поиска его токена в БД. Пользователь собирается из этих полей
+    как из выборки .only(): остальные поля подгружаются из БД при первом обращении.
+    LRU других процессов при выходе не сбрасывается и живет не дольше LOCAL_TTL.
+    """
+    _local = OrderedDict()  # {token_key: (expires_at, user)}
+    _local_keys_by_user = {}  # {user_id: set(token_keys)}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def token_cache_key(token_key):
+        return f'auth:token:{token_key}'
+
+    @staticmethod
+    def user_cache_key(user_id):
+        return f'auth:user:{user_id}'
+
+    @classmethod
+    def get_local(cls, token_key):
+        """Поиск только в памяти процесса - безопасно вызывать прямо из event loop"""
+        with cls._lock:
+            entry = cls._local.get(token_key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                cls._drop_local(token_key)
+                return None
+            cls._local.move_to_end(token_key)
+            # Копия, чтобы изменения request.user в одном запросе не попадали в другие
+            return copy.copy(user)
+
+    @classmethod
+    def get_user(cls, token_key):
+        """
+        Возвращает пользователя по токену или None, если токен не существует.
+        Порядок поиска: память процесса, Redis, БД.
+        """
+        user = cls.get_local(token_key)
+        if user is not None:
+            return user
+
+        redis_ttl = _cache_settings().get('REDIS_TTL', 300)
+        user_id = cache.get(cls.token_cache_key(token_key))
+        if user_id is not None:
+            fields = cache.get(cls.user_cache_key(user_id))
+            # Записи предыдущей версии хранили объект пользователя целиком - читаем их из БД заново
+            if isinstance(fields, dict):
+                user = cls.user_from_fields(fields)
+
+        if user is None:
+            try:
+                token = Token.objects.select_related('user').get(key=token_key)
+            except Token.DoesNotExist:
+                return None
+            user = token.user
+            cache.set_many({
+                cls.token_cache_key(token_key): user.pk,
+                cls.user_cache_key(user.pk): cls.user_fields(user),
+            }, timeout=redis_ttl)
+
+        cls._set_local(token_key, user)
+        return copy.copy(user)
+
+    @staticmethod
+    def user_fields(user):
+        return {name: getattr(user, name) for name in AUTH_FIELDS}
+
+    @staticmethod
+    def user_from_fields(fields):
+        """Пользователь с загруженными AUTH_FIELDS, остальные поля отложены (deferred)"""
+        # from_db ожидает значения в порядке concrete_fields модели
+        names = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in fields]
+        return CustomUser.from_db('default', names, [fields[name] for name in names])
+
+    @classmethod
+    def invalidate(cls, token_key):
+        """Сбрасываем токен в памяти процесса и в Redis"""
+        with cls._lock:
+            cls._drop_local(token_key)
+        cache.delete(cls.token_cache_key(token_key))
+
+    @classmethod
+    def invalidate_user(cls, user_id):
+        """Сбрасываем закэшированный объект пользователя после его изменения"""
+        with cls._lock:
+            for token_key in list(cls._local_keys_by_user.get(user_id, ())):
+                cls._drop_local(token_key)
+        cache.delete(cls.user_cache_key(user_id))
+
+    @classmethod
+    def _set_local(cls, token_key, user):
+        options = _cache_settings()
+        expires_at = time.monotonic() + options.get('LOCAL_TTL', 30)
+        with cls._lock:
+            cls._local[token_key] = (expires_at, user)
+            cls._local.move_to_end(token_key)
+            cls._local_keys_by_user.setdefault(user.pk, set()).add(token_key)
+            while len(cls._local) > options.get('LOCAL_MAX_SIZE', 10000):
+                oldest_key = next(iter(cls._local))
+                cls._drop_local(oldest_key)
+
+    @classmethod
+    def _drop_local(cls, token_key):
+        entry = cls._local.pop(token_key, None)
+        if entry is None:
+            return
+        user_id = entry[1].pk
+        keys = cls._local_keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(token_key)
+            if not keys:
+                del cls._local_keys_by_user[user_id]
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Выход из системы и любое удаление токена сразу закрывают доступ по нему"""
+    try:
+        TokenUserCache.invalidate(instance.key)
+    except Exception as e:
+        logger.error(f"Error invalidating token cache: {e}")
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_changed_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= PRESENCE_FIELDS:
+        return
+    try:
+        TokenUserCache.invalidate_user(instance.pk)
+    except Exception as e:
+        logger.error(f"Error invalidating user cache: {e}")
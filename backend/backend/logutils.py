@@ -0,0 +1,196 @@
+"""
+Бюджет логирования горячего пути.
+
+- lazy/preview: значения, которые вычисляются только если запись действительно форматируется;
+- HotPathFilter: token bucket на логгер, сэмплирование и превращение отладочных записей в счетчики;
+- configure_logging: LOGGING_CONFIG, который переносит вывод выбранных логгеров в отдельный поток
+  через QueueHandler/QueueListener, чтобы запись в консоль и файлы не блокировала event loop.
+"""
+import atexit
+import logging
+import logging.config
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class lazy:
+    """Откладывает вызов func(*args) до форматирования записи: logger.debug('%s', lazy(dump, data))"""
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+def _preview(text, limit):
+    if not text:
+        return 'empty'
+    return text if len(text) <= limit else f'{text[:limit]}...'
+
+
+def preview(text, limit=50):
+    """Начало текста сообщения для лога, обрезается только при форматировании"""
+    return lazy(_preview, text, limit)
+
+
+class LogCounters:
+    """
+    Счетчики записей, которые не попали в вывод: log.<logger>.<level> для превращенных в счетчики
+    и log.<logger>.suppressed для отброшенных rate limit'ом и сэмплированием.
+    Раз в FLUSH_INTERVAL секунд счетчики складываются в общий hash метрик chat:metrics.
+    """
+    FLUSH_INTERVAL = 10
+
+    _counts = Counter()
+    _lock = threading.Lock()
+    _flusher = None
+
+    @classmethod
+    def incr(cls, name):
+        with cls._lock:
+            cls._counts[name] += 1
+        if cls._flusher is None:
+            cls._start_flusher()
+
+    @classmethod
+    def _start_flusher(cls):
+        with cls._lock:
+            if cls._flusher is not None:
+                return
+            cls._flusher = threading.Thread(target=cls._flush_loop, name='log-counters', daemon=True)
+            cls._flusher.start()
+
+    @classmethod
+    def _flush_loop(cls):
+        while True:
+            time.sleep(cls.FLUSH_INTERVAL)
+            cls.flush()
+
+    @classmethod
+    def flush(cls):
+        with cls._lock:
+            counts, cls._counts = cls._counts, Counter()
+        if not counts:
+            return
+        try:
+            from chatapp.services.metrics import METRICS_KEY
+            from chatapp.services.redis_client import get_sync_redis
+
+            with get_sync_redis().pipeline(transaction=False) as pipe:
+                for name, value in counts.items():
+                    pipe.hincrby(METRICS_KEY, name, value)
+                pipe.execute()
+        except Exception as e:
+            # Счетчики не теряем: их набор ограничен именами логгеров, допишем в следующий раз
+            with cls._lock:
+                cls._counts.update(counts)
+            logger.error('📊 [LOG-COUNTERS] Error flushing log counters: %s', e)
+
+
+class HotPathFilter(logging.Filter):
+    """
+    Фильтр логгеров горячего пути, отдельный бюджет на каждый логгер (record.name).
+
+    count_below - записи ниже этого уровня не выводятся, а только считаются;
+    rate/burst - token bucket записей в секунду, лишние записи отбрасываются и считаются;
+    sample - доля записей ниже WARNING, которые проходят после rate limit.
+    Записи WARNING и выше проходят всегда.
+    """
+
+    def __init__(self, rate=None, burst=None, sample=1.0, count_below=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self.sample = sample
+        if isinstance(count_below, str):
+            count_below = logging.getLevelName(count_below)
+        self.count_below = count_below
+        self._buckets = {}  # {logger: (tokens, ts)}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if self.count_below is not None and record.levelno < self.count_below:
+            LogCounters.incr(f'log.{record.name}.{record.levelname.lower()}')
+            return False
+
+        if self.rate and not self._take_token(record.name):
+            LogCounters.incr(f'log.{record.name}.suppressed')
+            return False
+
+        if self.sample < 1.0 and random.random() >= self.sample:
+            LogCounters.incr(f'log.{record.name}.suppressed')
+            return False
+
+        return True
+
+    def _take_token(self, name):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - ts) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[name] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+
+_listeners = []
+_atexit_registered = False
+
+
+def configure_logging(config):
+    """
+    LOGGING_CONFIG проекта: обычный dictConfig плюс необязательный ключ 'background' -
+    список логгеров, обработчики которых переносятся в поток QueueListener.
+    На event loop остается только постановка записи в очередь.
+    """
+    config = dict(config)
+    background = config.pop('background', [])
+    logging.config.dictConfig(config)
+
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+
+    # Один поток и одна очередь на набор обработчиков, чтобы общий handler не писал из двух потоков
+    groups = {}
+    for name in background:
+        target = logging.getLogger(name or None)
+        if target.handlers:
+            groups.setdefault(tuple(target.handlers), []).append(target)
+
+    for handlers, targets in groups.items():
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+
+        queue_handler = logging.handlers.QueueHandler(records)
+        for target in targets:
+            target.handlers = [queue_handler]
+
+    global _atexit_registered
+    if _listeners and not _atexit_registered:
+        atexit.register(stop_listeners)
+        _atexit_registered = True
+
+
+def stop_listeners():
+    """Дописывает оставшиеся в очереди записи (atexit)"""
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+    LogCounters.flush()
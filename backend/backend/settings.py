@@ -66,7 +66,7 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authapp.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -348,6 +348,49 @@ if not DEBUG:
 # 1) iex (New-Object System.Net.WebClient).DownloadString('https://storage.yandexcloud.net/yandexcloud-yc/install.ps1')
 # 2)
 # Настройки логирования
+# Логгеры горячего пути: записи на каждое сообщение, кадр WebSocket или запрос медиа
+HOT_PATH_LOGGERS = [
+    'chatapp.consumers',
+    'chatapp.ingest',
+    'chatapp.media',
+    'chatapp.membership',
+    'chatapp.message_dedupe',
+    'chatapp.metrics',
+    'chatapp.outbound',
+    'chatapp.presence',
+    'chatapp.push_dispatch',
+    'chatapp.push_notifications',
+    'chatapp.rate_limit',
+    'chatapp.read_receipts',
+    'chatapp.recent_messages',
+    'chatapp.refresh',
+    'chatapp.room_presence',
+    'chatapp.room_sync',
+    'chatapp.send_message',
+    'chatapp.tasks',
+    'media_api.views',
+    'profileapp.view_api',
+]
+
+# Профиль логирования (LOG_PROFILE):
+# 'debug' - выводятся все записи горячего пути, включая DEBUG (разработка);
+# 'default' - выводится INFO и выше;
+# 'production' - DEBUG горячего пути только считается (log.<logger>.debug в chat:metrics),
+#   INFO ограничен HOT_PATH_LOG_RATE записями в секунду на логгер, лишнее тоже считается.
+# Во всех профилях вывод в консоль идет из потока QueueListener, а не из event loop.
+LOG_PROFILE = env('LOG_PROFILE', default='default')
+HOT_PATH_LOG_FILTER = {
+    'debug': {},
+    'default': {},
+    'production': {
+        'rate': env.float('HOT_PATH_LOG_RATE', default=20),
+        'burst': 100,
+        'sample': env.float('HOT_PATH_LOG_SAMPLE', default=1.0),
+        'count_below': 'INFO',
+    },
+}[LOG_PROFILE]
+
+LOGGING_CONFIG = 'backend.logutils.configure_logging'
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -358,29 +401,35 @@ LOGGING = {
             'datefmt': '%Y-%m-%d %H:%M:%S',
         },
     },
+    'filters': {
+        'hot_path': {
+            '()': 'backend.logutils.HotPathFilter',
+            **HOT_PATH_LOG_FILTER,
+        },
+    },
     'handlers': {
         'console': {
-            'level': 'INFO',
+            'level': 'DEBUG' if LOG_PROFILE == 'debug' else 'INFO',
             'class': 'logging.StreamHandler',
             'formatter': 'push_notifications',
         },
     },
     'loggers': {
-        'chatapp.push_notifications': {
+        name: {
             'handlers': ['console'],
-            'level': 'INFO',
+            # В production DEBUG должен дойти до фильтра, чтобы превратиться в счетчик
+            'level': 'INFO' if LOG_PROFILE == 'default' else 'DEBUG',
+            'filters': ['hot_path'],
             'propagate': False,
-        },
-        'chatapp.consumers': {
-            'handlers': ['console'],
-            'level': 'INFO',
-            'propagate': False,
-        },
+        }
+        for name in HOT_PATH_LOGGERS
     },
     'root': {
         'handlers': ['console'],
         'level': 'INFO',
     },
+    # Логгеры, обработчики которых работают в фоновом потоке (backend.logutils.configure_logging)
+    'background': ['', *HOT_PATH_LOGGERS],
 }
 
 
@@ -432,3 +481,112 @@ CACHE_TTL = {
 }
 
 
+
+# Redis для состояния чата, общего для всех воркеров daphne (presence и т.п.)
+CHAT_REDIS_URL = env('CHAT_REDIS_URL', default='redis://127.0.0.1:6379/2')
+
+# Реестр онлайн-соединений: соединение считается живым CONNECTION_TTL секунд
+# после последнего heartbeat, heartbeat отправляется каждые HEARTBEAT_INTERVAL секунд.
+# Оффлайн рассылается контактам, если за OFFLINE_GRACE секунд не было переподключения.
+# Статус в Redis - источник истины, в CustomUser.is_online/last_seen он записывается
+# раз в FLUSH_INTERVAL секунд одним UPDATE на FLUSH_BATCH_SIZE пользователей
+CHAT_PRESENCE = {
+    'HEARTBEAT_INTERVAL': 20,
+    'CONNECTION_TTL': 60,
+    'OFFLINE_GRACE': 5,
+    'SWEEP_INTERVAL': 60,  # поиск пользователей, оставшихся онлайн после падения воркера, сек
+    'FLUSH_INTERVAL': 10,
+    'FLUSH_BATCH_SIZE': 500,
+    'CONTACTS_TTL': 3600,  # кэш собеседников пользователя, сек
+    'FANOUT_CONCURRENCY': 50,  # одновременных group_send при рассылке статуса
+}
+
+# Кто в групповой комнате (Room): ZSET в Redis с heartbeat, как в CHAT_PRESENCE.
+# Входы и выходы рассылаются одной сводкой presence_summary раз в SUMMARY_INTERVAL секунд
+CHAT_ROOM_PRESENCE = {
+    'HEARTBEAT_INTERVAL': 20,
+    'CONNECTION_TTL': 60,
+    'SUMMARY_INTERVAL': 1,
+    'SUMMARY_MAX_NAMES': 20,  # имен в сводке, остальные только в счетчиках
+}
+
+# Окно схлопывания триггеров пересчета уведомлений и списка чатов, сек
+CHAT_REFRESH = {
+    'COALESCE_WINDOW': env.float('CHAT_REFRESH_COALESCE_WINDOW', default=0.15),
+}
+
+# Медиа, отправленное через WebSocket в base64, хранится в Redis и раздается по ссылке
+CHAT_MEDIA = {
+    'INLINE_MAX_BYTES': env.int('CHAT_MEDIA_INLINE_MAX_BYTES', default=512 * 1024),
+    'INLINE_TTL': 300,  # сек
+}
+
+# Исходящая очередь WebSocket соединения: при превышении MAX_FRAMES дольше EVICT_AFTER секунд
+# клиент получает resync_required и отключается. Глубина очередей публикуется раз в REPORT_INTERVAL секунд
+CHAT_OUTBOUND = {
+    'MAX_FRAMES': env.int('CHAT_OUTBOUND_MAX_FRAMES', default=200),
+    'EVICT_AFTER': 10,
+    'REPORT_INTERVAL': 10,
+}
+
+# Лимиты входящих WebSocket кадров на пользователя (token bucket в Redis):
+# RATE - токенов в секунду, BURST - емкость. message - сообщения, read - прочтения, control - прочее
+CHAT_RATE_LIMITS = {
+    'message': {'RATE': env.float('CHAT_RATE_MESSAGE', default=5), 'BURST': 20},
+    'read': {'RATE': 10, 'BURST': 50},
+    'control': {'RATE': 2, 'BURST': 10},
+}
+
+# Горячие запросы WebSocket consumer'ов: async ORM Django вместо database_sync_to_async.
+# Сравнение путей: python manage.py chat_benchmark consumer_db
+CHAT_DB = {
+    'ASYNC_ORM': env.bool('CHAT_ASYNC_ORM', default=False),
+    'CONNECTION_CHECK_INTERVAL': 60,  # сек, проверка устаревших соединений async ORM
+}
+
+# Write-behind запись текстовых сообщений (только PostgreSQL): MODE 'stream' - сообщение кладется
+# в Redis stream и рассылается сразу, строки пишет python manage.py chat_ingest_worker.
+# DURABILITY: 'enqueue' - подтверждение после записи в stream, 'commit' - после коммита в БД
+CHAT_INGEST = {
+    'MODE': env('CHAT_INGEST_MODE', default='sync'),
+    'DURABILITY': env('CHAT_INGEST_DURABILITY', default='enqueue'),
+    'STREAM': 'chat:ingest',
+    'GROUP': 'chat-persisters',
+    'STREAM_MAXLEN': 100000,
+    'COMMIT_TIMEOUT': 5,  # сек
+}
+
+# Push-уведомления о сообщениях: отправка в FCM через Celery (chatapp.tasks.send_message_push_task)
+CHAT_PUSH = {
+    'DEDUPE_TTL': 3600,  # не больше одного push на сообщение, сек
+    'MAX_RETRIES': 3,
+    'RETRY_BACKOFF': 2,  # пауза перед повтором: RETRY_BACKOFF * 2^попытка, сек
+}
+
+# Синхронизация после переподключения (кадр resume с last_seq)
+CHAT_SYNC = {
+    'RESUME_MAX_MESSAGES': 500,  # больше пропущенных сообщений - resync_required
+    'RESUME_WINDOW': 200,  # сколько последних сообщений клиента проверять на прочтения и удаления
+}
+
+# Последние сообщения комнаты в Redis: первая страница chat_history и кадр recent_messages при подключении
+CHAT_RECENT = {
+    'SIZE': 50,  # сообщений в списке комнаты, не меньше максимального limit истории
+    'TTL': 86400,  # сек, после истечения список собирается из БД заново
+    'HANDSHAKE_LIMIT': 15,
+}
+
+# Отправка сообщения: кэш участников комнаты room_id -> (user1_id, user2_id)
+# и дедупликация повторных отправок по client_msg_id
+CHAT_SEND = {
+    'PARTICIPANTS_TTL': 86400,  # Redis, сек
+    'PARTICIPANTS_LOCAL_MAX_SIZE': 10000,  # LRU в памяти процесса
+    'CLIENT_MSG_TTL': 600,  # сколько помнить client_msg_id отправителя в Redis, сек
+}
+
+# Кэш токен -> пользователь для REST и WebSocket аутентификации
+AUTH_TOKEN_CACHE = {
+    'LOCAL_TTL': 30,  # LRU в памяти процесса, сек
+    'LOCAL_MAX_SIZE': 10000,
+    'REDIS_TTL': 300,
+}
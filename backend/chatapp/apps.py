@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChatappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chatapp"
+
+    def ready(self):
+        # Подключаем сигналы сброса кэшей собеседников и участников комнат и создания RoomMembership
+        from chatapp.services import membership, presence_fanout, send_message  # noqa: F401
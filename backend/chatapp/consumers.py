@@ -5,138 +5,172 @@ from channels.db import database_sync_to_async
 from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 from django.utils import timezone
-from rest_framework.authtoken.models import Token
 from .models import Room, Message, PrivateChatRoom, PrivateMessage
 from django.db.models import Q, Count
 import asyncio
 from typing import Dict, List, Any
 
-from .push_notifications import PushNotificationService
+from backend.logutils import preview
+
+from .services.presence import PresenceRegistry
+from .services.presence_fanout import broadcast_status
+from .services.room_presence import RoomPresence
+from .services.push_dispatch import dispatch_message_push
+from .services.outbound import OutboundQueue, SLOW_CONSUMER_CLOSE_CODE
+from .services import message_dedupe, rate_limit
+from .services.db import fetch_all, run_query
+from .services.frames import event_frame, room_message_frame, with_frame
+from .services.send_message import (
+    DuplicateClientMessage, RoomParticipantsCache, SendMessageError, client_frame, message_event, send_message
+)
+from .services.room_sync import resume_room
+from .services.ingest import enqueue_message, get_participants, ingest_enabled
+from .services.recent_messages import RecentMessages
+from .services.refresh import RefreshCoalescer
+from .services.chat_list import get_chat_list, format_chat_for_socket
+from .services.read_receipts import mark_message_read, mark_read_up_to
+from .services.membership import RoomMemberships
+from .services.media_blobs import InlineMediaTooLarge, inline_max_bytes, store_inline_blob
 
 logger = logging.getLogger('chatapp.consumers')
 
+# Отложенные объявления оффлайн: event loop хранит на задачи только слабые ссылки
+_offline_tasks = set()
 
-class GlobalConnectionTracker:
-    """
-    Глобальный трекер активных WebSocket соединений пользователей
-    В продакшене следует использовать Redis для масштабируемости
-    """
-    _connections = {}  # {user_id: set(channel_names)}
-
-    @classmethod
-    def add_connection(cls, user_id, channel_name, connection_type="unknown"):
-        """Добавляем соединение пользователя"""
-        if user_id not in cls._connections:
-            cls._connections[user_id] = set()
-        cls._connections[user_id].add(channel_name)
-        logger.info(f"🔌 [TRACKER] User {user_id} connected ({connection_type}). Active connections: {len(cls._connections[user_id])}")
-
-    @classmethod
-    def remove_connection(cls, user_id, channel_name, connection_type="unknown"):
-        """Удаляем соединение пользователя"""
-        if user_id in cls._connections:
-            cls._connections[user_id].discard(channel_name)
-            if not cls._connections[user_id]:  # Если у пользователя нет активных соединений
-                del cls._connections[user_id]
-                logger.info(f"🔌 [TRACKER] User {user_id} disconnected ({connection_type}). No active connections left.")
-                return True  # Пользователь полностью отключился
-            else:
-                logger.info(f"🔌 [TRACKER] User {user_id} disconnected ({connection_type}). Still has {len(cls._connections[user_id])} active connections.")
-                return False  # У пользователя еще есть активные соединения
-        return True  # Если пользователя не было в трекере, считаем что он отключился
-
-    @classmethod
-    def is_user_connected(cls, user_id):
-        """Проверяем, есть ли у пользователя активные соединения"""
-        return user_id in cls._connections and len(cls._connections[user_id]) > 0
-
-    @classmethod
-    def get_connection_count(cls, user_id):
-        """Получаем количество активных соединений пользователя"""
-        return len(cls._connections.get(user_id, set()))
 
 class BaseConsumerMixin:
     """Базовый миксин с общими методами для всех consumer'ов"""
 
-    @database_sync_to_async
-    def set_user_online(self, user_id):
-        """Устанавливаем статус пользователя онлайн в БД"""
+    def get_authenticated_user(self):
+        """
+        Пользователь, определенный HybridAuthMiddleware (токен или сессия).
+        Возвращает None для анонимного соединения.
+        """
+        user = self.scope.get('user')
+        if user is None or user.is_anonymous:
+            return None
+        return user
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        """
+        Текстовые кадры уходят клиенту через ограниченную очередь соединения.
+        coalesce_key - для кадров-снимков состояния: неотправленный кадр с тем же ключом заменяется новым.
+        """
+        if text_data is None or close:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+
+        outbound = getattr(self, 'outbound', None)
+        if outbound is None:
+            outbound = self.outbound = OutboundQueue(self.channel_name, self.send_frame, self.evict_slow_consumer)
+        await outbound.put(text_data, coalesce_key)
+
+    async def send_frame(self, text_data):
+        await super().send(text_data=text_data)
+
+    async def evict_slow_consumer(self, resync_hint):
+        """Клиент не успевает читать: сообщаем, что нужна полная синхронизация, и закрываем сокет"""
+        await super().send(text_data=resync_hint)
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        try:
+            await super().websocket_disconnect(message)
+        finally:
+            outbound = getattr(self, 'outbound', None)
+            if outbound is not None:
+                await outbound.release()
+
+    async def set_user_online(self, user_id):
+        """Статус онлайн: в Redis сразу, в БД - общей пакетной записью (PresenceRegistry.flush)"""
         try:
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-            user.is_online = 'online'
-            user.save(update_fields=['is_online'])
-            logger.info(f"User {user_id} set to online")
+            await PresenceRegistry.record_status(user_id, 'online')
+            logger.info("User %s set to online", user_id)
         except Exception as e:
             logger.error(f"Error setting user {user_id} online: {e}")
 
-    @database_sync_to_async
-    def set_user_offline(self, user_id):
-        """Устанавливаем статус пользователя оффлайн в БД"""
+    async def set_user_offline(self, user_id):
+        """Статус оффлайн и last_seen: в Redis сразу, в БД - общей пакетной записью"""
         try:
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-            user.is_online = 'offline'
-            user.last_seen = timezone.now()
-            user.save(update_fields=['is_online', 'last_seen'])
-            logger.info(f"User {user_id} set to offline")
+            await PresenceRegistry.record_status(user_id, 'offline')
+            logger.info("User %s set to offline", user_id)
         except Exception as e:
             logger.error(f"Error setting user {user_id} offline: {e}")
 
-    def add_user_connection(self, user_id, connection_type="unknown"):
-        """Регистрируем соединение пользователя"""
-        GlobalConnectionTracker.add_connection(user_id, self.channel_name, connection_type)
+    async def add_user_connection(self, user_id, connection_type="unknown"):
+        """
+        Регистрируем соединение пользователя в общем для всех воркеров реестре.
+        Возвращает True, если это первое активное соединение пользователя.
+        """
+        try:
+            return await PresenceRegistry.add_connection(user_id, self.channel_name, connection_type)
+        except Exception as e:
+            logger.error(f"Error registering connection for user {user_id}: {e}")
+            return False
 
     async def remove_user_connection(self, user_id, connection_type="unknown"):
         """Отменяем регистрацию соединения пользователя и проверяем нужно ли устанавливать статус оффлайн"""
-        user_fully_disconnected = GlobalConnectionTracker.remove_connection(user_id, self.channel_name, connection_type)
+        try:
+            user_fully_disconnected = await PresenceRegistry.remove_connection(
+                user_id, self.channel_name, connection_type
+            )
+        except Exception as e:
+            # Без реестра нельзя понять, остались ли соединения на других воркерах - статус не трогаем
+            logger.error(f"Error unregistering connection for user {user_id}: {e}")
+            return
 
         if user_fully_disconnected:
-            # Пользователь полностью отключился от всех WebSocket соединений
-            await self.set_user_offline(user_id)
-            await self.broadcast_user_status(user_id, 'offline')
-            logger.info(f"🔌 [TRACKER] User {user_id} fully disconnected - set to offline")
+            # Пользователь полностью отключился: оффлайн объявляем после паузы,
+            # чтобы при быстром переподключении статус у контактов не мигал
+            task = asyncio.get_running_loop().create_task(self.announce_offline_later(user_id))
+            _offline_tasks.add(task)
+            task.add_done_callback(_offline_tasks.discard)
         else:
-            logger.info(f"🔌 [TRACKER] User {user_id} still has active connections - keeping online")
+            logger.info("🔌 [PRESENCE] User %s still has active connections - keeping online", user_id)
 
-    async def broadcast_user_status(self, user_id, status):
-        """Отправляем обновление статуса всем заинтересованным пользователям"""
+    async def announce_online(self, user_id):
+        """Устанавливаем статус онлайн и рассылаем его, только если контакты видели пользователя оффлайн"""
         try:
-            chat_users = await self.get_chat_users(user_id)
-            for chat_user_id in chat_users:
-                await self.channel_layer.group_send(
-                    f'notifications_{chat_user_id}',
-                    {
-                        'type': 'user_status_update',
-                        'user_id': user_id,
-                        'status': status
-                    }
-                )
+            if not await PresenceRegistry.announce_status(user_id, 'online'):
+                logger.info("🔌 [PRESENCE] User %s reconnected within grace period - status unchanged", user_id)
+                return
         except Exception as e:
-            logger.error(f"Error broadcasting user status: {e}")
+            logger.error(f"Error announcing online status for user {user_id}: {e}")
 
-    @database_sync_to_async
-    def get_chat_users(self, user_id):
-        """Получаем список пользователей, с которыми есть чаты"""
-        try:
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
+        await self.set_user_online(user_id)
+        await self.broadcast_user_status(user_id, 'online')
 
-            chat_users = set()
+    async def announce_offline_later(self, user_id):
+        """Объявляем оффлайн, если за OFFLINE_GRACE секунд пользователь не переподключился"""
+        await asyncio.sleep(PresenceRegistry.offline_grace())
+        try:
+            if await PresenceRegistry.is_user_online(user_id):
+                logger.info("🔌 [PRESENCE] User %s reconnected within grace period - keeping online", user_id)
+                return
+            if not await PresenceRegistry.announce_status(user_id, 'offline'):
+                return
 
-            # Чаты, где пользователь является user1
-            rooms_as_user1 = PrivateChatRoom.objects.filter(user1=user).values_list('user2_id', flat=True)
-            chat_users.update(rooms_as_user1)
+            await self.set_user_offline(user_id)
+            await self.broadcast_user_status(user_id, 'offline')
+            logger.info("🔌 [PRESENCE] User %s fully disconnected - set to offline", user_id)
+        except Exception as e:
+            logger.error(f"Error announcing offline status for user {user_id}: {e}")
 
-            # Чаты, где пользователь является user2  
-            rooms_as_user2 = PrivateChatRoom.objects.filter(user2=user).values_list('user1_id', flat=True)
-            chat_users.update(rooms_as_user2)
+    async def apply_live_presence(self, chats):
+        """Статус собеседников в строках списка чатов берем из реестра соединений, а не из БД"""
+        online_users = await PresenceRegistry.get_online_users({chat['other_user']['id'] for chat in chats})
+        for chat in chats:
+            chat['other_user']['is_online'] = 'online' if chat['other_user']['id'] in online_users else 'offline'
+        return chats
 
-            return list(chat_users)
+    async def broadcast_user_status(self, user_id, status):
+        """Отправляем обновление статуса всем собеседникам (кэш контактов, параллельная рассылка)"""
+        try:
+            await broadcast_status(self.channel_layer, user_id, status)
         except Exception as e:
-            logger.error(f"Error getting chat users: {e}")
-            return []
+            logger.error(f"Error broadcasting user status: {e}")
 
 
 class ChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
@@ -147,6 +181,7 @@ class ChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
         self.room = None
         self.user = None
         self.user_inbox = None
+        self.presence_joined = False
 
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
@@ -170,28 +205,27 @@ class ChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
 
         await self.accept()
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_join',
-                'user': self.user.username
-            }
-        )
+        # Присутствие - в Redis, о входе остальные узнают из общей сводки раз в секунду
+        online_count = await RoomPresence.join(self.room.id, self.room_name, self.user.username, self.channel_name)
+        self.presence_joined = True
+        await self.send(text_data=json.dumps({
+            'type': 'user_list',
+            'users': await RoomPresence.members(self.room.id),
+            'online_count': online_count
+        }))
 
-    @database_sync_to_async
-    def get_room(self, room_name):
-        return Room.objects.get(name=room_name)
+    async def get_room(self, room_name):
+        return await run_query(Room.objects.all(), 'get', name=room_name)
 
     async def disconnect(self, close_code):
-        if self.room_group_name:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_leave',
-                    'user': self.user.username if self.user else 'Unknown'
-                }
-            )
+        if self.presence_joined:
+            self.presence_joined = False
+            try:
+                await RoomPresence.leave(self.room.id, self.room_name, self.user.username, self.channel_name)
+            except Exception as e:
+                logger.error(f"👥 [ROOM-PRESENCE] Error leaving room {self.room_name}: {e}")
 
+        if self.room_group_name:
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
@@ -208,12 +242,12 @@ class ChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
 
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {
+                    with_frame({
                         'type': 'chat_message',
                         'message': message,
                         'username': username,
                         'timestamp': timezone.now().isoformat()
-                    }
+                    }, room_message_frame)
                 )
         except Exception as e:
             logger.error(f"Error in receive: {e}")
@@ -228,103 +262,133 @@ class ChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
         )
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'username': event['username'],
-            'timestamp': event['timestamp']
-        }))
-
-    async def user_join(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_join',
-            'user': event['user']
-        }))
+        await self.send(text_data=event_frame(event, room_message_frame))
 
-    async def user_leave(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_leave',
-            'user': event['user']
-        }))
+    async def presence_summary(self, event):
+        """Сводка входов и выходов за интервал: одно событие вместо события на каждое соединение"""
+        await self.send(text_data=event_frame(event))
 
 class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
-    # Глобальный трекинг активных пользователей (в реальном приложении используйте Redis)
-    connected_users = set()
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.room_name = None
+        self.room_id = None
         self.user = None
 
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'private_{self.room_name}'
 
-        token = None
-        query_string = self.scope.get('query_string', b'').decode()
-        if 'token=' in query_string:
-            token = query_string.split('token=')[1]
+        self.user = self.get_authenticated_user()
+        if self.user is None:
+            await self.close()
+            return
 
-        if token:
-            try:
-                token_obj = await database_sync_to_async(Token.objects.select_related('user').get)(key=token)
-                self.user = token_obj.user
-            except Token.DoesNotExist:
-                await self.close()
-                return
-        else:
-            self.user = self.scope.get('user')
-            if isinstance(self.user, AnonymousUser):
-                await self.close()
-                return
+        # Регистрируем соединение пользователя
+        await self.add_user_connection(self.user.id, "PrivateChatConsumer")
+
+        await self.accept()
+        await self.open_stream()
+
+    async def open_stream(self):
+        """
+        Подписка на комнату. Вызывается из connect и из MultiplexConsumer,
+        когда клиент подписывается на комнату внутри общего соединения.
+        """
+        self.room_id = int(self.room_name)
+
+        # Без проверки любой пользователь получал бы события и историю чужой комнаты
+        if not await self.is_participant():
+            logger.warning("🚫 [CONSUMER] User %s is not a participant of room %s", self.user.id, self.room_id)
+            await self.close()
+            return
+
+        self.room_group_name = f'private_{self.room_name}'
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
-        # Добавляем пользователя в список активных и регистрируем соединение
-        PrivateChatConsumer.connected_users.add(self.user.id)
-        self.add_user_connection(self.user.id, "PrivateChatConsumer")
-
-        await self.accept()
+        # Помечаем сообщения как прочитанные одним UPDATE и рассылаем одно событие
+        await self.apply_read_receipt()
 
-        # Помечаем сообщения как прочитанные и обновляем счетчики
-        messages_updated = await self.mark_messages_as_read()
-        if messages_updated:
-            # Отправляем обновления счетчиков уведомлений
-            await self.send_notification_updates()
-            # Отправляем обновления списка чатов
-            await self.send_chat_list_updates()
+        await self.send_recent_messages()
 
-    @database_sync_to_async
-    def mark_messages_as_read(self):
+    async def send_recent_messages(self):
+        """
+        Кадр recent_messages: последние сообщения комнаты из RecentMessages (первая страница истории).
+        При собранном списке обходится без запросов к БД; если списка не хватает, кадр не отправляется
+        и клиент загружает историю через chat_history.
+        """
         try:
-            room = PrivateChatRoom.objects.get(id=int(self.room_name))
-            unread_messages = PrivateMessage.objects.filter(
-                room=room,
-                recipient=self.user,
-                read=False
+            if not await self.is_participant():
+                return
+            # При промахе список собирается из БД
+            result = await database_sync_to_async(RecentMessages.page)(
+                self.room_id, self.user.id, RecentMessages.handshake_limit()
             )
-            unread_count = unread_messages.count()
+        except Exception as e:
+            logger.error(f"🗂️ [RECENT] Error loading recent messages for room {self.room_id}: {e}")
+            return
 
-            if unread_count > 0:
-                unread_messages.update(read=True)
-                logger.info(f"Marked {unread_count} messages as read for user {self.user.id} in room {self.room_name}")
-                return True  # Возвращаем True, если были обновления
-            return False
-        except PrivateChatRoom.DoesNotExist:
-            logger.error(f"Room {self.room_name} does not exist")
-            return False
+        if result is None:
+            return
+        messages, has_more = result
+        await self.send(text_data=json.dumps({
+            'type': 'recent_messages',
+            'room_id': self.room_id,
+            'messages': messages,
+            'has_more': has_more
+        }))
+
+    async def is_participant(self):
+        participants = await get_participants(self.room_id)
+        return participants is not None and self.user.id in participants
+
+    async def apply_read_receipt(self, up_to_message_id=None):
+        """
+        Помечаем прочитанными все сообщения комнаты до up_to_message_id (None - все)
+        и рассылаем результат: одно событие messages_read_by_recipient в комнату,
+        дельты счетчиков уведомлений читателю и строку списка чатов участникам.
+        """
+        try:
+            receipt = await database_sync_to_async(mark_read_up_to)(self.room_id, self.user.id, up_to_message_id)
         except Exception as e:
-            logger.error(f"Error marking messages as read: {e}")
-            return False
+            logger.error(f"📖 [READ-RECEIPT] ❌ Error marking messages as read: {e}")
+            return None
+
+        if not receipt:
+            return None
+
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            with_frame({
+                'type': 'messages_read_by_recipient',
+                'message_ids': receipt['message_ids'],
+                'up_to_message_id': receipt['up_to_message_id'],
+                'read_at': receipt['read_at'].isoformat(),
+                'read_by_user_id': self.user.id,
+                'room_id': self.room_id
+            })
+        )
+
+        # Уменьшаем счетчики уведомлений читателя
+        for sender_id, count in receipt['read_counts'].items():
+            await self.send_read_delta(sender_id, count)
+
+        # Обновляем строку комнаты в списке чатов у обоих участников
+        await self.notify_chat_list_update([self.user.id, *receipt['read_counts']])
+        return receipt
 
     async def disconnect(self, close_code):
-        # Удаляем пользователя из списка активных и отменяем регистрацию соединения
+        # Отменяем регистрацию соединения
         if hasattr(self, 'user') and self.user:
-            PrivateChatConsumer.connected_users.discard(self.user.id)
             await self.remove_user_connection(self.user.id, "PrivateChatConsumer")
 
+        await self.close_stream()
+
+    async def close_stream(self):
+        """Отписка от комнаты"""
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(
                 self.room_group_name,
@@ -336,7 +400,13 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
             data = json.loads(text_data)
             message_type = data.get('type', 'chat_message')
 
-            logger.info(f"📡 [CONSUMER] Received message type: {message_type}")
+            logger.debug("📡 [CONSUMER] Received message type: %s", message_type)
+
+            # Каждый тип кадра списывается из своего бюджета пользователя, общего для всех воркеров
+            rejection = await rate_limit.consume(self.user.id, message_type)
+            if rejection:
+                await self.send(text_data=json.dumps(rejection))
+                return
 
             if message_type == 'chat_message':
                 await self.handle_text_message(data)
@@ -348,6 +418,8 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
                 await self.handle_mark_multiple_as_read(data)
             elif message_type == 'messages_deleted_notification':
                 await self.handle_message_deletion_notification(data)
+            elif message_type == 'resume':
+                await self.handle_resume(data)
             else:
                 logger.warning(f"Unknown message type: {message_type}")
 
@@ -359,8 +431,6 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
     async def handle_text_message(self, data):
         """Обработка обычных текстовых сообщений"""
         message_content = data.get('message', '')
-        user1_id = data.get('user1')
-        user2_id = data.get('user2')
 
         # ИСПРАВЛЕНИЕ: Данные для реплая - обрабатываем все возможные варианты полей
         reply_to_message_id = data.get('reply_to_message_id')
@@ -368,50 +438,68 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
         reply_to_message_text = data.get('reply_to_message') or data.get('reply_to_message_text')
         reply_to_sender_name = data.get('reply_to_sender') or data.get('reply_to_sender_name')
         reply_to_media_type = data.get('reply_to_media_type')
+        client_msg_id = message_dedupe.clean_client_msg_id(data.get('client_msg_id'))
 
-        # Определяем получателя (тот, кто не является отправителем)
-        recipient_id = user2_id if user1_id == self.user.id else user1_id
-
-        logger.info(f"Processing text message: sender={self.user.id}, recipient={recipient_id}, message='{message_content[:50]}'")
+        # Получатель - второй участник комнаты, его определяет send_message
+        logger.debug("Processing text message: sender=%s, room=%s, message='%s'", self.user.id, self.room_id, preview(message_content))
 
         if reply_to_message_id:
-            logger.info(f"Text message is reply to: {reply_to_message_id}, text='{reply_to_message_text[:30] if reply_to_message_text else 'empty'}', sender={reply_to_sender_name}")
-
-        if message_content and recipient_id:
-            try:
-                recipient = await database_sync_to_async(get_user_model().objects.get)(id=recipient_id)
-                room = await self.get_or_create_room_by_users(self.user, recipient)
+            logger.debug("Text message is reply to: %s, text='%s', sender=%s",
+                         reply_to_message_id, preview(reply_to_message_text, 30), reply_to_sender_name)
 
-                message_instance = await self.save_message(
-                    self.user, message_content, room, 
-                    media_type='text',
-                    reply_to_message_id=reply_to_message_id,
-                    reply_to_message_text=reply_to_message_text,
-                    reply_to_sender_name=reply_to_sender_name,
-                    reply_to_media_type=reply_to_media_type
-                )
-
-                if message_instance:
-                    await self.broadcast_message(message_instance, recipient_id, room)
+        if message_content:
+            if await self.is_repeated_send(client_msg_id):
+                return
 
-            except get_user_model().DoesNotExist:
-                await self.send(text_data=json.dumps({'error': 'Recipient not found'}))
+            saved = False
+            try:
+                reply = {
+                    'reply_to_message_id': reply_to_message_id,
+                    'reply_to_message_text': reply_to_message_text,
+                    'reply_to_sender_name': reply_to_sender_name,
+                    'reply_to_media_type': reply_to_media_type,
+                }
+                if ingest_enabled():
+                    # Write-behind: сообщение в Redis stream, строку в БД запишет chat_ingest_worker
+                    message_instance, _ = await enqueue_message(
+                        self.user, self.room_id, message_content, client_msg_id=client_msg_id, **reply
+                    )
+                    saved = True
+                    await self.remember_client_msg_id(client_msg_id, message_instance.id)
+                    await self.broadcast_message(message_instance, message_event(message_instance, self.user), persisted=False)
+                else:
+                    # Проверка участника, реплай и INSERT - одна транзакция в одном переходе в поток БД
+                    message_instance, event = await database_sync_to_async(send_message)(
+                        self.user, self.room_id, message_content, client_msg_id=client_msg_id, **reply
+                    )
+                    saved = True
+                    await self.remember_client_msg_id(client_msg_id, message_instance.id)
+                    await self.broadcast_message(message_instance, event)
+
+            except DuplicateClientMessage as e:
+                await self.remember_client_msg_id(client_msg_id, e.message_id)
+                await self.send_message_ack(client_msg_id, e.message_id)
+            except SendMessageError as e:
+                await self.release_client_msg_id(client_msg_id)
+                await self.send(text_data=json.dumps({'error': str(e)}))
             except Exception as e:
                 logger.error(f"Error processing text message: {e}")
+                if not saved:
+                    await self.release_client_msg_id(client_msg_id)
                 await self.send(text_data=json.dumps({'error': 'Failed to send message'}))
 
     async def handle_media_message(self, data):
         """Обработка медиа-сообщений (изображения, видео, документы)"""
-        logger.info(f"📷 [CONSUMER] Processing media message")
+        logger.debug("📷 [CONSUMER] Processing media message")
 
         message_content = data.get('message', '')
-        user1_id = data.get('user1')
-        user2_id = data.get('user2')
         media_type = data.get('mediaType')
         media_hash = data.get('mediaHash')
         media_filename = data.get('mediaFileName')
         media_size = data.get('mediaSize')
         media_base64 = data.get('mediaBase64')
+        # Ссылка на файл, уже загруженный через media_api
+        media_file_id = data.get('mediaFileId')
 
         # ИСПРАВЛЕНИЕ: Данные для реплая - обрабатываем все возможные варианты полей
         reply_to_message_id = data.get('reply_to_message_id')
@@ -419,64 +507,104 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
         reply_to_message_text = data.get('reply_to_message') or data.get('reply_to_message_text')
         reply_to_sender_name = data.get('reply_to_sender') or data.get('reply_to_sender_name')
         reply_to_media_type = data.get('reply_to_media_type')
+        client_msg_id = message_dedupe.clean_client_msg_id(data.get('client_msg_id'))
 
-        # Определяем получателя
-        recipient_id = user2_id if user1_id == self.user.id else user1_id
-
-        logger.info(f"📷 [CONSUMER] Media message details: type={media_type}, hash={media_hash}, size={media_size}, filename={media_filename}")
+        logger.debug("📷 [CONSUMER] Media message details: type=%s, hash=%s, size=%s, filename=%s",
+                     media_type, media_hash, media_size, media_filename)
 
         if reply_to_message_id:
-            logger.info(f"📷 [CONSUMER] Media message is reply to: {reply_to_message_id}, text='{reply_to_message_text[:30] if reply_to_message_text else 'empty'}', sender={reply_to_sender_name}")
+            logger.debug("📷 [CONSUMER] Media message is reply to: %s, text='%s', sender=%s",
+                         reply_to_message_id, preview(reply_to_message_text, 30), reply_to_sender_name)
 
-        if media_type and media_hash and recipient_id:
-            try:
-                recipient = await database_sync_to_async(get_user_model().objects.get)(id=recipient_id)
-                room = await self.get_or_create_room_by_users(self.user, recipient)
+        if media_type and media_hash:
+            if await self.is_repeated_send(client_msg_id):
+                return
 
-                # Сохраняем медиа-сообщение с метаданными
-                message_instance = await self.save_message(
-                    self.user, message_content, room,
+            saved = False
+            try:
+                # Сохраняем медиа-сообщение с метаданными одной транзакцией
+                message_instance, event = await database_sync_to_async(send_message)(
+                    self.user, self.room_id, message_content,
                     media_type=media_type,
                     media_hash=media_hash,
                     media_filename=media_filename,
                     media_size=media_size,
+                    media_file_id=media_file_id,
                     reply_to_message_id=reply_to_message_id,
                     reply_to_message_text=reply_to_message_text,
                     reply_to_sender_name=reply_to_sender_name,
-                    reply_to_media_type=reply_to_media_type
+                    reply_to_media_type=reply_to_media_type,
+                    client_msg_id=client_msg_id
                 )
+                saved = True
+                await self.remember_client_msg_id(client_msg_id, message_instance.id)
 
-                if message_instance:
-                    # Отправляем сообщение включая base64 данные для получателя
-                    await self.broadcast_media_message(
-                        message_instance, recipient_id, room, media_base64
-                    )
+                # base64 кладем в Redis один раз, получатели получают только ссылку
+                inline_blob_id = None
+                if media_base64:
+                    inline_blob_id = await self.store_media_inline(message_instance, media_base64)
 
-                logger.info(f"📷 [CONSUMER] ✅ Media message processed successfully")
+                await self.broadcast_media_message(message_instance, event, inline_blob_id)
 
-            except get_user_model().DoesNotExist:
-                logger.error(f"📷 [CONSUMER] ❌ Recipient not found: {recipient_id}")
-                await self.send(text_data=json.dumps({'error': 'Recipient not found'}))
+                logger.debug("📷 [CONSUMER] ✅ Media message processed successfully")
+
+            except DuplicateClientMessage as e:
+                await self.remember_client_msg_id(client_msg_id, e.message_id)
+                await self.send_message_ack(client_msg_id, e.message_id)
+            except SendMessageError as e:
+                logger.error(f"📷 [CONSUMER] ❌ {e}: user {self.user.id}, room {self.room_id}")
+                await self.release_client_msg_id(client_msg_id)
+                await self.send(text_data=json.dumps({'error': str(e)}))
             except Exception as e:
                 logger.error(f"📷 [CONSUMER] ❌ Error processing media message: {e}")
+                if not saved:
+                    await self.release_client_msg_id(client_msg_id)
                 await self.send(text_data=json.dumps({'error': 'Failed to send media message'}))
         else:
             logger.error(f"📷 [CONSUMER] ❌ Missing required media data")
             await self.send(text_data=json.dumps({'error': 'Missing media data'}))
 
+    async def is_repeated_send(self, client_msg_id):
+        """
+        Повторная отправка клиентом уже принятого сообщения (тот же client_msg_id).
+        Такой кадр не сохраняется, не рассылается и не порождает push - клиент получает message_ack
+        с id исходного сообщения (или pending, если оно еще сохраняется).
+        """
+        if not client_msg_id:
+            return False
+        existing = await message_dedupe.claim(self.user.id, client_msg_id)
+        if existing is None:
+            return False
+        logger.debug("🔁 [DEDUPE] Repeated client_msg_id %s from user %s: %s", client_msg_id, self.user.id, existing)
+        await self.send_message_ack(client_msg_id, existing)
+        return True
+
+    async def remember_client_msg_id(self, client_msg_id, message_id):
+        if client_msg_id:
+            await message_dedupe.remember(self.user.id, client_msg_id, message_id)
+
+    async def release_client_msg_id(self, client_msg_id):
+        if client_msg_id:
+            await message_dedupe.release(self.user.id, client_msg_id)
+
+    async def send_message_ack(self, client_msg_id, message_id):
+        frame = {'type': 'message_ack', 'client_msg_id': client_msg_id, 'room_id': self.room_id}
+        if message_id == message_dedupe.PENDING:
+            frame['status'] = 'pending'
+        else:
+            frame.update({'status': 'duplicate', 'id': message_id})
+        await self.send(text_data=json.dumps(frame))
+
     async def handle_mark_as_read(self, data):
         """Обработка пометки сообщения как прочитанного"""
         message_id = data.get('message_id')
         room_id = data.get('room_id')
         user_id = data.get('user_id')
 
-        logger.info(f"📖 [READ-RECEIPT] ========== PROCESSING READ RECEIPT ==========")
-        logger.info(f"📖 [READ-RECEIPT] Message ID: {message_id}")
-        logger.info(f"📖 [READ-RECEIPT] Room ID: {room_id}")
-        logger.info(f"📖 [READ-RECEIPT] User ID: {user_id}")
+        logger.debug("📖 [READ-RECEIPT] Processing read receipt: message=%s, room=%s, user=%s", message_id, room_id, user_id)
 
         if not message_id or not user_id:
-            logger.error(f"📖 [READ-RECEIPT] ❌ Missing required data")
+            logger.error("📖 [READ-RECEIPT] ❌ Missing required data")
             await self.send(text_data=json.dumps({
                 'type': 'read_receipt_confirmation',
                 'success': False,
@@ -486,10 +614,10 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
 
         try:
             # Помечаем сообщение как прочитанное в БД
-            success, sender_id = await self.mark_message_as_read_in_db(message_id, user_id)
+            success, sender_id, newly_read = await self.mark_message_as_read_in_db(message_id, user_id)
 
             if success:
-                logger.info(f"📖 [READ-RECEIPT] ✅ Message {message_id} marked as read")
+                logger.debug("📖 [READ-RECEIPT] ✅ Message %s marked as read", message_id)
 
                 # Отправляем подтверждение текущему пользователю
                 await self.send(text_data=json.dumps({
@@ -502,28 +630,32 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
                 if sender_id:
                     await self.channel_layer.group_send(
                         self.room_group_name,
-                        {
+                        with_frame({
                             'type': 'message_read_notification',
                             'message_id': message_id,
-                            'reader_id': user_id
-                        }
+                            'reader_id': user_id,
+                            'room_id': self.room_id
+                        })
                     )
 
                     # Отправляем обновление статуса сообщения
                     await self.channel_layer.group_send(
                         self.room_group_name,
-                        {
+                        with_frame({
                             'type': 'message_status_update',
                             'message_id': message_id,
                             'read': True,
-                            'read_by_user_id': user_id
-                        }
+                            'read_by_user_id': user_id,
+                            'room_id': self.room_id
+                        })
                     )
 
-                    # Также отправляем обновление счетчиков уведомлений
-                    await self.send_notification_updates_for_read(sender_id)
+                    # Уменьшаем счетчик уведомлений читателя и непрочитанные в списке чатов
+                    if newly_read:
+                        await self.send_read_delta(sender_id, 1)
+                        await self.notify_chat_list_update([self.user.id, sender_id])
 
-                    logger.info(f"📖 [READ-RECEIPT] ✅ Notified sender {sender_id}")
+                    logger.debug("📖 [READ-RECEIPT] ✅ Notified sender %s", sender_id)
             else:
                 logger.warning(f"📖 [READ-RECEIPT] ⚠️ Failed to mark message as read")
                 await self.send(text_data=json.dumps({
@@ -542,105 +674,70 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
                 'error': str(e)
             }))
 
-    async def broadcast_message(self, message_instance, recipient_id, room):
-        """Отправка обычного сообщения всем участникам"""
-        timestamp = message_instance.timestamp.isoformat()
-
-        # Подготавливаем данные сообщения
-        message_data = {
-            'type': 'chat_message',
-            'message': message_instance.message,
-            'sender__username': self.user.username,
-            'sender_id': self.user.id,
-            'recipient_id': recipient_id,
-            'timestamp': int(message_instance.timestamp.timestamp()),
-            'id': message_instance.id,
-            'read': message_instance.read
-        }
-
-        # Добавляем данные реплая если есть
-        if message_instance.reply_to_message:
-            message_data.update({
-                'reply_to_message_id': message_instance.reply_to_message.id,
-                'reply_to_message_text': message_instance.reply_to_message_text,
-                'reply_to_sender_name': message_instance.reply_to_sender_name,
-                'reply_to_media_type': message_instance.reply_to_media_type
-            })
+    async def broadcast_message(self, message_instance, event, persisted=True):
+        """
+        Отправка обычного сообщения всем участникам.
+        persisted=False - сообщение еще в очереди write-behind: строку списка чатов
+        обновит chat_ingest_worker после записи в БД.
+        """
+        recipient_id = event['recipient_id']
 
-        # Отправляем сообщение в группу чата
-        await self.channel_layer.group_send(self.room_group_name, message_data)
+        # Событие уже собрано send_message, дополнительных запросов не нужно.
+        # Кадр клиента кодируем здесь один раз, получатели пересылают его как есть
+        await self.channel_layer.group_send(self.room_group_name, with_frame(event, client_frame))
 
         # Отправляем уведомление получателю
-        await self.channel_layer.group_send(
-            f'notifications_{recipient_id}',
-            {
-                'type': 'new_message_notification',
-                'sender_id': self.user.id,
-                'sender_name': self.user.username,
-                'recipient_id': recipient_id,
-                'message': message_instance.message,
-                'timestamp': timestamp,
-                'room_id': room.id
-            }
-        )
+        await self.send_new_message_delta(message_instance, recipient_id)
 
         # Обновляем список чатов для обоих пользователей
-        await self.notify_chat_list_update([self.user.id, recipient_id])
+        if persisted:
+            await self.notify_chat_list_update([self.user.id, recipient_id])
 
         # Отправляем push-уведомление
         await self.send_push_notification_if_needed(message_instance)
 
-    async def broadcast_media_message(self, message_instance, recipient_id, room, media_base64):
+    async def store_media_inline(self, message_instance, media_base64):
+        """
+        Сохраняем inline base64 во временное хранилище.
+        Слишком большие данные не принимаем: получатель загрузит файл по mediaUrl.
+        """
+        try:
+            return await store_inline_blob(
+                media_base64, self.room_id,
+                mime_type=message_instance.media_file.mime_type if message_instance.media_file else None,
+                filename=message_instance.media_filename
+            )
+        except InlineMediaTooLarge as e:
+            logger.warning(f"📷 [CONSUMER] ⚠️ Inline media rejected for message {message_instance.id}: {e}")
+            await self.send(text_data=json.dumps({
+                'type': 'media_inline_rejected',
+                'message_id': message_instance.id,
+                'mediaHash': message_instance.media_hash,
+                'max_size': inline_max_bytes()
+            }))
+        except Exception as e:
+            logger.error(f"📷 [CONSUMER] ❌ Error storing inline media: {e}")
+        return None
+
+    async def broadcast_media_message(self, message_instance, event, inline_blob_id=None):
         """Отправка медиа-сообщения всем участникам"""
-        timestamp = message_instance.timestamp.isoformat()
-
-        logger.info(f"📷 [CONSUMER] Broadcasting media message with hash: {message_instance.media_hash}")
-
-        # Отправляем сообщение в группу чата с медиа-данными
-        message_data = {
-            'type': 'chat_message',
-            'message': message_instance.message,
-            'sender__username': self.user.username,
-            'sender_id': self.user.id,
-            'recipient_id': recipient_id,
-            'timestamp': int(message_instance.timestamp.timestamp()),
-            'id': message_instance.id,
-            'mediaType': message_instance.media_type,
-            'mediaHash': message_instance.media_hash,
-            'mediaFileName': message_instance.media_filename,
-            'mediaSize': message_instance.media_size,
-            'read': message_instance.read
-        }
-
-        # Добавляем данные реплая если есть
-        if message_instance.reply_to_message:
-            message_data.update({
-                'reply_to_message_id': message_instance.reply_to_message.id,
-                'reply_to_message_text': message_instance.reply_to_message_text,
-                'reply_to_sender_name': message_instance.reply_to_sender_name,
-                'reply_to_media_type': message_instance.reply_to_media_type
+        logger.debug("📷 [CONSUMER] Broadcasting media message with hash: %s", message_instance.media_hash)
+        recipient_id = event['recipient_id']
+
+        # Вместо base64 передаем ссылку: через channel layer идут только метаданные
+        if inline_blob_id:
+            event.update({
+                'mediaInlineId': inline_blob_id,
+                'mediaInlineUrl': reverse('chat:inline_media', args=[inline_blob_id]),
             })
 
-        # Добавляем base64 данные если есть
-        if media_base64:
-            message_data['mediaBase64'] = media_base64
-            logger.info(f"📷 [CONSUMER] Including base64 data in broadcast")
+        await self.channel_layer.group_send(self.room_group_name, with_frame(event, client_frame))
 
-        await self.channel_layer.group_send(self.room_group_name, message_data)
+        # Прогреваем кэш URL, который клиенты запрашивают через media_api
+        await self.prefetch_media_url_to_cache(message_instance)
 
         # Отправляем уведомление получателю
-        await self.channel_layer.group_send(
-            f'notifications_{recipient_id}',
-            {
-                'type': 'new_message_notification',
-                'sender_id': self.user.id,
-                'sender_name': self.user.username,
-                'recipient_id': recipient_id,
-                'message': message_instance.message,
-                'timestamp': timestamp,
-                'room_id': room.id
-            }
-        )
+        await self.send_new_message_delta(message_instance, recipient_id)
 
         # Обновляем список чатов для обоих пользователей
         await self.notify_chat_list_update([self.user.id, recipient_id])
@@ -649,341 +746,145 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
         await self.send_push_notification_if_needed(message_instance)
 
     async def chat_message(self, event):
-        message = event['message']
-        sender = event.get('sender__username', event.get('sender', 'Unknown'))
-        timestamp = event['timestamp']
-        message_id = event.get('id', event.get('message_id'))
-        sender_id = event.get('sender_id')
-        read_status = event.get('read', False)
-
-        # Медиа данные
-        media_type = event.get('mediaType')
-        media_hash = event.get('mediaHash')
-        media_filename = event.get('mediaFileName')
-        media_size = event.get('mediaSize')
-        media_base64 = event.get('mediaBase64')
-
-        # Данные реплая
-        reply_to_message_id = event.get('reply_to_message_id')
-        reply_to_message_text = event.get('reply_to_message_text')
-        reply_to_sender_name = event.get('reply_to_sender_name')
-        reply_to_media_type = event.get('reply_to_media_type')
-
-        if media_type:
-            logger.info(f"📡 [SEND] Sending media message to client: type={media_type}, hash={media_hash}")
+        if event.get('mediaType'):
+            logger.debug("📡 [SEND] Sending media message to client: type=%s, hash=%s", event['mediaType'], event.get('mediaHash'))
         else:
-            logger.info(f"📡 [SEND] Sending text message to client: sender={sender}, message='{message[:50] if message else 'empty'}'")
-
-        if reply_to_message_id:
-            logger.info(f"📡 [SEND] Message is reply to: {reply_to_message_id}, text='{reply_to_message_text[:30] if reply_to_message_text else 'empty'}', sender={reply_to_sender_name}")
-
-        # Базовые данные сообщения
-        response_data = {
-            'message': message,
-            'sender__username': sender,
-            'timestamp': timestamp,
-            'id': message_id,
-            'sender_id': sender_id,
-            'read': read_status
-        }
-
-        # ИСПРАВЛЕНИЕ: Добавляем данные реплая с правильными названиями полей для фронтенда
-        if reply_to_message_id:
-            response_data.update({
-                'reply_to_message_id': reply_to_message_id,
-                'reply_to_message': reply_to_message_text,  # ИСПРАВЛЕНО: правильное поле
-                'reply_to_sender': reply_to_sender_name,    # ИСПРАВЛЕНО: правильное поле
-                'reply_to_media_type': reply_to_media_type
-            })
-            logger.info(f"📡 [SEND] Added reply data to response: id={reply_to_message_id}, text='{reply_to_message_text[:30] if reply_to_message_text else 'empty'}'")
-
-        # Добавляем медиа данные если есть
-        if media_type and media_hash:
-            response_data.update({
-                'mediaType': media_type,
-                'mediaHash': media_hash,
-                'mediaFileName': media_filename,
-                'mediaSize': media_size
-            })
-
-            # Добавляем base64 данные если есть
-            if media_base64:
-                response_data['mediaBase64'] = media_base64
-                logger.info(f"📡 [SEND] Including base64 data in client response")
+            logger.debug("📡 [SEND] Sending text message to client: sender=%s, message='%s'",
+                         event.get('sender__username'), preview(event.get('message')))
 
-        await self.send(text_data=json.dumps(response_data))
+        await self.send(text_data=event_frame(event, client_frame))
 
-    @database_sync_to_async
-    def save_message(self, sender, message_content, room, media_type='text', 
-                    media_hash=None, media_filename=None, media_size=None,
-                    reply_to_message_id=None, reply_to_message_text=None, 
-                    reply_to_sender_name=None, reply_to_media_type=None):
-        try:
-            from media_api.models import UploadedFile
-
-            recipient = room.user2 if room.user1 == sender else room.user1
-
-            logger.info(f"💾 [DB] Saving message: type={media_type}, hash={media_hash}")
-
-            # Логируем информацию о реплае если есть
-            if reply_to_message_id:
-                logger.info(f"💾 [DB] Reply to message: id={reply_to_message_id}, sender={reply_to_sender_name}")
-
-            # Ищем медиафайл по hash если это медиа-сообщение
-            media_file = None
-            if media_type in ['image', 'video', 'audio', 'document', 'other'] and media_hash:
-                try:
-                    # ВАЖНО: для документов используем время загрузки (последний загруженный файл)
-                    from datetime import timedelta
-
-                    # Для документов ищем по расширенному временному окну
-                    time_window = timedelta(minutes=30)
-                    message_time = timezone.now()
-                    start_time = message_time - time_window
-
-                    # Поиск файла по типу и отправителю в временном окне
-                    potential_files = UploadedFile.objects.filter(
-                        user=sender,
-                        file_type=media_type,
-                        uploaded_at__gte=start_time,
-                        uploaded_at__lte=message_time + timedelta(minutes=1)  # Небольшой запас
-                    ).order_by('-uploaded_at')
-
-                    if potential_files.exists():
-                        media_file = potential_files.first()
-                        logger.info(f"💾 [DB] Found media_file: {media_file.id} (type={media_type}) for hash {media_hash}")
-                        logger.info(f"💾 [DB] File details: name={media_file.original_name}, size={media_file.file_size}")
-                    else:
-                        logger.warning(f"💾 [DB] Media file not found for hash {media_hash}, type={media_type}, sender={sender.id}")
-                        logger.warning(f"💾 [DB] Search window: {start_time} to {message_time}")
-                except Exception as file_error:
-                    logger.error(f"💾 [DB] Error finding media file: {file_error}")
-
-            # Ищем исходное сообщение для реплая
-            reply_to_message_obj = None
-            if reply_to_message_id:
-                try:
-                    reply_to_message_obj = PrivateMessage.objects.get(id=reply_to_message_id)
-                    logger.info(f"💾 [DB] Found reply_to message: {reply_to_message_obj.id}")
-                except PrivateMessage.DoesNotExist:
-                    logger.warning(f"💾 [DB] Reply_to message {reply_to_message_id} not found")
-
-            message = PrivateMessage.objects.create(
-                room=room,
-                sender=sender,
-                recipient=recipient,
-                message=message_content,
-                timestamp=timezone.now(),
-                media_type=media_type,
-                media_hash=media_hash,
-                media_filename=media_filename,
-                media_size=media_size,
-                media_file=media_file,
-                # Поля для реплаев
-                reply_to_message=reply_to_message_obj,
-                reply_to_message_text=reply_to_message_text,
-                reply_to_sender_name=reply_to_sender_name,
-                reply_to_media_type=reply_to_media_type,
-                is_deleted=False  # Явно указываем значение
-            )
-
-            logger.info(f"💾 [DB] ✅ Message saved with ID: {message.id}, media_file: {media_file.id if media_file else None}, reply_to: {reply_to_message_id}")
-            return message
-        except Exception as e:
-            logger.error(f"💾 [DB] ❌ Error saving message: {e}")
-            return None
-
-    @database_sync_to_async
-    def mark_message_as_read_in_db(self, message_id, reader_id):
+    async def mark_message_as_read_in_db(self, message_id, reader_id):
         """
         Помечаем сообщение как прочитанное в базе данных
-        Возвращает (success: bool, sender_id: int)
+        Возвращает (success: bool, sender_id: int, newly_read: bool)
         """
         try:
-            message = PrivateMessage.objects.select_related('sender').get(id=message_id)
+            message = await run_query(
+                PrivateMessage.objects.values('recipient_id', 'sender_id', 'read', 'room_id'), 'get', id=message_id
+            )
 
             # Проверяем, что читатель - это получатель сообщения
-            if message.recipient_id != reader_id:
+            if message['recipient_id'] != reader_id:
                 logger.warning(f"📖 [DB] User {reader_id} is not recipient of message {message_id}")
-                return False, None
-
-            # Если уже прочитано, не обновляем
-            if message.read:
-                logger.info(f"📖 [DB] Message {message_id} already read")
-                return True, message.sender_id
+                return False, None, False
 
-            # Помечаем как прочитанное
-            message.read = True
-            message.read_at = timezone.now()
-            message.save(update_fields=['read', 'read_at'])
+            # Помечаем как прочитанное вместе со счетчиком непрочитанных комнаты
+            updated = await database_sync_to_async(mark_message_read)(message_id, message['room_id'], reader_id)
+            if not updated:
+                logger.debug("📖 [DB] Message %s already read", message_id)
+                return True, message['sender_id'], False
 
-            logger.info(f"📖 [DB] ✅ Message {message_id} marked as read in database")
-            return True, message.sender_id
+            logger.debug("📖 [DB] ✅ Message %s marked as read in database", message_id)
+            await sync_to_async(RecentMessages.mark_read, thread_sensitive=False)(message['room_id'], [int(message_id)])
+            return True, message['sender_id'], True
 
         except PrivateMessage.DoesNotExist:
             logger.error(f"📖 [DB] ❌ Message {message_id} not found")
-            return False, None
+            return False, None, False
         except Exception as e:
             logger.error(f"📖 [DB] ❌ Error marking message as read: {e}")
-            return False, None
+            return False, None, False
+
+    async def send_new_message_delta(self, message_instance, recipient_id):
+        """
+        Увеличиваем счетчик непрочитанных получателя на одно сообщение.
+        NotificationConsumer применяет дельту к своему состоянию без запросов к БД.
+        """
+        await self.channel_layer.group_send(
+            f'notifications_{recipient_id}',
+            {
+                'type': 'new_message_notification',
+                'delta': 1,
+                'sender_id': self.user.id,
+                'sender_name': self.user.username,
+                'recipient_id': recipient_id,
+                'message': message_instance.message,
+                'message_id': message_instance.id,
+                'timestamp': message_instance.timestamp.timestamp(),
+                'room_id': self.room_id
+            }
+        )
 
-    async def send_notification_updates_for_read(self, sender_id):
+    async def send_read_delta(self, sender_id, count):
         """
-        Отправляем обновление счетчиков уведомлений после прочтения сообщения
+        Уменьшаем счетчик непрочитанных от sender_id в уведомлениях читателя.
+        Счетчики самого отправителя от прочтения не меняются, поэтому ему ничего не шлем.
         """
         try:
             await self.channel_layer.group_send(
-                f'notifications_{sender_id}',
+                f'notifications_{self.user.id}',
                 {
                     'type': 'new_message_notification',
+                    'delta': -count,
                     'sender_id': sender_id,
-                    'trigger_update': True
+                    'room_id': self.room_id
                 }
             )
-            logger.info(f"📖 [NOTIFICATION] Sent notification update to sender {sender_id}")
+            logger.debug("📖 [NOTIFICATION] Sent read delta -%s for sender %s to user %s", count, sender_id, self.user.id)
         except Exception as e:
-            logger.error(f"📖 [NOTIFICATION] Error sending notification update: {e}")
+            logger.error(f"📖 [NOTIFICATION] Error sending read delta: {e}")
 
     async def message_read_notification(self, event):
         """
         Обработчик уведомления о прочитанности сообщения
         Отправляется отправителю когда его сообщение прочитали
         """
-        await self.send(text_data=json.dumps({
-            'type': 'message_read',
-            'message_id': event['message_id'],
-            'reader_id': event['reader_id']
-        }))
-
-    async def message_status_update(self, event):
-        """Обработчик обновления статуса отдельного сообщения"""
-        await self.send(text_data=json.dumps({
-            'type': 'message_status_update',
-            'message_id': event['message_id'],
-            'read': event['read'],
-            'read_by_user_id': event.get('read_by_user_id')
-        }))
-
-    @database_sync_to_async
-    def notify_chat_list_update(self, user_ids):
-        pass
+        await self.send(text_data=event_frame(event))
 
-    @database_sync_to_async
-    def get_or_create_room_by_users(self, user1, user2):
+    async def notify_chat_list_update(self, user_ids):
+        """
+        Отправляем участникам только изменившуюся строку комнаты (chat_list_delta),
+        а не весь список чатов. chat = None - в комнате не осталось видимых сообщений.
+        """
         try:
-            room = PrivateChatRoom.objects.filter(
-                Q(user1=user1, user2=user2) | Q(user1=user2, user2=user1)
-            ).first()
-
-            if not room:
-                room = PrivateChatRoom.objects.create(user1=user1, user2=user2)
+            rows = await self.get_chat_rows(self.room_id, user_ids)
+            await self.apply_live_presence([row for row in rows.values() if row])
 
-            return room
+            for user_id in user_ids:
+                await self.channel_layer.group_send(
+                    f'chat_list_{user_id}',
+                    {
+                        'type': 'chat_list_delta',
+                        'room_id': self.room_id,
+                        'chat': rows.get(user_id)
+                    }
+                )
         except Exception as e:
-            logger.error(f"Error getting/creating room: {e}")
-            raise
+            logger.error(f"Error sending chat list delta: {e}")
 
-    async def send_notification_updates(self):
-        """Отправляем обновления счетчиков уведомлений"""
+    @database_sync_to_async
+    def get_chat_rows(self, room_id, user_ids):
+        """Строка комнаты в списке чатов для каждого пользователя: {user_id: chat или None}"""
+        rows = {}
+        for user_id, user in get_user_model().objects.in_bulk(user_ids).items():
+            chats = get_chat_list(user, room_id=room_id)
+            rows[user_id] = format_chat_for_socket(chats[0]) if chats else None
+        return rows
+
+    async def send_notification_updates(self, user_ids=None):
+        """
+        Триггер полного пересчета счетчиков уведомлений (resync).
+        Нужен, когда изменение нельзя выразить дельтой, например при удалении сообщений.
+        """
         try:
-            # Отправляем триггер для обновления уведомлений текущему пользователю
-            await self.channel_layer.group_send(
-                f'notifications_{self.user.id}',
-                {
-                    'type': 'new_message_notification',
-                    'sender_id': self.user.id,
-                    'trigger_update': True  # Флаг для принудительного обновления
-                }
-            )
-            logger.info(f"Sent notification update trigger for user {self.user.id}")
+            for user_id in user_ids or [self.user.id]:
+                await self.channel_layer.group_send(
+                    f'notifications_{user_id}',
+                    {
+                        'type': 'new_message_notification',
+                        'sender_id': self.user.id,
+                        'trigger_update': True  # Флаг для принудительного обновления
+                    }
+                )
+                logger.debug("Sent notification update trigger for user %s", user_id)
         except Exception as e:
             logger.error(f"Error sending notification updates: {e}")
 
-    async def send_chat_list_updates(self):
-        """Отправляем обновления списка чатов"""
-        try:
-            # Получаем обновленный список чатов
-            chat_data = await self.get_user_chats_for_update(self.user.id)
-
-            # Отправляем обновление списка чатов текущему пользователю через ChatListConsumer
-            await self.channel_layer.group_send(
-                f'chat_list_{self.user.id}',
-                {
-                    'type': 'chat_list_update',
-                    'chat_data': chat_data
-                }
-            )
-            logger.info(f"Sent chat list update for user {self.user.id}")
-        except Exception as e:
-            logger.error(f"Error sending chat list updates: {e}")
-
-    @database_sync_to_async
-    def get_user_chats_for_update(self, user_id):
-        """Получаем обновленный список чатов пользователя"""
-        try:
-            from .models import MessageDeletion
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-
-            # Получаем ID сообщений, которые пользователь удалил для себя
-            user_deleted_message_ids = MessageDeletion.objects.filter(
-                user=user
-            ).values_list('message__id', flat=True)
-
-            # Получаем все чаты пользователя
-            rooms = PrivateChatRoom.objects.filter(
-                Q(user1=user) | Q(user2=user)
-            ).select_related('user1', 'user2')
-
-            chat_data = []
-            for room in rooms:
-                # Определяем собеседника
-                other_user = room.user2 if room.user1 == user else room.user1
-
-                # Получаем последнее сообщение, исключая удалённые
-                last_message = PrivateMessage.objects.filter(
-                    room=room
-                ).exclude(
-                    Q(is_deleted=True) |  # Глобально удаленные сообщения
-                    Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
-                ).order_by('-timestamp').first()
-
-                if last_message:  # Показываем только чаты с сообщениями
-                    # Считаем непрочитанные сообщения (исключая удалённые)
-                    unread_count = PrivateMessage.objects.filter(
-                        room=room,
-                        recipient=user,
-                        read=False
-                    ).exclude(
-                        Q(is_deleted=True) |  # Глобально удаленные сообщения
-                        Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
-                    ).count()
-
-                    chat_info = {
-                        'id': room.id,
-                        'other_user': {
-                            'id': other_user.id,
-                            'username': other_user.username,
-                            'first_name': getattr(other_user, 'first_name', ''),
-                            'last_name': getattr(other_user, 'last_name', ''),
-                            'avatar': other_user.avatar.url if hasattr(other_user,
-                                                                       'avatar') and other_user.avatar else None,
-                            'gender': getattr(other_user, 'gender', 'male'),
-                            'is_online': getattr(other_user, 'is_online', 'offline')
-                        },
-                        'last_message': last_message.message,
-                        'last_message_time': last_message.timestamp.isoformat(),
-                        'unread_count': unread_count
-                    }
-                    chat_data.append(chat_info)
-
-            # Сортируем по времени последнего сообщения
-            chat_data.sort(key=lambda x: x['last_message_time'], reverse=True)
-            return chat_data
-
-        except Exception as e:
-            logger.error(f"Error getting user chats for update: {e}")
-            return []
+    @database_sync_to_async
+    def get_room_user_ids(self):
+        """ID участников текущей комнаты"""
+        return list(RoomParticipantsCache.get(self.room_id) or ())
 
     @database_sync_to_async
     def prefetch_media_url_to_cache(self, message_instance):
@@ -1024,237 +925,138 @@ class PrivateChatConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
             # Кэшируем
             cache.set(cache_key, cache_data, timeout=cache_ttl)
 
-            logger.info(f"⚡ [PREFETCH] Media URL cached for message {message_instance.id} (TTL: {cache_ttl}s)")
+            logger.debug("⚡ [PREFETCH] Media URL cached for message %s (TTL: %ss)", message_instance.id, cache_ttl)
 
         except Exception as e:
             logger.error(f"⚡ [PREFETCH] Error prefetching media URL to cache: {e}")
 
     async def handle_mark_multiple_as_read(self, data):
-        """Обработка массовой пометки сообщений как прочитанных"""
-        message_ids = data.get('message_ids', [])
-        room_id = data.get('room_id')
-        user_id = data.get('user_id')
-
-        logger.info(f"📖 [BULK-READ] ========== PROCESSING BULK READ RECEIPT ==========")
-        logger.info(f"📖 [BULK-READ] Message IDs count: {len(message_ids)}")
-        logger.info(f"📖 [BULK-READ] Room ID: {room_id}")
-        logger.info(f"📖 [BULK-READ] User ID: {user_id}")
+        """
+        Обработка массовой пометки сообщений как прочитанных.
+        Читается всё до водяного знака: up_to_message_id или максимальный id из message_ids.
+        """
+        message_ids = [mid for mid in data.get('message_ids', []) if mid]  # Фильтруем None
+        up_to_message_id = data.get('up_to_message_id')
 
-        if not message_ids or not user_id:
-            logger.error(f"📖 [BULK-READ] ❌ Missing required data")
-            return
+        logger.debug("📖 [BULK-READ] Room %s: %s message ids, up_to=%s", self.room_id, len(message_ids), up_to_message_id)
 
         try:
-            # Помечаем сообщения как прочитанные в БД
-            success_count, sender_ids = await self.mark_multiple_messages_as_read_in_db(message_ids, user_id)
-
-            if success_count > 0:
-                logger.info(f"📖 [BULK-READ] ✅ {success_count} messages marked as read")
+            if not up_to_message_id and message_ids:
+                up_to_message_id = max(int(mid) for mid in message_ids)
+        except (TypeError, ValueError):
+            up_to_message_id = None
 
-                # Отправляем подтверждение текущему пользователю
-                await self.send(text_data=json.dumps({
-                    'type': 'bulk_read_receipt_confirmation',
-                    'message_ids': message_ids[:success_count],
-                    'success': True
-                }))
+        if not up_to_message_id:
+            logger.error(f"📖 [BULK-READ] ❌ Missing required data")
+            return
 
-                # Уведомляем отправителей что их сообщения прочитаны
-                for sender_id in sender_ids:
-                    if sender_id:
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
-                            {
-                                'type': 'messages_read_by_recipient',
-                                'message_ids': [mid for mid in message_ids if mid],  # Фильтруем None
-                                'read_by_user_id': user_id
-                            }
-                        )
-                        logger.info(f"📖 [BULK-READ] ✅ Notified sender {sender_id}")
+        receipt = await self.apply_read_receipt(int(up_to_message_id))
 
-            else:
-                logger.warning(f"📖 [BULK-READ] ⚠️ No messages marked as read")
+        if receipt:
+            logger.debug("📖 [BULK-READ] ✅ %s messages marked as read", len(receipt['message_ids']))
 
-        except Exception as e:
-            logger.error(f"📖 [BULK-READ] ❌ Error: {e}")
+            # Отправляем подтверждение текущему пользователю
+            await self.send(text_data=json.dumps({
+                'type': 'bulk_read_receipt_confirmation',
+                'message_ids': receipt['message_ids'],
+                'up_to_message_id': receipt['up_to_message_id'],
+                'success': True
+            }))
+        else:
+            logger.warning(f"📖 [BULK-READ] ⚠️ No messages marked as read")
 
     async def handle_message_deletion_notification(self, data):
         """Обработка уведомлений об удалении сообщений"""
         try:
-            logger.info(f"🗑️ [DELETE-HANDLER] Processing deletion notification: {data}")
+            logger.debug("🗑️ [DELETE-HANDLER] Processing deletion notification: %s", data)
 
             # Просто пересылаем уведомление всем участникам чата
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                with_frame({
+                    **data,  # Пересылаем все данные как есть
                     'type': 'messages_deleted_notification',
-                    **data  # Пересылаем все данные как есть
-                }
+                    'room_id': self.room_id
+                })
             )
 
+            # Удаленное сообщение могло быть непрочитанным или последним в уведомлениях и списке чатов
+            room_user_ids = await self.get_room_user_ids()
+            await self.send_notification_updates(room_user_ids)
+            await self.notify_chat_list_update(room_user_ids)
+
         except Exception as e:
             logger.error(f"🗑️ [DELETE-HANDLER] ❌ Error: {e}")
 
-    @database_sync_to_async
-    def mark_multiple_messages_as_read_in_db(self, message_ids, reader_id):
+    async def handle_resume(self, data):
         """
-        Помечаем множество сообщений как прочитанные в базе данных
-        Возвращает (success_count: int, sender_ids: List[int])
+        Синхронизация после переподключения: клиент присылает last_seq последнего сообщения,
+        которое у него есть, и получает пропущенные сообщения, прочтения и удаления одним кадром
         """
         try:
-            messages = PrivateMessage.objects.select_related('sender').filter(
-                id__in=message_ids,
-                recipient_id=reader_id,
-                read=False
-            )
-
-            sender_ids = set()
-            success_count = 0
+            last_seq = int(data.get('last_seq', 0))
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({'type': 'error', 'error': 'Invalid last_seq'}))
+            return
 
-            for message in messages:
-                message.read = True
-                message.read_at = timezone.now()
-                message.save(update_fields=['read', 'read_at'])
-                sender_ids.add(message.sender_id)
-                success_count += 1
+        if data.get('room_id') is not None and str(data['room_id']) != str(self.room_id):
+            await self.send(text_data=json.dumps({'type': 'error', 'error': 'Room mismatch'}))
+            return
 
-            logger.info(f"📖 [BULK-DB] ✅ {success_count} messages marked as read in database")
-            return success_count, list(sender_ids)
+        if not await self.is_participant():
+            await self.send(text_data=json.dumps({'type': 'error', 'error': 'Not a room participant'}))
+            return
 
+        try:
+            frame = await database_sync_to_async(resume_room)(self.room_id, self.user.id, last_seq)
         except Exception as e:
-            logger.error(f"📖 [BULK-DB] ❌ Error marking messages as read: {e}")
-            return 0, []
+            logger.error(f"🔄 [RESUME] ❌ Error resuming room {self.room_id} for user {self.user.id}: {e}")
+            frame = {'type': 'resync_required', 'room_id': self.room_id, 'reason': 'error'}
+
+        logger.info("🔄 [RESUME] Room %s, user %s: from seq %s to %s, %s messages",
+                    self.room_id, self.user.id, last_seq, frame.get('last_seq'), len(frame.get('messages', [])))
+        await self.send(text_data=json.dumps(frame))
 
     async def messages_read_by_recipient(self, event):
         """Обработчик уведомления о массовом прочтении сообщений получателем"""
-        await self.send(text_data=json.dumps({
-            'type': 'messages_read_by_recipient',
-            'message_ids': event['message_ids'],
-            'read_by_user_id': event['read_by_user_id']
-        }))
+        await self.send(text_data=event_frame(event))
 
     async def message_status_update(self, event):
         """Обработчик обновления статуса отдельного сообщения"""
-        await self.send(text_data=json.dumps({
-            'type': 'message_status_update',
-            'message_id': event['message_id'],
-            'read': event['read'],
-            'read_by_user_id': event.get('read_by_user_id')
-        }))
+        await self.send(text_data=event_frame(event))
 
     async def messages_deleted_notification(self, event):
         """Обработчик уведомления об удалении сообщений"""
-        await self.send(text_data=json.dumps({
-            'type': 'messages_deleted_notification',
-            'message_ids': event.get('message_ids', []),
-            'deleted_by_user_id': event.get('deleted_by_user_id'),
-            'deleted_by_username': event.get('deleted_by_username'),
-            'delete_type': event.get('delete_type', 'for_me')
-        }))
+        await self.send(text_data=event_frame(event))
 
     async def send_push_notification_if_needed(self, message_instance):
         """
-        Отправляем push-уведомление если нужно
+        Ставим push-уведомление в очередь, если получатель не подключен ни к одному воркеру.
+        Отправку в FCM выполняет Celery, отправитель ее не ждет.
         """
-        logger.info(f"🔥 [PUSH] === CHECKING PUSH NOTIFICATION NEEDED ===")
-        logger.info(f"🔥 [PUSH] Message ID: {message_instance.id}")
-        logger.info(f"🔥 [PUSH] Sender: {message_instance.sender.username} (ID: {message_instance.sender.id})")
-        logger.info(f"🔥 [PUSH] Message: {message_instance.message[:50]}...")
-
-        try:
-            # Получаем получателя сообщения
-            recipient = None
-            if hasattr(message_instance, 'recipient'):
-                recipient = message_instance.recipient
-                logger.info(f"🔥 [PUSH] Recipient from message.recipient: {recipient}")
-            else:
-                # Определяем получателя из участников комнаты (исключая отправителя)
-                room_users = message_instance.room.participants.exclude(id=message_instance.sender.id)
-                recipient = room_users.first() if room_users.exists() else None
-                logger.info(f"🔥 [PUSH] Room participants (excluding sender): {room_users.count()}")
-                if recipient:
-                    logger.info(f"🔥 [PUSH] Selected recipient: {recipient.username} (ID: {recipient.id})")
-
-            if not recipient:
-                logger.error(f"🔥 [PUSH] ❌ No recipient found for message {message_instance.id}")
-                return
-
-            logger.info(f"🔥 [PUSH] ✅ Recipient determined: {recipient.username} (ID: {recipient.id})")
-
-            # Проверяем, онлайн ли получатель
-            recipient_online = self.is_user_online(recipient.id)
-            logger.info(f"🔥 [PUSH] Recipient {recipient.username} online status: {recipient_online}")
-
-            # КРИТИЧНО: Отправляем push уведомления НЕЗАВИСИМО от онлайн статуса для отладки
-            logger.info(f"🔥 [PUSH] === FORCING PUSH NOTIFICATION SEND FOR DEBUG ===")
-            logger.info(f"🔥 [PUSH] Normal logic would be: send only if offline ({not recipient_online})")
-            logger.info(f"🔥 [PUSH] DEBUG: Sending push notification regardless of online status")
-
-            # Отправляем push-уведомление асинхронно
-            try:
-                await sync_to_async(self._send_push_notification_sync)(message_instance, recipient)
-
-            except Exception as send_error:
-                logger.error(f"🔥 [PUSH] ❌ Push notification send failed: {send_error}")
-                logger.error(f"🔥 [PUSH] ❌ Send error details: {str(send_error)}")
-
-        except Exception as e:
-            logger.error(f"🔥 [PUSH] ❌ Critical error in push notification logic: {e}")
-            logger.error(f"🔥 [PUSH] ❌ Error type: {type(e).__name__}")
-            logger.error(f"🔥 [PUSH] ❌ Error details: {str(e)}")
+        recipient_id = message_instance.recipient_id
+        if not recipient_id:
+            logger.error(f"🔥 [PUSH] ❌ No recipient found for message {message_instance.id}")
+            return
 
-    def _send_push_notification_sync(self, message_instance, recipient):
-        """
-        Синхронная версия отправки push-уведомления
-        """
-        push_service = PushNotificationService()
+        if await self.is_user_online(recipient_id):
+            logger.debug("🔥 [PUSH] Recipient %s is online - no push for message %s", recipient_id, message_instance.id)
+            return
 
         try:
-
-            # Сначала получаем FCM токены получателя из базы данных
-            logger.info(f"🔥 [PUSH-SYNC] Getting FCM tokens for user {recipient.id}")
-
-            # Получаем FCM токены получателя
-            fcm_tokens = []
-            if hasattr(recipient, 'fcm_token') and recipient.fcm_token:
-                fcm_tokens.append(recipient.fcm_token)
-            else:
-                logger.warning(f"🔥 [PUSH-SYNC] ❌ No FCM token found for user {recipient.username}")
-                return
-
-            logger.info(f"🔥 [PUSH-SYNC] Total FCM tokens to send to: {len(fcm_tokens)}")
-
-            # Отправляем уведомление с правильными параметрами
-            result = push_service.send_message_notification(
-                fcm_tokens=fcm_tokens,
-                sender_name=message_instance.sender.username,
-                message_text=message_instance.message,
-                chat_id=message_instance.room.id
-            )
-
-
-
-
+            await dispatch_message_push(message_instance, message_instance.sender.username)
         except Exception as e:
-            logger.error(f"🔥 [PUSH-SYNC] ❌ Error sending push notification for {recipient.username}: {e}")
-            logger.error(f"🔥 [PUSH-SYNC] ❌ Error type: {type(e).__name__}")
-            logger.error(f"🔥 [PUSH-SYNC] ❌ Error details: {str(e)}")
-            import traceback
-            logger.error(f"🔥 [PUSH-SYNC] ❌ Traceback: {traceback.format_exc()}")
+            logger.error(f"🔥 [PUSH] ❌ Error dispatching push for message {message_instance.id}: {e}")
 
     async def is_user_online(self, user_id):
         """
         Проверяем, подключен ли пользователь к WebSocket
         """
         try:
-            # Проверяем через channel layer, есть ли активные соединения
-            # для этого пользователя в группе уведомлений
-            group_name = f'notifications_{user_id}'
-
-            # Простая проверка - если пользователь в нашем локальном списке
-            # (это работает только для одного воркера, для продакшена нужен Redis)
-            is_online = user_id in PrivateChatConsumer.connected_users
+            # Соединения пользователя на любом из воркеров
+            is_online = await PresenceRegistry.is_user_online(user_id)
 
-            logger.debug(f"User {user_id} online status: {is_online}")
+            logger.debug("User %s online status: %s", user_id, is_online)
             return is_online
 
         except Exception as e:
@@ -1269,135 +1071,178 @@ class NotificationConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
         self.notification_group_name = None
         # Кеш для предотвращения дублирования уведомлений
         self.previous_messages_cache = {}
+        # Непрочитанные по отправителям {sender_id: данные для клиента}.
+        # Считается из БД только при подключении и resync, дальше меняется дельтами
+        self.unread_by_sender = {}
+        self.notification_refresh = RefreshCoalescer('notifications', self.refresh_notifications)
 
     async def connect(self):
 
         await self.accept()
 
-        # Получаем пользователя из токена
-        token = None
-        query_string = self.scope.get('query_string', b'').decode()
-        if 'token=' in query_string:
-            token = query_string.split('token=')[1].split('&')[0]
+        # Пользователь уже определен HybridAuthMiddleware
+        user = self.get_authenticated_user()
+        if user is None:
+            await self.close()
+            return
+        self.user_id = user.id
 
-        if token:
-            try:
-                token_obj = await database_sync_to_async(Token.objects.select_related('user').get)(key=token)
-                self.user_id = token_obj.user.id
-
-                # Подписываемся на группу уведомлений пользователя
-                self.notification_group_name = f'notifications_{self.user_id}'
-                await self.channel_layer.group_add(
-                    self.notification_group_name,
-                    self.channel_name
-                )
+        # Регистрируем соединение и устанавливаем статус онлайн
+        await self.add_user_connection(self.user_id, "NotificationConsumer")
+        await self.announce_online(self.user_id)
 
-                logger.info(f"User {self.user_id} connected to notifications")
+        await self.open_stream()
 
-                # Регистрируем соединение и устанавливаем статус онлайн
-                self.add_user_connection(self.user_id, "NotificationConsumer")
-                await self.set_user_online(self.user_id)
-                await self.broadcast_user_status(self.user_id, 'online')
+    async def open_stream(self):
+        """Подписка на уведомления пользователя и отправка начального состояния"""
+        # Подписываемся на группу уведомлений пользователя
+        self.notification_group_name = f'notifications_{self.user_id}'
+        await self.channel_layer.group_add(
+            self.notification_group_name,
+            self.channel_name
+        )
 
-                # Отправляем начальные уведомления
-                unread_sender_count = await self.get_unique_senders_count(self.user_id)
-                messages_by_sender = await self.get_messages_by_sender(self.user_id)
-                await self.send_initial_notification(unread_sender_count, messages_by_sender)
+        logger.info("User %s connected to notifications", self.user_id)
 
-            except Token.DoesNotExist:
-                await self.close()
+        # Отправляем начальные уведомления
+        await self.resync_unread_state()
+        await self.send_initial_notification()
 
-    async def send_notification_update(self, unique_sender_count, messages_by_sender):
+    async def close_stream(self):
+        """Отписка от группы уведомлений"""
+        self.notification_refresh.cancel()
+        if self.notification_group_name:
+            await self.channel_layer.group_discard(
+                self.notification_group_name,
+                self.channel_name
+            )
+            logger.info("User %s disconnected from notifications", self.user_id)
+
+    async def resync_unread_state(self):
+        """Полный пересчет непрочитанных по отправителям из БД"""
+        messages_by_sender = await self.get_messages_by_sender(self.user_id)
+        sender_names = await self.get_sender_names([message['sender_id'] for message in messages_by_sender])
+
+        self.unread_by_sender = {}
+        for message in messages_by_sender:
+            sender_id = message['sender_id']
+            self.unread_by_sender[sender_id] = {
+                'sender_id': sender_id,
+                'sender_name': sender_names.get(sender_id, f"Пользователь {sender_id}"),
+                'count': message['count'],
+                'last_message': message.get('last_message', ''),
+                'timestamp': message.get('timestamp'),
+                'message_id': message.get('message_id'),  # ДОБАВЛЕНО: ID сообщения
+                'chat_id': message.get('chat_id')
+            }
+
+    def apply_unread_delta(self, event):
+        """
+        Применяем дельту к счетчикам без обращения к БД.
+        Возвращает True, если состояние изменилось.
+        """
+        sender_id = event.get('sender_id')
+        delta = event.get('delta', 0)
+        entry = self.unread_by_sender.get(sender_id)
+
+        if delta > 0:
+            message_id = event.get('message_id')
+            if entry is None:
+                entry = self.unread_by_sender[sender_id] = {
+                    'sender_id': sender_id,
+                    'sender_name': event.get('sender_name') or f"Пользователь {sender_id}",
+                    'count': 0,
+                }
+            elif message_id is not None and entry.get('message_id') is not None and message_id <= entry['message_id']:
+                # Сообщение уже учтено при resync, который прошел после его сохранения
+                return False
+
+            entry.update({
+                'count': entry['count'] + delta,
+                'last_message': event.get('message', ''),
+                'timestamp': event.get('timestamp'),
+                'message_id': message_id,
+                'chat_id': event.get('room_id')
+            })
+            return True
+
+        if entry is None or not delta:
+            return False
+
+        entry['count'] += delta
+        if entry['count'] <= 0:
+            del self.unread_by_sender[sender_id]
+        return True
+
+    async def send_notification_update(self):
         try:
+            formatted_messages = list(self.unread_by_sender.values())
+
             # НОВОЕ: проверяем, изменились ли данные
-            current_messages_hash = hash(str(messages_by_sender))
+            current_messages_hash = hash(str(formatted_messages))
             previous_hash = self.previous_messages_cache.get('hash')
 
             if previous_hash == current_messages_hash:
-                logger.debug(f"No changes in messages for user {self.user_id}, skipping update")
+                logger.debug("No changes in messages for user %s, skipping update", self.user_id)
                 return
 
             # Обновляем кеш
             self.previous_messages_cache['hash'] = current_messages_hash
-            self.previous_messages_cache['messages'] = messages_by_sender
-
-            formatted_messages = []
-            for message in messages_by_sender:
-                user_info = await self.get_user_info(message['sender_id'])
-                formatted_message = {
-                    'sender_id': message['sender_id'],
-                    'sender_name': user_info.get('username', f"Пользователь {message['sender_id']}"),
-                    'count': message['count'],
-                    'last_message': message.get('last_message', ''),
-                    'timestamp': message.get('timestamp'),
-                    'message_id': message.get('message_id'),  # ДОБАВЛЕНО: ID сообщения
-                    'chat_id': message.get('chat_id')
-                }
-                formatted_messages.append(formatted_message)
 
             await self.send(text_data=json.dumps({
                 'type': 'notification_update',
-                'unique_sender_count': unique_sender_count,
+                'unique_sender_count': len(formatted_messages),
                 'messages': [{'user': self.user_id}, formatted_messages]
-            }))
+            }), coalesce_key='notification_update')
 
-            logger.debug(f"Sent notification update to user {self.user_id}")
+            logger.debug("Sent notification update to user %s", self.user_id)
 
         except Exception as e:
             logger.error(f"Error in send_notification_update: {e}")
 
-    async def send_initial_notification(self, unique_sender_count, messages_by_sender):
+    async def send_initial_notification(self):
         try:
-            formatted_messages = []
-            for message in messages_by_sender:
-                user_info = await self.get_user_info(message['sender_id'])
-                formatted_message = {
-                    'sender_id': message['sender_id'],
-                    'sender_name': user_info.get('username', f"Пользователь {message['sender_id']}"),
-                    'count': message['count'],
-                    'last_message': message.get('last_message', ''),
-                    'timestamp': message.get('timestamp'),
-                    'message_id': message.get('message_id'),  # ДОБАВЛЕНО: ID сообщения
-                    'chat_id': message.get('chat_id')
-                }
-                formatted_messages.append(formatted_message)
+            formatted_messages = list(self.unread_by_sender.values())
 
             await self.send(text_data=json.dumps({
                 'type': 'initial_notification',
-                'unique_sender_count': unique_sender_count,
+                'unique_sender_count': len(formatted_messages),
                 'messages': [{'user': self.user_id}, formatted_messages]
             }))
 
             # Инициализируем кеш
-            self.previous_messages_cache['hash'] = hash(str(messages_by_sender))
-            self.previous_messages_cache['messages'] = messages_by_sender
+            self.previous_messages_cache['hash'] = hash(str(formatted_messages))
 
         except Exception as e:
             logger.error(f"Error in send_initial_notification: {e}")
 
     async def new_message_notification(self, event):
         """
-        ОБНОВЛЕНО: Обработчик для новых уведомлений о сообщениях
+        Обработчик уведомлений о сообщениях.
+        Событие с delta (+1 новое сообщение, -n прочитанные) меняет счетчики без запросов к БД,
+        trigger_update запускает полный пересчет.
         """
         try:
-            logger.info(f"Processing new message notification for user {self.user_id}")
-
-            # Если это принудительное обновление (например, после прочтения сообщений)
-            if event.get('trigger_update'):
-                # Сбрасываем кеш для принудительного обновления
-                self.previous_messages_cache = {}
-                logger.info(f"Forced notification update triggered for user {self.user_id}")
-
-            # Получаем обновленные данные
-            unread_sender_count = await self.get_unique_senders_count(self.user_id)
-            messages_by_sender = await self.get_messages_by_sender(self.user_id)
+            # Пока ждем пересчета, дельты не применяем: пересчет все равно прочитает актуальную БД
+            if event.get('trigger_update') or 'delta' not in event or self.notification_refresh.active:
+                self.notification_refresh.trigger()
+                return
 
-            # Отправляем обновленные уведомления (с проверкой дублирования)
-            await self.send_notification_update(unread_sender_count, messages_by_sender)
+            if self.apply_unread_delta(event):
+                # Отправляем обновленные уведомления (с проверкой дублирования)
+                await self.send_notification_update()
 
         except Exception as e:
             logger.error(f"Error sending new message notification: {e}")
 
+    async def refresh_notifications(self):
+        """Полный пересчет по триггеру, вызывается RefreshCoalescer не чаще раза за окно"""
+        # Сбрасываем кеш для принудительного обновления
+        self.previous_messages_cache = {}
+        logger.info("Forced notification update triggered for user %s", self.user_id)
+        await self.resync_unread_state()
+        await self.send_notification_update()
+
     # Остальные методы остаются без изменений...
     async def separate_message_notification(self):
         try:
@@ -1440,18 +1285,20 @@ class NotificationConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
             message_type = event.get('message_type', 'notification')
 
             if message_type == 'message_notification':
-                unread_sender_count = await self.get_unique_senders_count(self.user_id)
-                messages_by_sender = await self.get_messages_by_sender(self.user_id)
-
-                await self.send_notification_update(unread_sender_count, messages_by_sender)
+                self.notification_refresh.trigger()
 
         except Exception as e:
             logger.error(f"Error in notification_message: {e}")
 
-    @database_sync_to_async
-    def get_user_info(self, user_id):
+    async def get_sender_names(self, sender_ids):
+        """Имена отправителей одним запросом: {user_id: username}"""
+        if not sender_ids:
+            return {}
+        return dict(await fetch_all(get_user_model().objects.filter(id__in=sender_ids).values_list('id', 'username')))
+
+    async def get_user_info(self, user_id):
         try:
-            user = get_user_model().objects.get(id=user_id)
+            user = await run_query(get_user_model().objects.only('id', 'username', 'first_name', 'last_name'), 'get', id=user_id)
             return {
                 'id': user.id,
                 'username': user.username,
@@ -1464,44 +1311,26 @@ class NotificationConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
     async def send_user_online(self, user_id):
         await self.channel_layer.group_send(
             f'user_status_{user_id}',
-            {
+            with_frame({
                 'type': 'user_status_update',
                 'user_id': user_id,
                 'status': 'online'
-            }
+            })
         )
 
     async def send_user_offline(self, user_id):
         await self.channel_layer.group_send(
             f'user_status_{user_id}',
-            {
+            with_frame({
                 'type': 'user_status_update',
                 'user_id': user_id,
                 'status': 'offline'
-            }
+            })
         )
 
-    async def broadcast_user_status(self, user_id, status):
-        # Найти все чаты пользователя и отправить обновление статуса
-        chat_users = await self.get_chat_users(user_id)
-        for chat_user_id in chat_users:
-            await self.channel_layer.group_send(
-                f'notifications_{chat_user_id}',
-                {
-                    'type': 'user_status_update',
-                    'user_id': user_id,
-                    'status': status
-                }
-            )
-
     async def disconnect(self, close_code):
         # Отписываемся от группы уведомлений
-        if hasattr(self, 'notification_group_name') and self.notification_group_name:
-            await self.channel_layer.group_discard(
-                self.notification_group_name,
-                self.channel_name
-            )
-            logger.info(f"User {self.user_id} disconnected from notifications")
+        await self.close_stream()
 
         if self.user_id:
             # Отменяем регистрацию соединения и устанавливаем статус оффлайн только если пользователь полностью отключился
@@ -1512,53 +1341,35 @@ class NotificationConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
             data = json.loads(text_data)
             message_type = data.get('type', '')
 
-            logger.info(f"NotificationConsumer received: {message_type} from user {self.user_id}")
+            logger.debug("NotificationConsumer received: %s from user %s", message_type, self.user_id)
 
             if message_type == 'ping':
-                logger.info(f"Sending pong to user {self.user_id}")
+                logger.debug("Sending pong to user %s", self.user_id)
                 await self.send(text_data=json.dumps({'type': 'pong'}))
             elif message_type == 'get_initial_data':
-                logger.info(f"Sending initial notification data to user {self.user_id}")
-                unread_sender_count = await self.get_unique_senders_count(self.user_id)
-                messages_by_sender = await self.get_messages_by_sender(self.user_id)
-                await self.send_initial_notification(unread_sender_count, messages_by_sender)
+                logger.debug("Sending initial notification data to user %s", self.user_id)
+                await self.resync_unread_state()
+                await self.send_initial_notification()
 
         except Exception as e:
             logger.error(f"Error in NotificationConsumer receive: {e}")
 
     async def notification(self, event):
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'notification',
-                'message': event['message'],
-                'user_id': event.get('user_id'),
-                'notification_type': event.get('notification_type', 'general')
-            }))
+            await self.send(text_data=event_frame(event))
         except Exception as e:
             logger.error(f"Error sending notification: {e}")
 
     async def user_status_update(self, event):
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'user_status_update',
-                'user_id': event['user_id'],
-                'status': event['status']
-            }))
+            await self.send(text_data=event_frame(event), coalesce_key=f"user_status:{event['user_id']}")
         except Exception as e:
             logger.error(f"Error sending user status update: {e}")
 
     @database_sync_to_async
     def get_unique_senders_count(self, user_id):
         try:
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-
-            unique_senders = PrivateMessage.objects.filter(
-                recipient=user,
-                read=False
-            ).values('sender').distinct().count()
-
-            return unique_senders
+            return RoomMemberships.unread_rooms_count(user_id)
         except Exception as e:
             logger.error(f"Error getting unique senders count: {e}")
             return 0
@@ -1566,17 +1377,7 @@ class NotificationConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_sender_message_count(self, user_id, sender_id):
         try:
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-            sender = User.objects.get(id=sender_id)
-
-            count = PrivateMessage.objects.filter(
-                recipient=user,
-                sender=sender,
-                read=False
-            ).count()
-
-            return count
+            return RoomMemberships.unread_from(user_id, sender_id)
         except Exception as e:
             logger.error(f"Error getting sender message count: {e}")
             return 0
@@ -1584,131 +1385,53 @@ class NotificationConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_messages_by_sender(self, user_id):
         try:
-            from .models import MessageDeletion
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-
-            # Получаем ID сообщений, которые пользователь удалил для себя
-            user_deleted_message_ids = MessageDeletion.objects.filter(
-                user=user
-            ).values_list('message__id', flat=True)
-
-            # Получаем непрочитанные сообщения, исключая глобально удаленные и пользовательские удаления
-            unread_messages = PrivateMessage.objects.filter(
-                recipient=user,
-                read=False
-            ).exclude(
-                Q(is_deleted=True) |  # Глобально удаленные сообщения
-                Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
-            ).select_related('sender', 'room').order_by('sender', '-timestamp')
-
-            # Группируем по отправителям
-            senders_data = {}
-            for message in unread_messages:
-                sender_id = message.sender.id
-                if sender_id not in senders_data:
-                    senders_data[sender_id] = {
-                        'sender_id': sender_id,
-                        'count': 0,
-                        'last_message': message.message,
-                        'timestamp': message.timestamp.timestamp(),  # ИСПРАВЛЕНО: Unix timestamp
-                        'message_id': message.id,  # ДОБАВЛЕНО: ID сообщения
-                        'chat_id': message.room.id if message.room else None
-                    }
-                senders_data[sender_id]['count'] += 1
-
-                # ИСПРАВЛЕНО: Обновляем на самое новое сообщение (исключая удалённые)
-                if message.timestamp.timestamp() > senders_data[sender_id]['timestamp']:
-                    senders_data[sender_id]['last_message'] = message.message
-                    senders_data[sender_id]['timestamp'] = message.timestamp.timestamp()
-                    senders_data[sender_id]['message_id'] = message.id
-
-            # Дополнительно проверяем для каждого отправителя, что last_message не удалено
-            for sender_id, data in senders_data.items():
-                # Если по какой-то причине последнее сообщение всё ещё удалено,
-                # найдём ближайшее не удалённое для этого отправителя
-                latest_non_deleted = PrivateMessage.objects.filter(
-                    recipient=user,
-                    sender_id=sender_id
-                ).exclude(
-                    Q(is_deleted=True) |  # Глобально удаленные сообщения
-                    Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
-                ).order_by('-timestamp').first()
-
-                if latest_non_deleted and latest_non_deleted.id != data['message_id']:
-                    data['last_message'] = latest_non_deleted.message
-                    data['timestamp'] = latest_non_deleted.timestamp.timestamp()
-                    data['message_id'] = latest_non_deleted.id
-
-            return list(senders_data.values())
-
+            # Счетчики из RoomMembership, без подсчета непрочитанных сообщений
+            return RoomMemberships.unread_by_sender(user_id)
         except Exception as e:
             logger.error(f"Error getting messages by sender: {e}")
             return []
 
-    @database_sync_to_async
-    def get_chat_users(self, user_id):
-        try:
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-
-            # Получаем всех пользователей, с которыми есть чаты
-            chat_users = set()
-
-            # Чаты, где пользователь является user1
-            rooms_as_user1 = PrivateChatRoom.objects.filter(user1=user).values_list('user2_id', flat=True)
-            chat_users.update(rooms_as_user1)
-
-            # Чаты, где пользователь является user2  
-            rooms_as_user2 = PrivateChatRoom.objects.filter(user2=user).values_list('user1_id', flat=True)
-            chat_users.update(rooms_as_user2)
-
-            return list(chat_users)
-        except Exception as e:
-            logger.error(f"Error getting chat users: {e}")
-            return []
-
 
 class ChatListConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = None
         self.user_id = None
+        self.chat_list_refresh = RefreshCoalescer('chat_list', self.refresh_chat_list)
 
     async def connect(self):
-        token = None
-        query_string = self.scope.get('query_string', b'').decode()
-        if 'token=' in query_string:
-            token = query_string.split('token=')[1].split('&')[0]
+        self.user = self.get_authenticated_user()
+        if self.user is None:
+            await self.close()
+            return
+        self.user_id = self.user.id
 
-        if token:
-            try:
-                token_obj = await database_sync_to_async(Token.objects.select_related('user').get)(key=token)
-                self.user = token_obj.user
-                self.user_id = token_obj.user.id
-
-                # Подписываемся на группу обновлений списка чатов
-                await self.channel_layer.group_add(
-                    f'chat_list_{self.user_id}',
-                    self.channel_name
-                )
+        await self.open_stream()
 
-                # Регистрируем соединение
-                self.add_user_connection(self.user_id, "ChatListConsumer")
+        # Регистрируем соединение
+        await self.add_user_connection(self.user_id, "ChatListConsumer")
 
-                await self.accept()
-            except Token.DoesNotExist:
-                await self.close()
-        else:
-            await self.close()
+        await self.accept()
+
+    async def open_stream(self):
+        """Подписка на группу обновлений списка чатов"""
+        await self.channel_layer.group_add(
+            f'chat_list_{self.user_id}',
+            self.channel_name
+        )
+
+    async def close_stream(self):
+        """Отписка от группы обновлений списка чатов"""
+        self.chat_list_refresh.cancel()
+        await self.channel_layer.group_discard(
+            f'chat_list_{self.user_id}',
+            self.channel_name
+        )
 
     async def disconnect(self, close_code):
         # Отписываемся от группы обновлений списка чатов и отменяем регистрацию соединения
         if self.user_id:
-            await self.channel_layer.group_discard(
-                f'chat_list_{self.user_id}',
-                self.channel_name
-            )
+            await self.close_stream()
             await self.remove_user_connection(self.user_id, "ChatListConsumer")
 
     async def receive(self, text_data):
@@ -1717,14 +1440,14 @@ class ChatListConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
             message_type = data.get('type')
 
             if message_type == 'get_chat_list':
-                await self.send_chat_list()
+                await self.send_chat_list(limit=data.get('limit'), before=data.get('before'))
 
         except Exception as e:
             logger.error(f"Error in ChatListConsumer receive: {e}")
 
-    async def send_chat_list(self):
+    async def send_chat_list(self, limit=None, before=None):
         try:
-            chats = await self.get_user_chats(self.user_id)
+            chats = await self.apply_live_presence(await self.get_user_chats(self.user_id, limit=limit, before=before))
             await self.send(text_data=json.dumps({
                 'type': 'chat_list',
                 'chats': chats
@@ -1733,76 +1456,256 @@ class ChatListConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
             logger.error(f"Error sending chat list: {e}")
 
     async def chat_list_update(self, event):
+        if 'chat_data' not in event:
+            # Триггер без данных: пересчитываем сами, схлопывая серию триггеров
+            self.chat_list_refresh.trigger()
+            return
+
         await self.send(text_data=json.dumps({
             'type': 'chat_list_update',
             'chat_data': event['chat_data']
-        }))
+        }), coalesce_key='chat_list_update')
+
+    async def chat_list_delta(self, event):
+        """Изменилась одна комната: клиент обновляет строку в своем списке"""
+        await self.send(text_data=json.dumps({
+            'type': 'chat_list_delta',
+            'room_id': event['room_id'],
+            'chat': event['chat']
+        }), coalesce_key=f"chat_list_delta:{event['room_id']}")
+
+    async def refresh_chat_list(self):
+        chats = await self.apply_live_presence(await self.get_user_chats(self.user_id))
+        await self.send(text_data=json.dumps({
+            'type': 'chat_list_update',
+            'chat_data': chats
+        }), coalesce_key='chat_list_update')
 
     @database_sync_to_async
-    def get_user_chats(self, user_id):
+    def get_user_chats(self, user_id, limit=None, before=None):
         try:
-            from .models import MessageDeletion
-            User = get_user_model()
-            user = User.objects.get(id=user_id)
-
-            # Получаем ID сообщений, которые пользователь удалил для себя
-            user_deleted_message_ids = MessageDeletion.objects.filter(
-                user=user
-            ).values_list('message__id', flat=True)
-
-            # Получаем все чаты пользователя
-            rooms = PrivateChatRoom.objects.filter(
-                Q(user1=user) | Q(user2=user)
-            ).select_related('user1', 'user2')
-
-            chat_data = []
-            for room in rooms:
-                # Определяем собеседника
-                other_user = room.user2 if room.user1 == user else room.user1
-
-                # Получаем последнее сообщение, исключая удалённые
-                last_message = PrivateMessage.objects.filter(
-                    room=room
-                ).exclude(
-                    Q(is_deleted=True) |  # Глобально удаленные сообщения
-                    Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
-                ).order_by('-timestamp').first()
-
-                if last_message:  # Показываем только чаты с сообщениями
-                    # Считаем непрочитанные сообщения (исключая удалённые)
-                    unread_count = PrivateMessage.objects.filter(
-                        room=room,
-                        recipient=user,
-                        read=False
-                    ).exclude(
-                        Q(is_deleted=True) |  # Глобально удаленные сообщения
-                        Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
-                    ).count()
-
-                    chat_info = {
-                        'id': room.id,
-                        'other_user': {
-                            'id': other_user.id,
-                            'username': other_user.username,
-                            'first_name': getattr(other_user, 'first_name', ''),
-                            'last_name': getattr(other_user, 'last_name', ''),
-                            'avatar': other_user.avatar.url if hasattr(other_user,
-                                                                       'avatar') and other_user.avatar else None,
-                            'gender': getattr(other_user, 'gender', 'male'),
-                            'is_online': getattr(other_user, 'is_online', 'offline')
-                        },
-                        'last_message': last_message.message,
-                        'last_message_time': last_message.timestamp.isoformat(),
-                        'unread_count': unread_count
-                    }
-                    chat_data.append(chat_info)
-
-            # Сортируем по времени последнего сообщения
-            chat_data.sort(key=lambda x: x['last_message_time'], reverse=True)
-            return chat_data
+            user = self.user if self.user and self.user.id == user_id else get_user_model().objects.get(id=user_id)
+            return [format_chat_for_socket(chat) for chat in get_chat_list(user, limit=limit, before=before)]
 
         except Exception as e:
             logger.error(f"Error getting user chats: {e}")
             return []
 
     # Все общие методы теперь в BaseConsumerMixin
+
+
+class MultiplexedStreamMixin:
+    """
+    Поток внутри мультиплексированного соединения.
+    Переиспользует обработчики обычного consumer'а, но отправляет кадры через общий сокет
+    MultiplexConsumer, а регистрацию соединения и статус онлайн оставляет ему.
+    """
+    stream_channel = None
+
+    def __init__(self, mux, room_id=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mux = mux
+        self.scope = mux.scope
+        self.channel_layer = mux.channel_layer
+        self.channel_name = mux.channel_name
+        self.user = mux.user
+        self.user_id = mux.user_id
+
+        # Префикс кадра собираем один раз, payload уже сериализован обработчиком
+        header = {'channel': self.stream_channel}
+        if room_id is not None:
+            self.room_id = room_id
+            self.room_name = str(room_id)
+            header['room_id'] = room_id
+        self.frame_prefix = json.dumps(header)[:-1] + ', "payload": '
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        if text_data is not None:
+            if coalesce_key is not None:
+                coalesce_key = f'{self.stream_channel}:{coalesce_key}'
+            await self.mux.send(text_data=f'{self.frame_prefix}{text_data}}}', coalesce_key=coalesce_key)
+        if close:
+            await self.close()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=None, reason=None):
+        await self.mux.detach_stream(self)
+
+    async def add_user_connection(self, user_id, connection_type="unknown"):
+        return False
+
+    async def remove_user_connection(self, user_id, connection_type="unknown"):
+        pass
+
+
+class NotificationStream(MultiplexedStreamMixin, NotificationConsumer):
+    stream_channel = 'notifications'
+
+
+class ChatListStream(MultiplexedStreamMixin, ChatListConsumer):
+    stream_channel = 'chat_list'
+
+
+class PrivateChatStream(MultiplexedStreamMixin, PrivateChatConsumer):
+    stream_channel = 'room'
+
+
+class MultiplexConsumer(BaseConsumerMixin, AsyncWebsocketConsumer):
+    """
+    Одно WebSocket соединение на устройство вместо NotificationConsumer, ChatListConsumer
+    и PrivateChatConsumer на каждый открытый чат.
+
+    Исходящие кадры: {"channel": "notifications" | "chat_list" | "room", "room_id": ..., "payload": {...}}
+    Входящие кадры:
+        {"channel": "room", "room_id": 5, "action": "subscribe" | "unsubscribe"}
+        {"channel": "room", "room_id": 5, "payload": {...}}  - кадр PrivateChatConsumer
+        {"channel": "notifications" | "chat_list", "payload": {...}}
+        {"type": "ping"}
+    """
+    NOTIFICATION_EVENTS = {
+        'new_message_notification', 'notification', 'notification_message', 'user_status_update',
+    }
+    CHAT_LIST_EVENTS = {'chat_list_update', 'chat_list_delta'}
+    ROOM_EVENTS = {
+        'chat_message', 'message_read_notification', 'message_status_update',
+        'messages_read_by_recipient', 'messages_deleted_notification',
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = None
+        self.user_id = None
+        self.notifications = None
+        self.chat_list = None
+        self.rooms = {}
+
+    async def connect(self):
+        self.user = self.get_authenticated_user()
+        if self.user is None:
+            await self.close()
+            return
+
+        self.user_id = self.user.id
+        await self.accept()
+
+        # Одна регистрация соединения и одна рассылка статуса на устройство
+        await self.add_user_connection(self.user_id, "MultiplexConsumer")
+        await self.announce_online(self.user_id)
+
+        self.notifications = NotificationStream(self)
+        self.chat_list = ChatListStream(self)
+        await self.notifications.open_stream()
+        await self.chat_list.open_stream()
+
+    async def disconnect(self, close_code):
+        if not self.user_id:
+            return
+
+        for stream in [self.notifications, self.chat_list, *self.rooms.values()]:
+            if stream:
+                await stream.close_stream()
+        self.rooms = {}
+
+        await self.remove_user_connection(self.user_id, "MultiplexConsumer")
+
+    async def dispatch(self, message):
+        """События channel layer маршрутизируем в соответствующий поток"""
+        event_type = message.get('type', '')
+
+        if event_type in self.ROOM_EVENTS:
+            stream = self.rooms.get(message.get('room_id'))
+            if stream:
+                await stream.dispatch(message)
+            return
+        if event_type in self.NOTIFICATION_EVENTS:
+            if self.notifications:
+                await self.notifications.dispatch(message)
+            return
+        if event_type in self.CHAT_LIST_EVENTS:
+            if self.chat_list:
+                await self.chat_list.dispatch(message)
+            return
+
+        await super().dispatch(message)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            channel = data.get('channel')
+
+            if channel is None:
+                if data.get('type') == 'ping':
+                    await self.send(text_data=json.dumps({'type': 'pong'}))
+                return
+
+            if channel == 'room':
+                await self.receive_room_frame(data)
+            elif channel == 'notifications' and self.notifications:
+                await self.notifications.receive(json.dumps(data.get('payload', {})))
+            elif channel == 'chat_list' and self.chat_list:
+                await self.chat_list.receive(json.dumps(data.get('payload', {})))
+            else:
+                logger.warning(f"Unknown multiplex channel: {channel}")
+
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON received")
+        except Exception as e:
+            logger.error(f"Error in MultiplexConsumer receive: {e}")
+
+    async def receive_room_frame(self, data):
+        try:
+            room_id = int(data.get('room_id'))
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({'channel': 'room', 'type': 'error', 'error': 'Invalid room_id'}))
+            return
+
+        action = data.get('action')
+        if action:
+            rejection = await rate_limit.consume(self.user_id, action)
+            if rejection:
+                await self.send(text_data=json.dumps({'channel': 'room', 'room_id': room_id, **rejection}))
+                return
+
+        if action == 'subscribe':
+            await self.subscribe_room(room_id)
+        elif action == 'unsubscribe':
+            stream = self.rooms.get(room_id)
+            if stream:
+                await self.detach_stream(stream)
+        elif room_id in self.rooms:
+            await self.rooms[room_id].receive(json.dumps(data.get('payload', {})))
+        else:
+            await self.send(text_data=json.dumps({
+                'channel': 'room', 'room_id': room_id, 'type': 'error', 'error': 'Not subscribed'
+            }))
+
+    async def subscribe_room(self, room_id):
+        if room_id not in self.rooms:
+            if not await self.is_room_participant(room_id):
+                await self.send(text_data=json.dumps({
+                    'channel': 'room', 'room_id': room_id, 'type': 'error', 'error': 'Room not found'
+                }))
+                return
+
+            stream = PrivateChatStream(self, room_id=room_id)
+            self.rooms[room_id] = stream
+            await stream.open_stream()
+
+        await self.send(text_data=json.dumps({'channel': 'room', 'room_id': room_id, 'type': 'subscribed'}))
+
+    async def detach_stream(self, stream):
+        """Закрытие потока: для комнаты - отписка, общие потоки живут вместе с сокетом"""
+        if isinstance(stream, PrivateChatStream) and self.rooms.get(stream.room_id) is stream:
+            del self.rooms[stream.room_id]
+            await stream.close_stream()
+            await self.send(text_data=json.dumps({
+                'channel': 'room', 'room_id': stream.room_id, 'type': 'unsubscribed'
+            }))
+
+    async def is_room_participant(self, room_id):
+        return await run_query(PrivateChatRoom.objects.filter(
+            Q(user1_id=self.user_id) | Q(user2_id=self.user_id),
+            id=room_id
+        ), 'exists')
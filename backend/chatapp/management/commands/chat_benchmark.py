@@ -0,0 +1,254 @@
+import asyncio
+import statistics
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from authapp.models import CustomUser
+from chatapp.models import MessageDeletion, PrivateChatRoom, PrivateMessage
+from chatapp.services.chat_list import get_chat_list
+from chatapp.services import ingest
+from chatapp.services.membership import RoomMemberships
+from chatapp.services.db import fetch_all, run_query
+from chatapp.services.redis_client import get_sync_redis
+from chatapp.services.send_message import RoomParticipantsCache, send_message
+
+
+def create_chat_fixture(rooms, messages_per_room=3):
+    """
+    Пользователь с rooms собеседниками и messages_per_room сообщениями в каждой комнате.
+    Часть сообщений непрочитана, часть удалена глобально или для владельца.
+    Возвращает владельца списка чатов.
+    """
+    prefix = uuid.uuid4().hex[:8]
+    # bulk_create не вызывает CustomUser.save(), который копирует файл аватара по умолчанию
+    owner, *others = CustomUser.objects.bulk_create([
+        CustomUser(username=f'bench_{prefix}_{i}', email=f'bench_{prefix}_{i}@bench.local')
+        for i in range(rooms + 1)
+    ])
+
+    chat_rooms = PrivateChatRoom.objects.bulk_create([
+        # bulk_create не вызывает pre_save, поэтому имя комнаты задаем сами
+        PrivateChatRoom(user1=owner, user2=other, name=f'private_chat_{owner.id}_{other.id}',
+                        last_seq=messages_per_room)
+        for other in others
+    ])
+
+    messages = []
+    for room, other in zip(chat_rooms, others):
+        for i in range(messages_per_room):
+            incoming = i % 2 == 0
+            messages.append(PrivateMessage(
+                room=room,
+                sender=other if incoming else owner,
+                recipient=owner if incoming else other,
+                message=f'message {i}',
+                seq=i + 1,
+                read=not incoming,
+                is_deleted=i == messages_per_room - 1 and room.id % 3 == 0,
+            ))
+    messages = PrivateMessage.objects.bulk_create(messages)
+
+    MessageDeletion.objects.bulk_create([
+        MessageDeletion(user=owner, message=message)
+        for message in messages[::messages_per_room * 5]
+    ])
+    # Сообщения созданы bulk_create в обход сервисов - счетчики участников собираем из них
+    RoomMemberships.rebuild([room.id for room in chat_rooms])
+    return owner
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарки чата: число SQL запросов и время. Данные создаются в транзакции и откатываются'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenario',
+            nargs='?',
+            default='chat_list',
+            choices=['chat_list', 'send_message', 'consumer_db', 'ingest'],
+            help='Сценарий бенчмарка',
+        )
+        parser.add_argument(
+            '--rooms',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000],
+            help='Количество комнат пользователя',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Количество повторов для усреднения времени',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='Одновременных операций в event loop (consumer_db)',
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['scenario']}")(options)
+
+    def bench_chat_list(self, options):
+        self.stdout.write(self.style.WARNING('📊 Список чатов (get_chat_list)'))
+        for rooms in options['rooms']:
+            with transaction.atomic():
+                owner = create_chat_fixture(rooms)
+
+                with CaptureQueriesContext(connection) as queries:
+                    chats = get_chat_list(owner)
+
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    get_chat_list(owner)
+                elapsed_ms = (time.perf_counter() - started) * 1000 / options['repeat']
+
+                self.stdout.write(
+                    f'  🏠 rooms={rooms:<6} chats={len(chats):<6} '
+                    f'queries={len(queries):<3} time={elapsed_ms:.1f} ms'
+                )
+                transaction.set_rollback(True)
+
+    def bench_send_message(self, options):
+        self.stdout.write(self.style.WARNING('📊 Отправка сообщения (send_message): одна транзакция на сообщение'))
+        with transaction.atomic():
+            owner = create_chat_fixture(1)
+            room = PrivateChatRoom.objects.get(user1=owner)
+            reply_to = PrivateMessage.objects.filter(room=room).first()
+
+            RoomParticipantsCache.invalidate(room.id)
+            with CaptureQueriesContext(connection) as cold_queries:
+                send_message(owner, room.id, 'cold')
+
+            with CaptureQueriesContext(connection) as queries:
+                send_message(owner, room.id, 'reply', reply_to_message_id=reply_to.id)
+
+            started = time.perf_counter()
+            for i in range(options['repeat']):
+                send_message(owner, room.id, f'message {i}')
+            elapsed_ms = (time.perf_counter() - started) * 1000 / options['repeat']
+
+            self.stdout.write(
+                f'  ✉️  cold cache queries={len(cold_queries):<3} '
+                f'warm reply queries={len(queries):<3} time={elapsed_ms:.2f} ms'
+            )
+            transaction.set_rollback(True)
+
+    def bench_consumer_db(self, options):
+        """
+        Пропускная способность event loop и p99 для запросов consumer'ов, которые идут через
+        run_query/fetch_all: database_sync_to_async против async ORM (CHAT_DB['ASYNC_ORM']).
+        Отправка и прочтение сообщения - транзакции, они в обоих режимах идут через
+        database_sync_to_async и в сравнение не входят.
+        Данные фиксируются в БД (async ORM работает в отдельном потоке) и удаляются в конце.
+        """
+        self.stdout.write(self.style.WARNING('📊 Запросы consumer\'ов: database_sync_to_async vs async ORM'))
+        owner = create_chat_fixture(1)
+        room = PrivateChatRoom.objects.get(user1=owner)
+        try:
+            for async_orm in (False, True):
+                with override_settings(CHAT_DB={'ASYNC_ORM': async_orm}):
+                    for operation in ('message_lookup', 'room_access', 'sender_names'):
+                        latencies, elapsed = async_to_sync(self.run_consumer_db)(
+                            operation, owner, room, options['repeat'] * 20, options['concurrency']
+                        )
+                        p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+                        self.stdout.write(
+                            f'  🔀 async_orm={str(async_orm):<5} {operation:<12} '
+                            f'ops/s={len(latencies) / elapsed:<8.0f} '
+                            f'p50={statistics.median(latencies):.2f} ms p99={p99:.2f} ms'
+                        )
+        finally:
+            CustomUser.objects.filter(id__in=[room.user1_id, room.user2_id]).delete()
+
+    async def run_consumer_db(self, operation, owner, room, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def message_lookup(i):
+            # Проверка получателя в PrivateChatConsumer.mark_message_as_read_in_db
+            await run_query(
+                PrivateMessage.objects.values('recipient_id', 'sender_id', 'read', 'room_id'), 'get', id=message_ids[i]
+            )
+
+        async def room_access(i):
+            # MultiplexConsumer.is_room_participant при подписке на комнату
+            await run_query(PrivateChatRoom.objects.filter(
+                Q(user1_id=owner.id) | Q(user2_id=owner.id), id=room.id
+            ), 'exists')
+
+        async def sender_names(i):
+            # NotificationConsumer.get_sender_names при resync
+            await fetch_all(CustomUser.objects.filter(id__in=[room.user1_id, room.user2_id]).values_list('id', 'username'))
+
+        message_ids = []
+        if operation == 'message_lookup':
+            message_ids = await database_sync_to_async(lambda: [
+                message.id for message in PrivateMessage.objects.bulk_create([
+                    PrivateMessage(room=room, sender=owner, recipient_id=room.user2_id, message=f'unread {i}')
+                    for i in range(total)
+                ])
+            ])()
+        handler = {'message_lookup': message_lookup, 'room_access': room_access, 'sender_names': sender_names}[operation]
+
+        async def timed(i):
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(i)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(i) for i in range(total)))
+        return latencies, time.perf_counter() - started
+
+    def bench_ingest(self, options):
+        """
+        Пропускная способность записи сообщений: синхронный send_message против write-behind
+        (XADD в stream на стороне consumer'а и bulk_create пачками на стороне chat_ingest_worker).
+        """
+        self.stdout.write(self.style.WARNING('📊 Запись сообщений: send_message vs Redis stream + bulk_create'))
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.ERROR('  Write-behind требует PostgreSQL'))
+            return
+
+        total = options['repeat'] * 100
+        owner = create_chat_fixture(1)
+        room = PrivateChatRoom.objects.get(user1=owner)
+        stream = f'chat:ingest:bench:{uuid.uuid4().hex[:8]}'
+        try:
+            started = time.perf_counter()
+            for i in range(total):
+                send_message(owner, room.id, f'sync {i}')
+            sync_elapsed = time.perf_counter() - started
+
+            with override_settings(CHAT_INGEST={'MODE': 'stream', 'STREAM': stream}):
+                started = time.perf_counter()
+                async_to_sync(self.run_enqueue)(owner, room, total)
+                enqueue_elapsed = time.perf_counter() - started
+
+                entries = get_sync_redis().xrange(stream)
+                started = time.perf_counter()
+                for offset in range(0, len(entries), 200):
+                    ingest.persist_batch(entries[offset:offset + 200])
+                persist_elapsed = time.perf_counter() - started
+
+            self.stdout.write(f'  ✉️  messages={total}')
+            self.stdout.write(f'  🐢 send_message        {total / sync_elapsed:>8.0f} msg/s')
+            self.stdout.write(f'  📥 enqueue (sender)    {total / enqueue_elapsed:>8.0f} msg/s')
+            self.stdout.write(f'  💾 bulk persist        {total / persist_elapsed:>8.0f} msg/s')
+        finally:
+            get_sync_redis().delete(stream)
+            CustomUser.objects.filter(id__in=[room.user1_id, room.user2_id]).delete()
+
+    async def run_enqueue(self, owner, room, total):
+        for i in range(total):
+            await ingest.enqueue_message(owner, room.id, f'stream {i}')
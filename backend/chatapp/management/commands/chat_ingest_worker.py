@@ -0,0 +1,128 @@
+import logging
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from redis.exceptions import ResponseError
+
+from chatapp.services import ingest
+from chatapp.services.redis_client import get_sync_redis
+
+logger = logging.getLogger('chatapp.ingest')
+
+
+class Command(BaseCommand):
+    help = 'Write-behind запись сообщений: читает Redis stream CHAT_INGEST и сохраняет PrivateMessage пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Количество потоков-потребителей stream',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Максимум сообщений в одном bulk_create',
+        )
+        parser.add_argument(
+            '--block-ms',
+            type=int,
+            default=1000,
+            help='Сколько ждать новых сообщений в одном XREADGROUP',
+        )
+        parser.add_argument(
+            '--claim-idle-ms',
+            type=int,
+            default=30000,
+            help='Через сколько забирать неподтвержденные сообщения упавших потребителей',
+        )
+
+    def handle(self, *args, **options):
+        redis = get_sync_redis()
+        try:
+            redis.xgroup_create(ingest.stream_name(), ingest.group_name(), id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+        threads = [
+            threading.Thread(target=self.consume, args=(f'{socket.gethostname()}-{i}', stop, options), daemon=True)
+            for i in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(self.style.SUCCESS(
+            f"📥 Ingest workers started: {options['workers']} on stream {ingest.stream_name()}"
+        ))
+        for thread in threads:
+            thread.join()
+
+    def consume(self, consumer, stop, options):
+        redis = get_sync_redis()
+        stream, group = ingest.stream_name(), ingest.group_name()
+
+        # Сначала свои неподтвержденные записи после перезапуска
+        self.process(redis.xreadgroup(group, consumer, {stream: '0'}, count=options['batch_size']))
+
+        next_claim = 0
+        while not stop.is_set():
+            try:
+                # Записи упавших потребителей и пачки, которые не удалось сохранить, повторяем
+                # не реже раза в claim_idle_ms
+                if time.monotonic() >= next_claim:
+                    self.claim_pending(redis, consumer, stop, options)
+                    next_claim = time.monotonic() + options['claim_idle_ms'] / 1000
+
+                self.process(redis.xreadgroup(
+                    group, consumer, {stream: '>'}, count=options['batch_size'], block=options['block_ms']
+                ))
+            except Exception as e:
+                logger.error("📥 [INGEST] %s: error reading stream: %s", consumer, e)
+                stop.wait(1)
+
+    def claim_pending(self, redis, consumer, stop, options):
+        """XAUTOCLAIM всех записей, которые пролежали в pending дольше claim_idle_ms, включая свои"""
+        stream, group = ingest.stream_name(), ingest.group_name()
+        start_id = '0-0'
+        while not stop.is_set():
+            start_id, entries, *_ = redis.xautoclaim(
+                stream, group, consumer, options['claim_idle_ms'], start_id, count=options['batch_size']
+            )
+            self.process([[stream, entries]])
+            if start_id == '0-0':
+                break
+
+    def process(self, response):
+        for _, entries in response or []:
+            # Удаленные по MAXLEN записи приходят без полей
+            entries = [(stream_id, fields) for stream_id, fields in entries if fields]
+            if entries:
+                self.persist(entries)
+
+    def persist(self, entries):
+        close_old_connections()
+        try:
+            rows = ingest.persist_batch(entries)
+        except Exception as e:
+            if len(entries) > 1:
+                # Одна плохая запись не должна держать всю пачку: сохраняем половины отдельно
+                logger.warning("📥 [INGEST] Error persisting %s messages, splitting batch: %s", len(entries), e)
+                middle = len(entries) // 2
+                self.persist(entries[:middle])
+                self.persist(entries[middle:])
+            else:
+                # Без XACK запись останется в pending и будет повторена ближайшим claim_pending
+                logger.error("📥 [INGEST] Error persisting message %s: %s", entries[0][0], e)
+            return
+        ingest.acknowledge(entries, rows)
+        logger.debug("📥 [INGEST] Persisted %s messages", len(rows))
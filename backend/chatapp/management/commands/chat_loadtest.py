@@ -0,0 +1,364 @@
+import asyncio
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from authapp.models import CustomUser
+from chatapp.models import PrivateChatRoom
+from chatapp.routing import websocket_urlpatterns
+from chatapp.services.membership import RoomMemberships
+from chatapp.services.redis_client import get_sync_redis
+
+# Бюджеты rate limit на время нагрузочного теста: иначе тест измеряет отказы, а не горячий путь
+UNLIMITED_RATE_LIMITS = {
+    bucket: {'RATE': 100000, 'BURST': 100000} for bucket in ('message', 'read', 'control')
+}
+
+
+class QueryCounter:
+    """
+    Счетчик SQL запросов всех потоков процесса: database_sync_to_async открывает
+    соединение в своем потоке, поэтому CaptureQueriesContext одного соединения не подходит.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.install)
+        self.install(connection=connection)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self.install)
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+
+
+def redis_calls():
+    """Сумма вызовов всех команд Redis по INFO commandstats (сервер общий для channel layer и чата)"""
+    stats = get_sync_redis().info('commandstats')
+    return sum(value['calls'] for value in stats.values())
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def with_user(application, user):
+    """ASGI обертка вместо HybridAuthMiddleware: пользователь подставляется в scope напрямую"""
+    async def app(scope, receive, send):
+        return await application(dict(scope, user=user), receive, send)
+    return app
+
+
+class LoadClient:
+    """Одно соединение пользователя с комнатой: отправка кадров и разбор входящих сообщений"""
+
+    def __init__(self, run, user, room_id):
+        self.run = run
+        self.user = user
+        self.room_id = room_id
+        self.communicator = None
+        self.reader = None
+        self.last_seq = 0
+
+    async def connect(self):
+        self.communicator = WebsocketCommunicator(
+            with_user(self.run.application, self.user), f'/wss/private/{self.room_id}/'
+        )
+        connected, _ = await self.communicator.connect(timeout=self.run.timeout)
+        if not connected:
+            raise CommandError(f'WebSocket connection to room {self.room_id} rejected')
+        self.reader = asyncio.get_running_loop().create_task(self.read())
+
+    async def disconnect(self):
+        if self.reader:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
+        await self.communicator.disconnect(timeout=self.run.timeout)
+
+    async def reconnect(self):
+        """Разрыв и переподключение с догоняющей синхронизацией по last_seq"""
+        await self.disconnect()
+        self.run.reconnects += 1
+        await self.connect()
+        await self.send({'type': 'resume', 'room_id': self.room_id, 'last_seq': self.last_seq})
+
+    async def send(self, frame):
+        await self.communicator.send_to(text_data=json.dumps(frame))
+
+    async def read(self):
+        while True:
+            try:
+                frame = json.loads(await self.communicator.receive_from(timeout=3600))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                return
+
+            if frame.get('type') == 'resume':
+                self.last_seq = max(self.last_seq, frame.get('last_seq') or 0)
+                for message in frame.get('messages', []):
+                    self.receive_message(message, resumed=True)
+            elif frame.get('type') in ('rate_limited', 'resync_required') or 'error' in frame:
+                kind = frame['type'] if frame.get('type') in self.run.errors else 'error'
+                self.run.errors[kind] += 1
+            elif 'message' in frame and 'sender_id' in frame:
+                self.receive_message(frame)
+
+    def receive_message(self, frame, resumed=False):
+        if frame.get('seq'):
+            self.last_seq = max(self.last_seq, frame['seq'])
+        if frame.get('sender_id') == self.user.id:
+            return
+        self.run.message_received(frame, resumed)
+
+        # Часть входящих сообщений получатель сразу отмечает прочитанными
+        if frame.get('id') and self.run.random.random() < self.run.read_ratio:
+            self.run.pending.append(asyncio.get_running_loop().create_task(
+                self.send({'type': 'mark_as_read', 'message_id': frame['id']})
+            ))
+
+
+class LoadRun:
+    """Состояние одного прогона: отправленные маркеры, задержки доставки и счетчики"""
+
+    def __init__(self, options):
+        self.application = URLRouter(websocket_urlpatterns)
+        self.timeout = options['timeout']
+        self.read_ratio = options['read_ratio']
+        self.random = random.Random(options['seed'])
+        self.sent_at = {}  # маркер сообщения -> perf_counter() отправки
+        self.latencies = []
+        self.received = 0
+        self.resumed = 0
+        self.reconnects = 0
+        self.errors = {'error': 0, 'rate_limited': 0, 'resync_required': 0}
+        self.pending = []
+        self.all_received = asyncio.Event()
+
+    def message_received(self, frame, resumed):
+        sent_at = self.sent_at.pop(frame.get('message', ''), None)
+        if sent_at is None:
+            return
+        if resumed:
+            # Сообщения, пришедшие через resume, ждали переподключения - в задержку не входят
+            self.resumed += 1
+        else:
+            self.received += 1
+            self.latencies.append((time.perf_counter() - sent_at) * 1000)
+        if not self.sent_at:
+            self.all_received.set()
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест WebSocket чата: N пользователей в M личных комнатах отправляют текст, '
+        'медиа по ссылке, отметки о прочтении и переподключаются. Результат - JSON для сравнения прогонов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Количество пользователей')
+        parser.add_argument('--rooms', type=int, default=10, help='Количество личных комнат (пары пользователей)')
+        parser.add_argument('--messages', type=int, default=50, help='Сообщений в каждой комнате')
+        parser.add_argument('--rate', type=float, default=0, help='Сообщений в секунду на комнату, 0 - без пауз')
+        parser.add_argument('--media-ratio', type=float, default=0.1, help='Доля медиа-сообщений')
+        parser.add_argument('--read-ratio', type=float, default=0.5, help='Доля сообщений, отмечаемых прочитанными')
+        parser.add_argument('--reconnect-ratio', type=float, default=0.02,
+                            help='Вероятность переподключения получателя после сообщения')
+        parser.add_argument('--timeout', type=float, default=30, help='Ожидание доставки и соединений, сек')
+        parser.add_argument('--seed', type=int, default=0, help='Seed генератора случайных чисел')
+        parser.add_argument('--keep-rate-limits', action='store_true',
+                            help='Не отключать CHAT_RATE_LIMITS на время теста')
+        parser.add_argument('--output', default='chat_loadtest.json', help='Файл с результатами (JSON)')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        users, rooms = self.create_fixture(options['users'], options['rooms'])
+        try:
+            settings_override = {} if options['keep_rate_limits'] else {'CHAT_RATE_LIMITS': UNLIMITED_RATE_LIMITS}
+            with override_settings(**settings_override), QueryCounter() as queries:
+                redis_before = redis_calls()
+                run, elapsed = async_to_sync(self.run_load)(users, rooms, options)
+                redis_ops = redis_calls() - redis_before - 1
+        finally:
+            CustomUser.objects.filter(id__in=[user.id for user in users]).delete()
+
+        result = self.build_result(options, run, elapsed, queries.count, redis_ops)
+        with open(options['output'], 'w') as output:
+            json.dump(result, output, indent=2)
+
+        self.print_result(result)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                self.print_comparison(json.load(baseline), result)
+        self.stdout.write(self.style.SUCCESS(f"💾 Результаты записаны в {options['output']}"))
+
+    def create_fixture(self, user_count, room_count):
+        pairs = list(itertools.islice(itertools.combinations(range(user_count), 2), room_count))
+        if len(pairs) < room_count:
+            raise CommandError(f'{user_count} пользователей хватает только на {len(pairs)} комнат')
+
+        prefix = uuid.uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'load_{prefix}_{i}', email=f'load_{prefix}_{i}@bench.local')
+            for i in range(user_count)
+        ])
+        rooms = PrivateChatRoom.objects.bulk_create([
+            PrivateChatRoom(user1=users[a], user2=users[b], name=f'private_chat_{users[a].id}_{users[b].id}')
+            for a, b in pairs
+        ])
+        # bulk_create не вызывает post_save, который создает строки участников
+        RoomMemberships.create_for_rooms(rooms)
+        return users, rooms
+
+    async def run_load(self, users, rooms, options):
+        run = LoadRun(options)
+        clients = []
+        for room in rooms:
+            pair = [LoadClient(run, room.user1, room.id), LoadClient(run, room.user2, room.id)]
+            for client in pair:
+                await client.connect()
+            clients.append(pair)
+
+        interval = 1 / options['rate'] if options['rate'] else 0
+
+        async def room_traffic(pair):
+            for i in range(options['messages']):
+                sender, recipient = pair[i % 2], pair[1 - i % 2]
+                marker = f'load {uuid.uuid4().hex}'
+                if run.random.random() < options['media_ratio']:
+                    frame = {
+                        'type': 'media_message',
+                        'message': marker,
+                        'mediaType': 'image',
+                        'mediaHash': uuid.uuid4().hex,
+                        'mediaFileName': 'load.jpg',
+                        'mediaSize': 1024,
+                    }
+                else:
+                    frame = {'type': 'chat_message', 'message': marker}
+
+                run.sent_at[marker] = time.perf_counter()
+                await sender.send(frame)
+
+                if run.random.random() < options['reconnect_ratio']:
+                    await recipient.reconnect()
+                if interval:
+                    await asyncio.sleep(interval)
+                else:
+                    await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(room_traffic(pair) for pair in clients))
+        # Событие могло сработать посреди прогона, когда все отправленные на тот момент уже дошли
+        run.all_received.clear()
+        if run.sent_at:
+            try:
+                await asyncio.wait_for(run.all_received.wait(), timeout=options['timeout'])
+            except asyncio.TimeoutError:
+                pass
+        elapsed = time.perf_counter() - started
+
+        await asyncio.gather(*run.pending, return_exceptions=True)
+        for client in itertools.chain.from_iterable(clients):
+            await client.disconnect()
+        return run, elapsed
+
+    def build_result(self, options, run, elapsed, query_count, redis_ops):
+        sent = options['rooms'] * options['messages']
+        delivered = run.received + run.resumed
+        return {
+            'scenario': 'chat_loadtest',
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'config': {
+                key: options[key] for key in (
+                    'users', 'rooms', 'messages', 'rate', 'media_ratio', 'read_ratio', 'reconnect_ratio', 'seed'
+                )
+            },
+            'messages': {
+                'sent': sent,
+                'delivered': run.received,
+                'resumed': run.resumed,
+                'lost': len(run.sent_at),
+            },
+            'throughput_msgs_per_sec': round(delivered / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                name: round(value, 2) if value is not None else None
+                for name, value in (
+                    ('p50', percentile(run.latencies, 50)),
+                    ('p95', percentile(run.latencies, 95)),
+                    ('p99', percentile(run.latencies, 99)),
+                    ('max', max(run.latencies) if run.latencies else None),
+                )
+            },
+            # Включают отметки о прочтении, соединения и resume - полная стоимость сообщения на сервере
+            'db_queries_per_message': round(query_count / sent, 2) if sent else None,
+            'redis_ops_per_message': round(redis_ops / sent, 2) if sent else None,
+            'reconnects': run.reconnects,
+            'errors': run.errors,
+            'elapsed_sec': round(elapsed, 3),
+        }
+
+    def print_result(self, result):
+        latency = result['latency_ms']
+        self.stdout.write(self.style.WARNING('📊 Нагрузочный тест WebSocket'))
+        self.stdout.write(
+            f"  ✉️  sent={result['messages']['sent']} delivered={result['messages']['delivered']} "
+            f"resumed={result['messages']['resumed']} lost={result['messages']['lost']} "
+            f"reconnects={result['reconnects']}"
+        )
+        self.stdout.write(f"  🚀 {result['throughput_msgs_per_sec']} msg/s")
+        self.stdout.write(
+            f"  ⏱  p50={latency['p50']} ms p95={latency['p95']} ms p99={latency['p99']} ms max={latency['max']} ms"
+        )
+        self.stdout.write(
+            f"  💾 queries/msg={result['db_queries_per_message']} 🧰 redis ops/msg={result['redis_ops_per_message']}"
+        )
+        if any(result['errors'].values()):
+            self.stdout.write(self.style.ERROR(f"  ❌ errors={result['errors']}"))
+
+    def print_comparison(self, baseline, result):
+        self.stdout.write(self.style.WARNING('📈 Сравнение с базовым прогоном'))
+        metrics = [
+            ('throughput_msgs_per_sec', baseline.get('throughput_msgs_per_sec'), result['throughput_msgs_per_sec']),
+            ('db_queries_per_message', baseline.get('db_queries_per_message'), result['db_queries_per_message']),
+            ('redis_ops_per_message', baseline.get('redis_ops_per_message'), result['redis_ops_per_message']),
+        ] + [
+            (f'latency_ms.{name}', baseline.get('latency_ms', {}).get(name), result['latency_ms'][name])
+            for name in ('p50', 'p95', 'p99')
+        ]
+        for name, before, after in metrics:
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0
+            self.stdout.write(f'  {name:<26} {before:>10} -> {after:<10} ({change:+.1f}%)')
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chatapp.models import RoomMembership
+from chatapp.services.membership import RoomMemberships
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает RoomMembership (непрочитанные, последнее сообщение, водяной знак прочтения) из сообщений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--room',
+            type=int,
+            nargs='+',
+            dest='rooms',
+            help='id комнат, по умолчанию все',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Показать число строк с расхождениями, не сохраняя пересчет',
+        )
+
+    def handle(self, *args, **options):
+        room_ids = options['rooms']
+        before = self.snapshot(room_ids)
+
+        started = time.perf_counter()
+        if options['dry_run']:
+            with transaction.atomic():
+                rebuilt = RoomMemberships.rebuild(room_ids)
+                after = self.snapshot(room_ids)
+                transaction.set_rollback(True)
+        else:
+            rebuilt = RoomMemberships.rebuild(room_ids)
+            after = self.snapshot(room_ids)
+        elapsed = time.perf_counter() - started
+
+        changed = sum(1 for key, row in after.items() if before.get(key) != row)
+        self.stdout.write(f'👥 Пересчитано строк: {rebuilt} за {elapsed:.1f} с')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'🚨 [DRY RUN] Расходятся с сообщениями: {changed}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✅ Исправлено строк: {changed}'))
+
+    @staticmethod
+    def snapshot(room_ids):
+        memberships = RoomMembership.objects.all()
+        if room_ids:
+            memberships = memberships.filter(room_id__in=room_ids)
+        return {
+            (row[0], row[1]): row[2:]
+            for row in memberships.values_list(
+                'room_id', 'user_id', 'unread_count', 'last_message_id', 'last_read_message_id'
+            ).iterator()
+        }
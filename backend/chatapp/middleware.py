@@ -4,21 +4,20 @@ from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from django.contrib.auth.models import AnonymousUser
 from django.db import close_old_connections
-from rest_framework.authtoken.models import Token
 from authapp.models import CustomUser
+from authapp.token_cache import TokenUserCache
 from django.contrib.sessions.models import Session
 from django.contrib.auth import get_user_model
 
 logger = logging.getLogger(__name__)
 
 
-@database_sync_to_async
-def get_user_from_token(token_key):
-    try:
-        token = Token.objects.get(key=token_key)
-        return token.user
-    except Token.DoesNotExist:
-        return AnonymousUser()
+async def get_user_from_token(token_key):
+    # Сначала LRU в памяти процесса - без перехода в поток для БД
+    user = TokenUserCache.get_local(token_key)
+    if user is None:
+        user = await database_sync_to_async(TokenUserCache.get_user)(token_key)
+    return user or AnonymousUser()
 
 
 @database_sync_to_async
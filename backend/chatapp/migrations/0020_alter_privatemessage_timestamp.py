@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-16 21:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatapp", "0019_privatemessage_reply_to_media_type_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="privatemessage",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
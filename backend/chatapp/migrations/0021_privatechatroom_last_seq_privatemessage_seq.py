@@ -0,0 +1,46 @@
+# Generated by Django 4.2.6 on 2026-10-16 22:05
+
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    """Нумеруем существующие сообщения каждой комнаты по порядку id"""
+    PrivateChatRoom = apps.get_model("chatapp", "PrivateChatRoom")
+    PrivateMessage = apps.get_model("chatapp", "PrivateMessage")
+
+    for room_id in PrivateChatRoom.objects.values_list("id", flat=True).iterator():
+        message_ids = list(
+            PrivateMessage.objects.filter(room_id=room_id).order_by("id").values_list("id", flat=True)
+        )
+        PrivateMessage.objects.bulk_update(
+            [PrivateMessage(id=message_id, seq=seq) for seq, message_id in enumerate(message_ids, 1)],
+            ["seq"],
+            batch_size=500,
+        )
+        PrivateChatRoom.objects.filter(id=room_id).update(last_seq=len(message_ids))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatapp", "0020_alter_privatemessage_timestamp"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="privatechatroom",
+            name="last_seq",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="privatemessage",
+            name="seq",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="privatemessage",
+            constraint=models.UniqueConstraint(
+                fields=("room", "seq"), name="chatapp_privatemessage_room_seq_uniq"
+            ),
+        ),
+    ]
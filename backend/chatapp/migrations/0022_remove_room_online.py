@@ -0,0 +1,16 @@
+# Generated by Django 4.2.6 on 2026-10-16 23:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatapp", "0021_privatechatroom_last_seq_privatemessage_seq"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="room",
+            name="online",
+        ),
+    ]
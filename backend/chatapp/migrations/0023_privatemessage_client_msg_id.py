@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-17 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatapp", "0022_remove_room_online"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="privatemessage",
+            name="client_msg_id",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="privatemessage",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("client_msg_id__isnull", False)),
+                fields=("sender", "client_msg_id"),
+                name="chatapp_privatemessage_sender_client_msg_uniq",
+            ),
+        ),
+    ]
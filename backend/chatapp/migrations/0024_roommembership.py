@@ -0,0 +1,98 @@
+# Generated by Django 4.2.6 on 2026-10-17 02:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_memberships(apps, schema_editor):
+    """Строки участников существующих комнат со счетчиками, посчитанными по сообщениям"""
+    PrivateChatRoom = apps.get_model("chatapp", "PrivateChatRoom")
+    PrivateMessage = apps.get_model("chatapp", "PrivateMessage")
+    MessageDeletion = apps.get_model("chatapp", "MessageDeletion")
+    RoomMembership = apps.get_model("chatapp", "RoomMembership")
+
+    RoomMembership.objects.bulk_create(
+        [
+            RoomMembership(room_id=room_id, user_id=user_id)
+            for room_id, user1_id, user2_id in PrivateChatRoom.objects.values_list("id", "user1_id", "user2_id").iterator()
+            for user_id in (user1_id, user2_id)
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+    visible = PrivateMessage.objects.filter(room_id=OuterRef("room_id"), is_deleted=False).exclude(
+        Exists(MessageDeletion.objects.filter(user_id=OuterRef(OuterRef("user_id")), message_id=OuterRef("pk")))
+    )
+    RoomMembership.objects.update(
+        unread_count=Coalesce(
+            Subquery(
+                visible.filter(recipient_id=OuterRef("user_id"), read=False)
+                .values("room_id")
+                .annotate(count=Count("id"))
+                .values("count"),
+                output_field=models.IntegerField(),
+            ),
+            Value(0),
+            output_field=models.IntegerField(),
+        ),
+        last_message_id=Subquery(
+            visible.order_by("-id").values("id")[:1], output_field=models.BigIntegerField()
+        ),
+        last_read_message_id=Subquery(
+            PrivateMessage.objects.filter(room_id=OuterRef("room_id"), recipient_id=OuterRef("user_id"), read=True)
+            .order_by("-id")
+            .values("id")[:1],
+            output_field=models.BigIntegerField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("chatapp", "0023_privatemessage_client_msg_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RoomMembership",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("unread_count", models.PositiveIntegerField(default=0)),
+                ("last_read_message_id", models.BigIntegerField(blank=True, null=True)),
+                ("last_message_id", models.BigIntegerField(blank=True, null=True)),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="memberships",
+                        to="chatapp.privatechatroom",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="room_memberships",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["user", "-last_message_id"], name="chatapp_membership_user_last")
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="roommembership",
+            constraint=models.UniqueConstraint(
+                fields=("room", "user"), name="chatapp_roommembership_room_user_uniq"
+            ),
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,7 @@ from uuid import uuid4
 
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from pytils.translit import slugify
 
 from authapp.models import CustomUser
@@ -22,25 +23,18 @@ def unique_slugify(instance, slug):
 
 class Room(models.Model):
     name = models.CharField(max_length=128, verbose_name='Название комнаты')
-    online = models.ManyToManyField(to=CustomUser)
     slug = models.CharField(verbose_name="URL-адрес", max_length=128)
 
     def get_online_count(self):
-        return self.online.count()
-
-    def join(self, user):
-        self.online.add(user)
-        self.save()
-
-    def leave(self, user):
-        self.online.remove(user)
-        self.save()
+        """Кто в комнате, хранится в Redis (chatapp.services.room_presence), а не в БД"""
+        from chatapp.services.room_presence import RoomPresence
+        return RoomPresence.count_sync(self.id)
 
     def get_message(self):
         return self.message_set.filter(timestamp__month__gt=1).all()
 
     def __str__(self):
-        return f'{self.name} ({self.get_online_count()} online)'
+        return self.name
 
     def save(self, *args, **kwargs):
         """
@@ -71,6 +65,8 @@ class PrivateChatRoom(models.Model):
     user2 = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='private_chat_room2')
     created_at = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=255, unique=True, blank=True)
+    # Последний выданный номер сообщения комнаты (PrivateMessage.seq)
+    last_seq = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user1.username} and {self.user2.username}"
@@ -104,9 +100,14 @@ class PrivateMessage(models.Model):
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='recipient', default=None)
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Не auto_now_add: write-behind сохраняет время, с которым сообщение уже разослано
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
+    # Номер сообщения в комнате без пропусков: курсор для синхронизации после переподключения
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
+    # Id, назначенный клиентом: повторная отправка того же сообщения не создает новую строку
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
 
     # Поля для медиафайлов
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES, default='text')
@@ -168,6 +169,14 @@ class PrivateMessage(models.Model):
             models.Index(fields=['media_file']),
             models.Index(fields=['reply_to_message']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'seq'], name='chatapp_privatemessage_room_seq_uniq'),
+            models.UniqueConstraint(
+                fields=['sender', 'client_msg_id'],
+                condition=models.Q(client_msg_id__isnull=False),
+                name='chatapp_privatemessage_sender_client_msg_uniq'
+            ),
+        ]
         ordering = ['timestamp']
 
     def __str__(self):
@@ -245,4 +254,31 @@ class MessageDeletion(models.Model):
         ]
 
     def __str__(self):
-        return f'{self.user.username} deleted message {self.message.id}'
\ No newline at end of file
+        return f'{self.user.username} deleted message {self.message.id}'
+
+
+class RoomMembership(models.Model):
+    """
+    Участник личной комнаты со счетчиками, которые иначе пришлось бы считать по PrivateMessage.
+    Поддерживается отправкой, прочтением и удалением сообщений (chatapp.services.membership),
+    пересобирается из сообщений командой chat_repair_membership.
+    """
+    room = models.ForeignKey(PrivateChatRoom, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='room_memberships')
+    # Непрочитанные видимые пользователю сообщения, адресованные ему
+    unread_count = models.PositiveIntegerField(default=0)
+    # Водяной знак прочтения: максимальный id прочитанного пользователем сообщения
+    last_read_message_id = models.BigIntegerField(null=True, blank=True)
+    # Последнее видимое пользователю сообщение комнаты, None - чата нет в списке
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='chatapp_roommembership_room_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_id'], name='chatapp_membership_user_last'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} in room {self.room_id}: {self.unread_count} unread'
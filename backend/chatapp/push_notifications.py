@@ -6,6 +6,8 @@ from django.conf import settings
 import firebase_admin
 from firebase_admin import credentials, messaging
 
+from backend.logutils import preview
+
 logger = logging.getLogger('chatapp.push_notifications')
 
 logger.info("🔔 [PUSH] === PUSH NOTIFICATIONS MODULE LOADED (FIREBASE) ===")
@@ -53,13 +55,9 @@ class PushNotificationService:
         """
         Отправляет Push-уведомление о новом сообщении ТОЛЬКО через Firebase FCM
         """
-        logger.info(f"🔔 [PUSH] === STARTING FIREBASE FCM PUSH NOTIFICATION ===")
-        logger.info(f"🔔 [PUSH] Received parameters:")
-        logger.info(f"🔔 [PUSH]   fcm_tokens: {fcm_tokens}")
-        logger.info(f"🔔 [PUSH]   tokens count: {len(fcm_tokens)}")
-        logger.info(f"🔔 [PUSH]   sender_name: {sender_name}")
-        logger.info(f"🔔 [PUSH]   message_text: {message_text[:100]}...")
-        logger.info(f"🔔 [PUSH]   chat_id: {chat_id}")
+        # Сами токены не логируем: это учетные данные устройств
+        logger.debug("🔔 [PUSH] Sending FCM push: tokens=%s, sender=%s, chat_id=%s, message='%s'",
+                     len(fcm_tokens), sender_name, chat_id, preview(message_text, 100))
 
         # ПРОВЕРКА 1: Есть ли токены вообще?
         if not fcm_tokens:
@@ -67,23 +65,16 @@ class PushNotificationService:
             cls._suggest_token_migration()
             return False
 
-        logger.info(f"🔔 [PUSH] ✅ CHECK 1 PASSED: {len(fcm_tokens)} tokens provided")
-
         # ПРОВЕРКА 2: Фильтруем и удаляем Expo токены из базы данных
-        logger.info(f"🔔 [PUSH] === TOKEN FILTERING ===")
         expo_tokens = [token for token in fcm_tokens if token.startswith('ExponentPushToken')]
         fcm_tokens_only = [token for token in fcm_tokens if not token.startswith('ExponentPushToken')]
 
-        logger.info(f"🔔 [PUSH] Filtering results:")
-        logger.info(f"🔔 [PUSH]   Original tokens: {len(fcm_tokens)}")
-        logger.info(f"🔔 [PUSH]   Expo tokens found: {len(expo_tokens)}")
-        logger.info(f"🔔 [PUSH]   FCM tokens remaining: {len(fcm_tokens_only)}")
+        logger.debug("🔔 [PUSH] Token filtering: original=%s, expo=%s, fcm=%s",
+                     len(fcm_tokens), len(expo_tokens), len(fcm_tokens_only))
 
         # Массово удаляем все найденные Expo токены
         if expo_tokens:
-            logger.warning(f"🔥 [FCM] 🚨 FOUND {len(expo_tokens)} Expo tokens - cleaning from DB")
-            for i, token in enumerate(expo_tokens):
-                logger.warning(f"🔥 [FCM] Expo token {i+1}: {token[:30]}...")
+            logger.warning("🔥 [FCM] 🚨 FOUND %s Expo tokens - cleaning from DB", len(expo_tokens))
 
             cls._cleanup_expo_tokens(expo_tokens)
             cls._cleanup_all_expo_tokens()
@@ -100,30 +91,17 @@ class PushNotificationService:
             cls._suggest_token_migration()
             return False
 
-        logger.info(f"🔔 [PUSH] ✅ CHECK 3 PASSED: {len(fcm_tokens_only)} valid FCM tokens")
-
-        # Логируем финальные токены которые будут отправлены
-        for i, token in enumerate(fcm_tokens_only):
-            logger.info(f"🔔 [PUSH] Final FCM token {i+1}: {token[:30]}...")
-
-        logger.info(f"🔔 [PUSH] === CALLING _send_firebase_notification ===")
-
         # Отправляем ТОЛЬКО через Firebase FCM
         try:
             fcm_success = cls._send_firebase_notification(fcm_tokens_only, sender_name, message_text, chat_id)
-            logger.info(f"🔔 [PUSH] _send_firebase_notification returned: {fcm_success}")
         except Exception as send_error:
             logger.error(f"🔔 [PUSH] ❌ _send_firebase_notification threw exception: {send_error}")
             fcm_success = False
 
-        logger.info(f"🔔 [PUSH] === FCM PUSH RESULT: {fcm_success} ===")
-
-        # Показываем статистику токенов для отслеживания миграции
-        if not fcm_success:
-            logger.info(f"🔔 [PUSH] Push failed, showing token statistics...")
+        # Статистика токенов - несколько COUNT по всей таблице пользователей, только для отладки
+        if not fcm_success and logger.isEnabledFor(logging.DEBUG):
             cls.get_token_statistics()
-        else:
-            logger.info(f"🔔 [PUSH] ✅ Push notification sent successfully!")
+        logger.info("🔔 [PUSH] FCM push to chat %s: %s", chat_id, 'sent' if fcm_success else 'failed')
 
         return fcm_success
 
@@ -140,24 +118,18 @@ class PushNotificationService:
             return False
 
         # Инициализируем Firebase
-        logger.info(f"🔥 [FCM] Step 1: Initializing Firebase...")
         try:
             cls._initialize_firebase()
-            logger.info(f"🔥 [FCM] ✅ Firebase initialized successfully")
         except Exception as e:
             logger.error(f"🔥 [FCM] ❌ Failed to initialize Firebase: {str(e)}")
             logger.error(f"🔥 [FCM] ❌ Check firebase-service-account.json and project configuration")
             return False
 
-        logger.info(f"🔥 [FCM] Step 2: Creating Firebase message...")
-
         # Ограничиваем длину текста сообщения
         truncated_text = message_text[:100] + "..." if len(message_text) > 100 else message_text
 
         # Создаем сообщение для Firebase
         try:
-            logger.info(f"🔥 [FCM] Creating message payload...")
-
             # Данные для приложения
             data_payload = {
                 "type": "message_notification",
@@ -166,15 +138,13 @@ class PushNotificationService:
                 "sender_name": sender_name,
             }
 
-            logger.info(f"🔥 [FCM] Data payload: {data_payload}")
+            logger.debug("🔥 [FCM] Data payload: %s", data_payload)
 
             # Создаем уведомление
-            logger.info(f"🔥 [FCM] Creating notification object...")
             notification = messaging.Notification(
                 title=f"💬 {sender_name}",
                 body=truncated_text
             )
-            logger.info(f"🔥 [FCM] ✅ Notification object created")
 
             # Настройки для Android
             android_config = messaging.AndroidConfig(
@@ -213,18 +183,13 @@ class PushNotificationService:
             # Отправляем уведомления батчами по 500 штук (лимит Firebase)
             batch_size = 500
 
-            logger.info(f"🔥 [FCM] === STARTING BATCH SENDING ===")
-            logger.info(f"🔥 [FCM] Total tokens: {len(fcm_tokens)}, batch size: {batch_size}")
 
             for i in range(0, len(fcm_tokens), batch_size):
                 batch_tokens = fcm_tokens[i:i + batch_size]
                 batch_num = i // batch_size + 1
 
-                logger.info(f"🔥 [FCM] === PROCESSING BATCH {batch_num} ===")
-                logger.info(f"🔥 [FCM] Batch {batch_num}: {len(batch_tokens)} tokens")
 
                 # Создаем список индивидуальных сообщений
-                logger.info(f"🔥 [FCM] Creating individual messages for batch {batch_num}...")
                 try:
                     messages = []
                     for token in batch_tokens:
@@ -236,13 +201,11 @@ class PushNotificationService:
                             token=token
                         )
                         messages.append(message)
-                    logger.info(f"🔥 [FCM] ✅ {len(messages)} individual messages created for batch {batch_num}")
                 except Exception as msg_error:
                     logger.error(f"🔥 [FCM] ❌ Error creating individual messages: {msg_error}")
                     continue
 
                 try:
-                    logger.info(f"🔥 [FCM] Sending batch {batch_num} to Firebase...")
                     # Отправляем сообщения по одному
                     batch_success_count = 0
                     batch_failed_count = 0
@@ -251,7 +214,7 @@ class PushNotificationService:
                         try:
                             message_id = messaging.send(message)
                             batch_success_count += 1
-                            logger.debug(f"Message sent successfully to token {batch_tokens[idx][:20]}..., ID: {message_id}")
+                            logger.debug("Message sent successfully, ID: %s", message_id)
                         except Exception as send_error:
                             batch_failed_count += 1
                             token = batch_tokens[idx]
@@ -263,8 +226,7 @@ class PushNotificationService:
                                 failed_tokens.append(token)
                                 logger.warning(f"Invalid token detected: {token[:20]}...")
 
-                    logger.info(f"🔥 [FCM] ✅ Batch {batch_num} response received")
-                    logger.info(f"🔥 [FCM] Batch {batch_num} result: {batch_success_count}/{len(batch_tokens)} successful")
+                    logger.debug("🔥 [FCM] Batch %s result: %s/%s successful", batch_num, batch_success_count, len(batch_tokens))
 
                     success_count += batch_success_count
 
@@ -276,15 +238,10 @@ class PushNotificationService:
             for token in failed_tokens:
                 cls._handle_invalid_token(token)
 
-            logger.info(f"🔥 [FCM] === FIREBASE PUSH SUMMARY ===")
-            logger.info(f"🔥 [FCM] Total successful: {success_count}")
-            logger.info(f"🔥 [FCM] Total failed tokens: {len(failed_tokens)}")
-            logger.info(f"🔥 [FCM] Success rate: {(success_count/len(fcm_tokens))*100:.1f}%")
-            logger.info(f"🔔 [PUSH] === FIREBASE PUSH COMPLETED: {success_count} successful ===")
+            logger.debug("🔥 [FCM] Push summary: %s successful, %s invalid tokens of %s",
+                         success_count, len(failed_tokens), len(fcm_tokens))
 
-            final_result = success_count > 0
-            logger.info(f"🔥 [FCM] Final result: {final_result}")
-            return final_result
+            return success_count > 0
 
         except Exception as e:
             logger.error(f"🔥 [FCM] ❌ CRITICAL ERROR creating Firebase message: {str(e)}")
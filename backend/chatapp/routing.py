@@ -1,8 +1,10 @@
 from django.urls import re_path
 
-from chatapp.consumers import PrivateChatConsumer, NotificationConsumer, ChatConsumer, ChatListConsumer
+from chatapp.consumers import PrivateChatConsumer, NotificationConsumer, ChatConsumer, ChatListConsumer, \
+    MultiplexConsumer
 
 websocket_urlpatterns = [
+    re_path(r"^wss/$", MultiplexConsumer.as_asgi()),
     re_path(r"^wss/notification/", NotificationConsumer.as_asgi()),
     re_path(r'^wss/chat/(?P<room_name>[^/]+)', ChatConsumer.as_asgi()),
     re_path(r'^wss/private/(?P<room_name>[^/]+)',PrivateChatConsumer.as_asgi()),
@@ -1,11 +1,57 @@
+import logging
+
 from rest_framework import serializers
 from .models import PrivateChatRoom, PrivateMessage, CustomUser
+from .services.presence import PresenceRegistry
+
+logger = logging.getLogger('chatapp.serializers')
+
+
+def live_presence(user_ids):
+    """{user_id: (is_online, last_seen)} из Redis; при недоступности Redis - пусто, остаются значения из БД"""
+    try:
+        return PresenceRegistry.live_status_sync(user_ids)
+    except Exception as e:
+        logger.error(f"Error reading live presence: {e}")
+        return {}
+
+
+class LivePresenceListSerializer(serializers.ListSerializer):
+    """Статус всех пользователей списка одним pipeline к Redis"""
+
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, 'all') else data)
+        self.child.context.setdefault('live_presence', {}).update(live_presence(user.id for user in users))
+        return [self.child.to_representation(user) for user in users]
+
+
+class LivePresenceMixin:
+    """
+    is_online и last_seen пользователя из Redis: поля CustomUser записываются пакетно
+    с задержкой (PresenceRegistry.flush). Статусы можно передать заранее в context['live_presence'].
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        presence = self.context.get('live_presence', {})
+        if instance.id not in presence:
+            presence = live_presence([instance.id])
+        if instance.id not in presence:
+            return data
+
+        is_online, last_seen = presence[instance.id]
+        if 'is_online' in data:
+            data['is_online'] = is_online
+        if 'last_seen' in data and last_seen is not None:
+            data['last_seen'] = self.fields['last_seen'].to_representation(last_seen)
+        return data
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(LivePresenceMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['id', 'username', 'avatar', 'gender', 'is_online', 'first_name', 'last_name']
+        list_serializer_class = LivePresenceListSerializer
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -25,15 +71,13 @@ class MessageSerializer(serializers.ModelSerializer):
     reply_to_media_type = serializers.CharField(read_only=True)
 
     def get_reply_to_message_id(self, obj):
-        """Получаем ID сообщения, на которое был ответ"""
-        if obj.reply_to_message:
-            return obj.reply_to_message.id
-        return None
+        """Получаем ID сообщения, на которое был ответ (без загрузки самого сообщения)"""
+        return obj.reply_to_message_id
 
     class Meta:
         model = PrivateMessage
         fields = [
-            'id', 'message', 'sender__username', 'timestamp', 'read', 'sender_id',
+            'id', 'seq', 'message', 'sender__username', 'timestamp', 'read', 'sender_id',
             'mediaType', 'mediaHash', 'mediaFileName', 'mediaSize',
             'reply_to_message_id', 'reply_to_message', 'reply_to_sender', 'reply_to_media_type'
         ]
@@ -54,4 +98,5 @@ class ChatPreviewSerializer(serializers.Serializer):
     other_user = UserSerializer(read_only=True)
     last_message = serializers.CharField()
     last_message_time = serializers.DateTimeField()
+    last_message_id = serializers.IntegerField(required=False)
     unread_count = serializers.IntegerField()
\ No newline at end of file
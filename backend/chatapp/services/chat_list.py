@@ -0,0 +1,122 @@
+from django.db.models import Exists, OuterRef
+
+from chatapp.models import MessageDeletion, PrivateMessage, RoomMembership
+
+MEDIA_PREVIEW_TEXT = {
+    'image': '📷 Изображение',
+    'video': '🎥 Видео',
+    'document': '📄 Документ',
+    'other': '📎 Файл',
+}
+
+
+def visible_messages(user):
+    """Сообщения, видимые пользователю: без глобально удаленных и удаленных им для себя"""
+    return PrivateMessage.objects.filter(is_deleted=False).exclude(
+        Exists(MessageDeletion.objects.filter(user=user, message=OuterRef('pk')))
+    )
+
+
+def get_chat_list(user, limit=None, before=None, room_id=None):
+    """
+    Список чатов пользователя с последним видимым сообщением и числом непрочитанных.
+
+    Последнее сообщение и счетчик непрочитанных хранятся в RoomMembership пользователя,
+    поэтому запросов два при любом количестве комнат: строки участника с комнатами
+    (индекс user, -last_message_id) и одна выборка последних сообщений.
+    Чаты отсортированы по последней активности; курсором служит last_message_id
+    последнего чата предыдущей страницы (before), id сообщений растут вместе со временем.
+    room_id ограничивает выборку одной комнатой (строка для chat_list_delta).
+    """
+    memberships = RoomMembership.objects.filter(
+        user=user,
+        # Показываем только чаты с сообщениями
+        last_message_id__isnull=False
+    ).select_related('room__user1', 'room__user2').order_by('-last_message_id')
+
+    if room_id is not None:
+        memberships = memberships.filter(room_id=room_id)
+    if before is not None:
+        memberships = memberships.filter(last_message_id__lt=before)
+    if limit is not None:
+        memberships = memberships[:limit]
+
+    memberships = list(memberships)
+    # Не in_bulk: он разбивает большой список id на пачки, и число запросов растет с числом комнат
+    messages = {
+        message.id: message
+        for message in PrivateMessage.objects.filter(id__in=[membership.last_message_id for membership in memberships])
+    }
+
+    return [_chat(membership, messages) for membership in memberships if membership.last_message_id in messages]
+
+
+def get_room_chats(room_ids):
+    """
+    Строки комнат room_ids в списках чатов обоих участников: {(room_id, user_id): chat}
+    в формате get_chat_list. Два запроса на любое число комнат; комнаты без видимых
+    пользователю сообщений в результат не попадают.
+    """
+    memberships = list(RoomMembership.objects.filter(
+        room_id__in=room_ids,
+        last_message_id__isnull=False
+    ).select_related('room__user1', 'room__user2'))
+    messages = {
+        message.id: message
+        for message in PrivateMessage.objects.filter(id__in=[membership.last_message_id for membership in memberships])
+    }
+    return {
+        (membership.room_id, membership.user_id): _chat(membership, messages)
+        for membership in memberships
+        if membership.last_message_id in messages
+    }
+
+
+def _chat(membership, messages):
+    room = membership.room
+    return {
+        'room': room,
+        'other_user': room.user2 if room.user1_id == membership.user_id else room.user1,
+        'last_message': messages[membership.last_message_id],
+        'unread_count': membership.unread_count,
+    }
+
+
+def preview_text(message):
+    """Текст последнего сообщения для превью: медиа заменяется подписью"""
+    return MEDIA_PREVIEW_TEXT.get(message.media_type) or message.message or '📎 Медиафайл'
+
+
+def format_chat_for_socket(chat):
+    """Элемент списка чатов для WebSocket (ChatListConsumer)"""
+    other_user = chat['other_user']
+    last_message = chat['last_message']
+    return {
+        'id': chat['room'].id,
+        'other_user': {
+            'id': other_user.id,
+            'username': other_user.username,
+            'first_name': getattr(other_user, 'first_name', ''),
+            'last_name': getattr(other_user, 'last_name', ''),
+            'avatar': other_user.avatar.url if hasattr(other_user, 'avatar') and other_user.avatar else None,
+            'gender': getattr(other_user, 'gender', 'male'),
+            'is_online': getattr(other_user, 'is_online', 'offline')
+        },
+        'last_message': last_message.message,
+        'last_message_time': last_message.timestamp.isoformat(),
+        'last_message_id': last_message.id,
+        'unread_count': chat['unread_count']
+    }
+
+
+def format_chat_preview(chat):
+    """Элемент списка чатов для ChatPreviewSerializer"""
+    last_message = chat['last_message']
+    return {
+        'id': chat['room'].id,
+        'other_user': chat['other_user'],
+        'last_message': preview_text(last_message),
+        'last_message_time': last_message.timestamp,
+        'last_message_id': last_message.id,
+        'unread_count': chat['unread_count']
+    }
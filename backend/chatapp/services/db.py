@@ -0,0 +1,77 @@
+import sqlite3
+import time
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, connection
+
+
+def async_orm_enabled():
+    """
+    CHAT_DB['ASYNC_ORM'] = True - горячие запросы consumer'ов идут через async ORM Django
+    (aget, aexists, aupdate, async for), иначе через database_sync_to_async.
+    """
+    return getattr(settings, 'CHAT_DB', {}).get('ASYNC_ORM', False)
+
+
+def _connection_check_interval():
+    return getattr(settings, 'CHAT_DB', {}).get('CONNECTION_CHECK_INTERVAL', 60)
+
+
+_next_connection_check = 0
+
+
+async def _check_connections():
+    """
+    database_sync_to_async закрывает устаревшие соединения до и после каждого вызова, async ORM - нет.
+    Для него то же делаем не чаще раза в CONNECTION_CHECK_INTERVAL секунд: иначе соединение
+    старше CONN_MAX_AGE или разорванное БД так и останется в потоке, и запросы будут падать.
+    close_old_connections выполняется в том же потоке БД, что и запросы async ORM.
+    """
+    global _next_connection_check
+    now = time.monotonic()
+    if now < _next_connection_check:
+        return
+    _next_connection_check = now + _connection_check_interval()
+    await sync_to_async(close_old_connections)()
+
+
+async def _run_async(call):
+    await _check_connections()
+    try:
+        return await call()
+    except (InterfaceError, OperationalError):
+        # Сломанное соединение закрываем сразу, следующий запрос откроет новое
+        await sync_to_async(close_old_connections)()
+        raise
+
+
+async def run_query(queryset, method, *args, **kwargs):
+    """
+    Выполняет метод QuerySet (get, first, exists, count, update, ...) выбранным путем.
+    database_sync_to_async проверяет и закрывает устаревшие соединения до и после каждого
+    вызова; async ORM переходит в поток БД без этой работы, а проверку соединений
+    делает раз в CONNECTION_CHECK_INTERVAL и после ошибки соединения.
+    """
+    if async_orm_enabled():
+        return await _run_async(lambda: getattr(queryset, f'a{method}')(*args, **kwargs))
+    return await database_sync_to_async(getattr(queryset, method))(*args, **kwargs)
+
+
+async def fetch_all(queryset):
+    """Все строки QuerySet списком"""
+    if async_orm_enabled():
+        async def collect():
+            return [row async for row in queryset]
+        return await _run_async(collect)
+    return await database_sync_to_async(list)(queryset)
+
+
+def supports_update_returning():
+    """UPDATE ... RETURNING: PostgreSQL и SQLite с 3.35"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 35)
+    return False
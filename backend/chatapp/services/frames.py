@@ -0,0 +1,115 @@
+import json
+
+# Кадр клиента, закодированный отправителем события один раз для всех получателей
+FRAME_KEY = 'frame'
+
+
+def room_message_frame(event):
+    """Сообщение групповой комнаты (ChatConsumer)"""
+    return {
+        'message': event['message'],
+        'username': event['username'],
+        'timestamp': event['timestamp']
+    }
+
+
+def presence_summary_frame(event):
+    return {
+        'type': 'presence_summary',
+        'joined': event['joined'],
+        'left': event['left'],
+        'joined_count': event['joined_count'],
+        'left_count': event['left_count'],
+        'online_count': event['online_count']
+    }
+
+
+def message_read_frame(event):
+    return {
+        'type': 'message_read',
+        'message_id': event['message_id'],
+        'reader_id': event['reader_id']
+    }
+
+
+def message_status_frame(event):
+    return {
+        'type': 'message_status_update',
+        'message_id': event['message_id'],
+        'read': event['read'],
+        'read_by_user_id': event.get('read_by_user_id')
+    }
+
+
+def messages_read_frame(event):
+    return {
+        'type': 'messages_read_by_recipient',
+        'message_ids': event['message_ids'],
+        'up_to_message_id': event.get('up_to_message_id'),
+        'read_at': event.get('read_at'),
+        'read_by_user_id': event['read_by_user_id']
+    }
+
+
+def messages_deleted_frame(event):
+    return {
+        'type': 'messages_deleted_notification',
+        'message_ids': event.get('message_ids', []),
+        'deleted_by_user_id': event.get('deleted_by_user_id'),
+        'deleted_by_username': event.get('deleted_by_username'),
+        'delete_type': event.get('delete_type', 'for_me')
+    }
+
+
+def notification_frame(event):
+    return {
+        'type': 'notification',
+        'message': event['message'],
+        'user_id': event.get('user_id'),
+        'notification_type': event.get('notification_type', 'general')
+    }
+
+
+def user_status_frame(event):
+    return {
+        'type': 'user_status_update',
+        'user_id': event['user_id'],
+        'status': event['status']
+    }
+
+
+# Тип события channel layer -> сборщик кадра клиента
+FRAME_BUILDERS = {
+    'presence_summary': presence_summary_frame,
+    'message_read_notification': message_read_frame,
+    'message_status_update': message_status_frame,
+    'messages_read_by_recipient': messages_read_frame,
+    'messages_deleted_notification': messages_deleted_frame,
+    'notification': notification_frame,
+    'user_status_update': user_status_frame,
+}
+
+
+def with_frame(event, build=None):
+    """
+    Добавляет в событие готовый кадр клиента (JSON строка) и возвращает событие.
+    Кадр собирается и кодируется один раз на стороне отправителя; получатели
+    (все сокеты группы, все устройства пользователя) пересылают его как есть.
+    build - сборщик кадра, по умолчанию из FRAME_BUILDERS по типу события
+    (у chat_message он разный для личных и групповых комнат и передается явно).
+    """
+    build = build or FRAME_BUILDERS[event['type']]
+    event[FRAME_KEY] = json.dumps(build(event))
+    return event
+
+
+def event_frame(event, build=None):
+    """
+    Кадр клиента из события: готовый, если его закодировал отправитель, иначе собранный здесь
+    (события воркеров предыдущей версии, события без with_frame)
+    """
+    frame = event.get(FRAME_KEY)
+    if frame is not None:
+        return frame
+    build = build or FRAME_BUILDERS[event['type']]
+    return json.dumps(build(event))
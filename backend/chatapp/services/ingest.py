@@ -0,0 +1,292 @@
+import json
+import logging
+from collections import Counter
+from datetime import datetime
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chatapp.models import PrivateChatRoom, PrivateMessage
+from chatapp.serializers import live_presence
+from .chat_list import format_chat_for_socket, get_room_chats
+from .membership import RoomMemberships
+from .recent_messages import RecentMessages
+from .redis_client import get_redis, get_sync_redis
+from .send_message import RoomParticipantsCache, SendMessageError, next_room_seq
+
+logger = logging.getLogger('chatapp.ingest')
+
+ACK_KEY_PREFIX = 'chat:ingest:ack:'
+
+
+def _ingest_settings():
+    return getattr(settings, 'CHAT_INGEST', {})
+
+
+def stream_name():
+    return _ingest_settings().get('STREAM', 'chat:ingest')
+
+
+def group_name():
+    return _ingest_settings().get('GROUP', 'chat-persisters')
+
+
+def ack_key(message_id):
+    return f'{ACK_KEY_PREFIX}{message_id}'
+
+
+def ingest_enabled():
+    """
+    MODE = 'stream' включает write-behind: сообщение попадает в Redis stream и рассылается сразу,
+    строки PrivateMessage пишет chat_ingest_worker. Id сообщений заранее берутся из последовательности
+    PostgreSQL, поэтому режим доступен только на PostgreSQL.
+    """
+    if _ingest_settings().get('MODE', 'sync') != 'stream':
+        return False
+    if connection.vendor != 'postgresql':
+        logger.warning("📥 [INGEST] Stream mode requires PostgreSQL, falling back to synchronous persistence")
+        return False
+    return True
+
+
+def ack_after_commit():
+    """DURABILITY = 'commit': отправитель ждет записи в БД, 'enqueue' - только записи в stream"""
+    return _ingest_settings().get('DURABILITY', 'enqueue') == 'commit'
+
+
+def reserve_message(room_id):
+    """
+    Id и номер seq нового сообщения одним UPDATE ... RETURNING: по одному nextval последовательности
+    PrivateMessage на сообщение, пока строка комнаты заблокирована. Внутри комнаты id растут вместе с seq
+    (как и у send_message, где INSERT идет после next_room_seq), поэтому водяные знаки по id
+    (mark_read_up_to, RoomMembership.last_message_id, курсор списка чатов) остаются верными.
+    Возвращает (id, seq) или None, если комнаты нет.
+    """
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {qn(PrivateChatRoom._meta.db_table)} SET {qn("last_seq")} = {qn("last_seq")} + 1 '
+            f'WHERE {qn("id")} = %s '
+            f"RETURNING nextval(pg_get_serial_sequence(%s, 'id')), {qn('last_seq')}",
+            [room_id, PrivateMessage._meta.db_table]
+        )
+        return cursor.fetchone()
+
+
+async def get_participants(room_id):
+    participants = RoomParticipantsCache.get_local(room_id)
+    if participants is None:
+        participants = await database_sync_to_async(RoomParticipantsCache.get)(room_id)
+    return participants
+
+
+async def enqueue_message(sender, room_id, message_content, reply_to_message_id=None, reply_to_message_text=None,
+                          reply_to_sender_name=None, reply_to_media_type=None, client_msg_id=None):
+    """
+    Write-behind аналог send_message для текстовых сообщений: назначает id и seq, кладет сообщение
+    в stream и возвращает (message, stream_id). message - несохраненный PrivateMessage с id и seq,
+    из которого собирается событие chat_message. Запись в БД делает persist_batch.
+    """
+    participants = await get_participants(room_id)
+    if participants is None or sender.id not in participants:
+        raise SendMessageError('Not a room participant')
+
+    reserved = await database_sync_to_async(reserve_message)(room_id)
+    if reserved is None:
+        raise SendMessageError('Room not found')
+    message_id, seq = reserved
+
+    message = PrivateMessage(
+        id=message_id,
+        seq=seq,
+        room_id=room_id,
+        sender=sender,
+        recipient_id=participants[1] if participants[0] == sender.id else participants[0],
+        message=message_content,
+        timestamp=timezone.now(),
+        media_type='text',
+        reply_to_message_id=reply_to_message_id or None,
+        reply_to_message_text=reply_to_message_text if reply_to_message_id else None,
+        reply_to_sender_name=reply_to_sender_name if reply_to_message_id else None,
+        reply_to_media_type=reply_to_media_type if reply_to_message_id else None,
+        client_msg_id=client_msg_id,
+    )
+
+    redis = get_redis()
+    stream_id = await redis.xadd(
+        stream_name(),
+        {'message': json.dumps(serialize(message))},
+        maxlen=_ingest_settings().get('STREAM_MAXLEN', 100000),
+        approximate=True
+    )
+
+    if ack_after_commit():
+        # Ждем, пока воркер закоммитит сообщение. Сообщение уже в stream и будет сохранено,
+        # поэтому по таймауту не отказываем, а рассылаем его как в режиме 'enqueue'
+        if not await redis.blpop([ack_key(message.id)], timeout=_ingest_settings().get('COMMIT_TIMEOUT', 5)):
+            logger.warning(f"📥 [INGEST] Message {message.id} not committed within timeout, broadcasting anyway")
+
+    await sync_to_async(RecentMessages.push, thread_sensitive=False)(message)
+    return message, stream_id
+
+
+def serialize(message):
+    return {
+        'id': message.id,
+        'room_id': message.room_id,
+        'sender_id': message.sender_id,
+        'recipient_id': message.recipient_id,
+        'message': message.message,
+        'timestamp': message.timestamp.isoformat(),
+        'reply_to_message_id': message.reply_to_message_id,
+        'reply_to_message_text': message.reply_to_message_text,
+        'reply_to_sender_name': message.reply_to_sender_name,
+        'reply_to_media_type': message.reply_to_media_type,
+        'client_msg_id': message.client_msg_id,
+        'seq': message.seq,
+    }
+
+
+def persist_batch(entries):
+    """
+    Сохраняет сообщения из stream одним bulk_create и возвращает строки пачки.
+    id и seq назначены при enqueue_message, поэтому повторная обработка тех же записей после
+    падения воркера безопасна: уже сохраненные строки просто пропускаются.
+    Так же пропускаются повторы клиента с уже сохраненным (sender, client_msg_id),
+    которые не остановила дедупликация в Redis, и сообщения удаленных комнат.
+    """
+    rows = [json.loads(fields['message']) for _, fields in entries]
+    for row in rows:
+        # Записи, поставленные в stream до появления client_msg_id и seq при enqueue
+        row.setdefault('client_msg_id', None)
+        row.setdefault('seq', None)
+    if not rows:
+        return []
+
+    # Реплай на несуществующее сообщение (или на сообщение другой комнаты) сохраняем без ссылки
+    batch_rooms = {row['id']: row['room_id'] for row in rows}
+    reply_ids = {row['reply_to_message_id'] for row in rows if row['reply_to_message_id']}
+    reply_rooms = dict(PrivateMessage.objects.filter(id__in=reply_ids - batch_rooms.keys()).values_list('id', 'room_id'))
+    reply_rooms.update(batch_rooms)
+
+    with transaction.atomic():
+        existing_ids = set(PrivateMessage.objects.filter(id__in=batch_rooms.keys()).values_list('id', flat=True))
+        new_rows = [row for row in rows if row['id'] not in existing_ids]
+        new_rows = _drop_client_duplicates(new_rows)
+        new_rows = _drop_deleted_rooms(new_rows)
+
+        # Записям без seq номер назначается при записи, в порядке stream
+        room_counts = Counter(row['room_id'] for row in new_rows if row['seq'] is None)
+        next_seqs = {}
+        for room_id, count in room_counts.items():
+            last_seq = next_room_seq(room_id, count)
+            if last_seq is not None:
+                next_seqs[room_id] = last_seq - count + 1
+
+        messages = []
+        for row in new_rows:
+            reply_to_message_id = row['reply_to_message_id']
+            if reply_to_message_id and reply_rooms.get(reply_to_message_id) != row['room_id']:
+                row.update(reply_to_message_id=None, reply_to_message_text=None,
+                           reply_to_sender_name=None, reply_to_media_type=None)
+            if row['seq'] is None and row['room_id'] in next_seqs:
+                row['seq'] = next_seqs[row['room_id']]
+                next_seqs[row['room_id']] += 1
+            messages.append(PrivateMessage(
+                **dict(row, timestamp=datetime.fromisoformat(row['timestamp'])),
+                media_type='text',
+                is_deleted=False
+            ))
+
+        PrivateMessage.objects.bulk_create(messages, ignore_conflicts=True)
+
+        # Счетчики участников: один UPDATE на комнату пачки
+        room_last_ids = {}
+        room_unread = {}
+        for row in new_rows:
+            room_last_ids[row['room_id']] = max(room_last_ids.get(row['room_id'], 0), row['id'])
+            unread = room_unread.setdefault(row['room_id'], Counter())
+            unread[row['recipient_id']] += 1
+        for room_id, last_message_id in room_last_ids.items():
+            RoomMemberships.messages_saved(room_id, last_message_id, room_unread[room_id])
+    return rows
+
+
+def _drop_deleted_rooms(rows):
+    """
+    Строки комнат, которые еще существуют. Сообщение удаленной комнаты не проходит проверку FK
+    (ignore_conflicts ее не покрывает) и валило бы всю пачку при каждом повторе.
+    """
+    room_ids = set(PrivateChatRoom.objects.filter(
+        id__in={row['room_id'] for row in rows}
+    ).values_list('id', flat=True))
+
+    kept = []
+    for row in rows:
+        if row['room_id'] not in room_ids:
+            logger.warning("📥 [INGEST] Skipping message %s of deleted room %s", row['id'], row['room_id'])
+            continue
+        kept.append(row)
+    return kept
+
+
+def _drop_client_duplicates(rows):
+    """Первая строка для каждого (sender_id, client_msg_id), которого еще нет в БД"""
+    client_ids = {(row['sender_id'], row['client_msg_id']) for row in rows if row['client_msg_id']}
+    if not client_ids:
+        return rows
+
+    seen = set(PrivateMessage.objects.filter(
+        sender_id__in={sender_id for sender_id, _ in client_ids},
+        client_msg_id__in={client_msg_id for _, client_msg_id in client_ids}
+    ).values_list('sender_id', 'client_msg_id'))
+
+    unique_rows = []
+    for row in rows:
+        if row['client_msg_id']:
+            client_id = (row['sender_id'], row['client_msg_id'])
+            if client_id in seen:
+                logger.warning(f"📥 [INGEST] Skipping duplicate client_msg_id {row['client_msg_id']} "
+                               f"of user {row['sender_id']} (message {row['id']})")
+                continue
+            seen.add(client_id)
+        unique_rows.append(row)
+    return unique_rows
+
+
+def acknowledge(entries, rows):
+    """После коммита: XACK, подтверждения ожидающим отправителям и строки комнат в списках чатов"""
+    redis = get_sync_redis()
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.xack(stream_name(), group_name(), *[stream_id for stream_id, _ in entries])
+        if ack_after_commit():
+            for row in rows:
+                pipe.lpush(ack_key(row['id']), 1)
+                pipe.expire(ack_key(row['id']), 60)
+        pipe.execute()
+
+    # Строки комнат в списках чатов читаются из БД, поэтому рассылаем их после записи:
+    # как и при синхронной отправке, участник получает только изменившуюся строку (chat_list_delta)
+    participants = {(row['room_id'], user_id) for row in rows for user_id in (row['sender_id'], row['recipient_id'])}
+    if not participants:
+        return
+    chats = get_room_chats({room_id for room_id, _ in participants})
+    statuses = live_presence({chat['other_user'].id for chat in chats.values()})
+
+    channel_layer = get_channel_layer()
+    for room_id, user_id in participants:
+        chat = chats.get((room_id, user_id))
+        if chat is not None:
+            chat = format_chat_for_socket(chat)
+            status = statuses.get(chat['other_user']['id'])
+            if status is not None:
+                chat['other_user']['is_online'] = status[0]
+        async_to_sync(channel_layer.group_send)(f'chat_list_{user_id}', {
+            'type': 'chat_list_delta',
+            'room_id': room_id,
+            'chat': chat
+        })
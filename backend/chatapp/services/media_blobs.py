@@ -0,0 +1,104 @@
+import base64
+import binascii
+import logging
+import mimetypes
+import re
+import uuid
+
+from django.conf import settings
+
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger('chatapp.media')
+
+BLOB_KEY_PREFIX = 'chat:blob:'
+
+# Медиа отдается с домена приложения, поэтому inline допустимы только типы, которые браузер
+# не исполняет: изображения (кроме SVG), видео и аудио. Остальное скачивается как файл
+INLINE_MIME_TYPE_RE = re.compile(r'(image|video|audio)/[a-z0-9][a-z0-9.+-]*')
+
+
+def _media_settings():
+    return getattr(settings, 'CHAT_MEDIA', {})
+
+
+def inline_max_bytes():
+    return _media_settings().get('INLINE_MAX_BYTES', 512 * 1024)
+
+
+def inline_ttl():
+    return _media_settings().get('INLINE_TTL', 300)
+
+
+def blob_key(blob_id):
+    return f'{BLOB_KEY_PREFIX}{blob_id}'
+
+
+def inline_mime_type(mime_type):
+    """Нормализованный MIME тип, если blob можно показать inline, иначе None"""
+    mime_type = (mime_type or '').split(';')[0].strip().lower()
+    if not INLINE_MIME_TYPE_RE.fullmatch(mime_type) or 'svg' in mime_type:
+        return None
+    return mime_type
+
+
+def decoded_size(media_base64):
+    """Размер данных после декодирования base64, без самого декодирования"""
+    padding = media_base64[-2:].count('=')
+    return len(media_base64) * 3 // 4 - padding
+
+
+class InlineMediaTooLarge(Exception):
+    pass
+
+
+async def store_inline_blob(media_base64, room_id, mime_type=None, filename=None):
+    """
+    Кладем base64 медиа один раз в Redis на INLINE_TTL секунд и возвращаем id.
+    В group_send и кадры получателям уходит только ссылка, а не сами данные.
+    mime_type и filename приходят от клиента: небезопасный тип сохраняется как application/octet-stream.
+    """
+    if media_base64.startswith('data:'):
+        # data:image/jpeg;base64,<данные>
+        header, _, media_base64 = media_base64.partition(',')
+        mime_type = mime_type or header[5:].split(';')[0]
+
+    size = decoded_size(media_base64)
+    if size > inline_max_bytes():
+        raise InlineMediaTooLarge(f'Inline media is {size} bytes, limit is {inline_max_bytes()}')
+
+    if not mime_type and filename:
+        mime_type = mimetypes.guess_type(filename)[0]
+
+    blob_id = uuid.uuid4().hex
+    key = blob_key(blob_id)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            'data': media_base64,
+            'room_id': room_id,
+            'mime_type': inline_mime_type(mime_type) or 'application/octet-stream',
+            'filename': filename or '',
+            'size': size,
+        })
+        pipe.expire(key, inline_ttl())
+        await pipe.execute()
+
+    logger.debug("📦 [BLOB] Stored inline media %s (%s bytes) for room %s", blob_id, size, room_id)
+    return blob_id
+
+
+def get_inline_blob(blob_id):
+    """
+    Читаем blob для HTTP выдачи (синхронно).
+    Возвращает dict с декодированными байтами в 'content' или None, если blob истек.
+    """
+    blob = get_sync_redis().hgetall(blob_key(blob_id))
+    if not blob:
+        return None
+    try:
+        blob['content'] = base64.b64decode(blob.pop('data'))
+    except (KeyError, binascii.Error, ValueError) as e:
+        logger.error(f"📦 [BLOB] Corrupted inline media {blob_id}: {e}")
+        return None
+    blob['room_id'] = int(blob['room_id'])
+    return blob
@@ -0,0 +1,198 @@
+import logging
+
+from django.db import transaction
+from django.db.models import (
+    BigIntegerField, Case, Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from chatapp.models import MessageDeletion, PrivateChatRoom, PrivateMessage, RoomMembership
+from .chat_list import visible_messages
+
+logger = logging.getLogger('chatapp.membership')
+
+REBUILD_BATCH_SIZE = 500
+
+
+def _max_id(field, value):
+    """max(field, value) для id-водяных знаков; NULL в поле считается нулем"""
+    return Greatest(
+        Coalesce(F(field), Value(0), output_field=BigIntegerField()),
+        Value(value),
+        output_field=BigIntegerField()
+    )
+
+
+class RoomMemberships:
+    """
+    Денормализованные счетчики участников личных комнат (RoomMembership).
+
+    Отправка увеличивает unread_count получателя и сдвигает last_message_id обоих участников,
+    прочтение уменьшает unread_count и сдвигает last_read_message_id читателя - в той же
+    транзакции, что и изменение сообщений. Удаление меняет видимость сообщений задним числом,
+    поэтому строки комнаты пересчитываются из сообщений (rebuild), как и командой
+    chat_repair_membership. Чтение счетчиков - выборка строк по индексу (user, -last_message_id)
+    вместо подсчета PrivateMessage по (recipient, read=False) с исключением MessageDeletion.
+    """
+
+    @classmethod
+    def create_for_rooms(cls, rooms):
+        """Строки обоих участников для комнат (user1_id, user2_id); существующие строки не меняются"""
+        RoomMembership.objects.bulk_create(
+            [
+                RoomMembership(room_id=room.id, user_id=user_id)
+                for room in rooms
+                for user_id in (room.user1_id, room.user2_id)
+            ],
+            ignore_conflicts=True
+        )
+
+    @classmethod
+    def messages_saved(cls, room_id, last_message_id, unread_counts):
+        """
+        Новые сообщения комнаты: last_message_id - максимальный id среди них,
+        unread_counts - {recipient_id: количество}. Вызывается в транзакции сохранения.
+        """
+        unread_delta = Case(
+            *[When(user_id=user_id, then=Value(count)) for user_id, count in unread_counts.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+        updated = RoomMembership.objects.filter(room_id=room_id).update(
+            unread_count=F('unread_count') + unread_delta,
+            last_message_id=_max_id('last_message_id', last_message_id)
+        )
+        if updated < 2:
+            # Комната создана в обход post_save (bulk_create): строки собираем из сообщений,
+            # только что сохраненные уже видны внутри транзакции
+            logger.warning(f"👥 [MEMBERSHIP] Room {room_id} had {updated} membership rows, rebuilding")
+            cls.rebuild([room_id])
+
+    @classmethod
+    def message_saved(cls, message):
+        cls.messages_saved(message.room_id, message.id, {message.recipient_id: 1})
+
+    @classmethod
+    def messages_read(cls, room_id, reader_id, count, up_to_message_id):
+        """reader_id прочитал count сообщений комнаты, максимальный прочитанный id - up_to_message_id"""
+        RoomMembership.objects.filter(room_id=room_id, user_id=reader_id).update(
+            unread_count=Greatest(F('unread_count') - count, Value(0), output_field=IntegerField()),
+            last_read_message_id=_max_id('last_read_message_id', up_to_message_id)
+        )
+
+    @classmethod
+    def rebuild(cls, room_ids=None):
+        """
+        Пересчитывает строки участников из сообщений: всех комнат или только room_ids.
+        Недостающие строки создаются. Возвращает число пересчитанных строк.
+        """
+        rooms = PrivateChatRoom.objects.order_by('id')
+        if room_ids is not None:
+            rooms = rooms.filter(id__in=room_ids)
+
+        rebuilt = 0
+        batch = []
+        for room in rooms.only('id', 'user1_id', 'user2_id').iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(room)
+            if len(batch) == REBUILD_BATCH_SIZE:
+                rebuilt += cls._rebuild_batch(batch)
+                batch = []
+        if batch:
+            rebuilt += cls._rebuild_batch(batch)
+        return rebuilt
+
+    @classmethod
+    def _rebuild_batch(cls, rooms):
+        # Сообщения комнаты строки, видимые ее участнику
+        visible = PrivateMessage.objects.filter(room_id=OuterRef('room_id'), is_deleted=False).exclude(
+            Exists(MessageDeletion.objects.filter(user_id=OuterRef(OuterRef('user_id')), message_id=OuterRef('pk')))
+        )
+        unread_count = Subquery(
+            visible.filter(recipient_id=OuterRef('user_id'), read=False)
+            .values('room_id')
+            .annotate(count=Count('id'))
+            .values('count'),
+            output_field=IntegerField()
+        )
+        last_message_id = Subquery(visible.order_by('-id').values('id')[:1], output_field=BigIntegerField())
+        last_read_message_id = Subquery(
+            PrivateMessage.objects.filter(room_id=OuterRef('room_id'), recipient_id=OuterRef('user_id'), read=True)
+            .order_by('-id').values('id')[:1],
+            output_field=BigIntegerField()
+        )
+
+        with transaction.atomic():
+            cls.create_for_rooms(rooms)
+            return RoomMembership.objects.filter(room_id__in=[room.id for room in rooms]).update(
+                unread_count=Coalesce(unread_count, Value(0), output_field=IntegerField()),
+                last_message_id=last_message_id,
+                last_read_message_id=last_read_message_id
+            )
+
+    @staticmethod
+    def unread_total(user_id):
+        """Все непрочитанные пользователя"""
+        return RoomMembership.objects.filter(user_id=user_id, unread_count__gt=0).aggregate(
+            total=Coalesce(Sum('unread_count'), Value(0), output_field=IntegerField())
+        )['total']
+
+    @staticmethod
+    def unread_rooms_count(user_id):
+        """Комнаты с непрочитанными, в личной комнате это число отправителей"""
+        return RoomMembership.objects.filter(user_id=user_id, unread_count__gt=0).count()
+
+    @staticmethod
+    def unread_from(user_id, sender_id):
+        """Непрочитанные пользователя в комнатах с sender_id"""
+        return RoomMembership.objects.filter(
+            Q(room__user1_id=sender_id) | Q(room__user2_id=sender_id),
+            user_id=user_id,
+            unread_count__gt=0
+        ).aggregate(total=Coalesce(Sum('unread_count'), Value(0), output_field=IntegerField()))['total']
+
+    @staticmethod
+    def unread_by_sender(user_id):
+        """
+        Непрочитанные по отправителям для NotificationConsumer:
+        счетчик из строки участника, превью - последнее непрочитанное видимое сообщение комнаты.
+        """
+        last_unread_id = Subquery(
+            visible_messages(user_id).filter(room_id=OuterRef('room_id'), recipient_id=user_id, read=False)
+            .order_by('-id').values('id')[:1],
+            output_field=BigIntegerField()
+        )
+        memberships = list(
+            RoomMembership.objects.filter(user_id=user_id, unread_count__gt=0)
+            .annotate(last_unread_id=last_unread_id)
+            .values('room_id', 'unread_count', 'last_unread_id')
+        )
+        messages = {
+            message.id: message
+            for message in PrivateMessage.objects.filter(id__in=[row['last_unread_id'] for row in memberships])
+        }
+
+        senders_data = []
+        for row in memberships:
+            message = messages.get(row['last_unread_id'])
+            if message is None:
+                # Счетчик разошелся с сообщениями - его исправит chat_repair_membership
+                logger.warning(f"👥 [MEMBERSHIP] Room {row['room_id']} of user {user_id} has "
+                               f"unread_count={row['unread_count']} but no unread messages")
+                continue
+            senders_data.append({
+                'sender_id': message.sender_id,
+                'count': row['unread_count'],
+                'last_message': message.message,
+                'timestamp': message.timestamp.timestamp(),
+                'message_id': message.id,
+                'chat_id': row['room_id']
+            })
+        return senders_data
+
+
+@receiver(post_save, sender=PrivateChatRoom)
+def create_room_memberships(sender, instance, created, **kwargs):
+    if created:
+        RoomMemberships.create_for_rooms([instance])
@@ -0,0 +1,69 @@
+import logging
+
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger('chatapp.message_dedupe')
+
+KEY_PREFIX = 'chat:clientmsg:'
+PENDING = 'pending'
+CLIENT_MSG_ID_MAX_LENGTH = 64
+
+
+def _dedupe_ttl():
+    return getattr(settings, 'CHAT_SEND', {}).get('CLIENT_MSG_TTL', 600)
+
+
+def dedupe_key(sender_id, client_msg_id):
+    return f'{KEY_PREFIX}{sender_id}:{client_msg_id}'
+
+
+def clean_client_msg_id(value):
+    """client_msg_id из кадра: непустая строка не длиннее 64 символов, иначе None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or len(value) > CLIENT_MSG_ID_MAX_LENGTH:
+        return None
+    return value
+
+
+async def claim(sender_id, client_msg_id):
+    """
+    Захватывает client_msg_id отправителя перед сохранением сообщения (SET NX на CLIENT_MSG_TTL секунд).
+
+    Возвращает None, если id новый и сообщение нужно сохранить. Для повтора возвращает id уже
+    сохраненного сообщения или PENDING, если первая попытка еще сохраняется.
+    Без Redis возвращает None: повтор остановит уникальное ограничение (sender, client_msg_id).
+    """
+    key = dedupe_key(sender_id, client_msg_id)
+    try:
+        redis = get_redis()
+        if await redis.set(key, PENDING, nx=True, ex=_dedupe_ttl()):
+            return None
+        existing = await redis.get(key)
+    except Exception as e:
+        logger.error(f"🔁 [DEDUPE] Error claiming client_msg_id {client_msg_id} of user {sender_id}: {e}")
+        return None
+
+    # Ключ истек между SET и GET - считаем id новым
+    if existing is None:
+        return None
+    return existing if existing == PENDING else int(existing)
+
+
+async def remember(sender_id, client_msg_id, message_id):
+    """Сообщение сохранено: повторы получат его id"""
+    try:
+        await get_redis().set(dedupe_key(sender_id, client_msg_id), message_id, ex=_dedupe_ttl())
+    except Exception as e:
+        logger.error(f"🔁 [DEDUPE] Error storing client_msg_id {client_msg_id} of user {sender_id}: {e}")
+
+
+async def release(sender_id, client_msg_id):
+    """Сохранить не удалось: повтор клиента должен пройти как новое сообщение"""
+    try:
+        await get_redis().delete(dedupe_key(sender_id, client_msg_id))
+    except Exception as e:
+        logger.error(f"🔁 [DEDUPE] Error releasing client_msg_id {client_msg_id} of user {sender_id}: {e}")
@@ -0,0 +1,36 @@
+import logging
+
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger('chatapp.metrics')
+
+# Счетчики всех воркеров складываются в один hash, чтобы их можно было смотреть через API
+METRICS_KEY = 'chat:metrics'
+
+
+async def incr_counters(counters):
+    """Увеличиваем счетчики одним pipeline: {'refresh.notifications.triggers': 3, ...}"""
+    counters = {name: value for name, value in counters.items() if value}
+    if not counters:
+        return
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for name, value in counters.items():
+                pipe.hincrby(METRICS_KEY, name, value)
+            await pipe.execute()
+    except Exception as e:
+        logger.error(f"📊 [METRICS] Error updating counters: {e}")
+
+
+def get_counters(prefix=''):
+    """Текущие значения счетчиков (синхронно, для REST)"""
+    counters = get_sync_redis().hgetall(METRICS_KEY)
+    return {
+        name: int(value)
+        for name, value in sorted(counters.items())
+        if name.startswith(prefix)
+    }
+
+
+def reset_counters():
+    get_sync_redis().delete(METRICS_KEY)
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import incr_counters
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger('chatapp.outbound')
+
+# Глубина очередей всех соединений: {channel_name: depth}
+DEPTH_KEY = 'chat:outbound:depth'
+
+# Код закрытия для медленного клиента: клиент переподключается и запрашивает полное состояние
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+def _outbound_settings():
+    return getattr(settings, 'CHAT_OUTBOUND', {})
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих кадров одного WebSocket соединения.
+
+    Обработчики событий channel layer только кладут кадр в очередь, отправку в сокет
+    выполняет отдельная задача, поэтому медленный клиент не задерживает чтение channel layer.
+    Кадры-снимки состояния (статус пользователя, список чатов, счетчики уведомлений)
+    передаются с coalesce_key: новый кадр вытесняет еще не отправленный кадр с тем же ключом
+    и встает в конец очереди, чтобы не обогнать более ранние дельты.
+    Сообщения чата не схлопываются и не отбрасываются никогда. Если очередь дольше EVICT_AFTER
+    секунд превышает MAX_FRAMES, соединение закрывается с подсказкой resync_required.
+    """
+
+    # Очереди текущего процесса, глубина которых публикуется в Redis: {channel_name: OutboundQueue}
+    _local_queues = {}
+    _report_tasks = {}
+
+    def __init__(self, channel_name, send_frame, evict):
+        self.channel_name = channel_name
+        self.send_frame = send_frame
+        self.evict = evict
+        self.max_frames = _outbound_settings().get('MAX_FRAMES', 200)
+        self.evict_after = _outbound_settings().get('EVICT_AFTER', 10)
+
+        self._frames = deque()
+        # Еще не отправленные кадры-снимки: {coalesce_key: [coalesce_key, text_data]}
+        self._coalescible = {}
+        # Вытесненные кадры остаются в deque до отправки предшествующих, но не отправляются
+        self._superseded = 0
+        self._over_limit_since = None
+        self._writer = None
+        self._closed = False
+        self._counters = {'outbound.frames': 0, 'outbound.coalesced': 0}
+
+        self._local_queues[channel_name] = self
+        self._ensure_reporter()
+
+    @property
+    def depth(self):
+        return len(self._frames) - self._superseded
+
+    async def put(self, text_data, coalesce_key=None):
+        if self._closed:
+            return
+
+        previous = None
+        if coalesce_key is not None:
+            previous = self._coalescible.get(coalesce_key)
+            if previous is not None:
+                previous[1] = None
+                self._superseded += 1
+                self._counters['outbound.coalesced'] += 1
+            entry = [coalesce_key, text_data]
+            self._coalescible[coalesce_key] = entry
+        else:
+            entry = [None, text_data]
+
+        self._frames.append(entry)
+        if previous is None:
+            self._counters['outbound.frames'] += 1
+
+        if self.depth > self.max_frames:
+            now = time.monotonic()
+            if self._over_limit_since is None:
+                self._over_limit_since = now
+                logger.warning(f"📤 [OUTBOUND] {self.channel_name} queue over limit: {self.depth} frames")
+            elif now - self._over_limit_since > self.evict_after:
+                await self.evict_slow_consumer()
+                return
+        else:
+            self._over_limit_since = None
+
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while self._frames and not self._closed:
+            coalesce_key, text_data = self._frames.popleft()
+            if text_data is None:
+                self._superseded -= 1
+                continue
+            if coalesce_key is not None:
+                del self._coalescible[coalesce_key]
+            if self.depth <= self.max_frames:
+                self._over_limit_since = None
+
+            try:
+                await self.send_frame(text_data)
+            except Exception as e:
+                logger.error(f"📤 [OUTBOUND] Error sending frame to {self.channel_name}: {e}")
+
+    async def evict_slow_consumer(self):
+        logger.warning(
+            f"📤 [OUTBOUND] Evicting slow consumer {self.channel_name}: "
+            f"{self.depth} frames queued for over {self.evict_after}s"
+        )
+        self._counters['outbound.evicted'] = self._counters.get('outbound.evicted', 0) + 1
+        self.close()
+        try:
+            await self.evict(json.dumps({'type': 'resync_required', 'reason': 'slow_consumer'}))
+        except Exception as e:
+            logger.error(f"📤 [OUTBOUND] Error evicting {self.channel_name}: {e}")
+
+    def close(self):
+        """Отбрасываем неотправленные кадры и снимаем очередь с учета"""
+        self._closed = True
+        self._frames.clear()
+        self._coalescible.clear()
+        self._superseded = 0
+        if self._writer is not None and not self._writer.done() and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._writer = None
+        self._local_queues.pop(self.channel_name, None)
+
+    def take_counters(self):
+        counters, self._counters = self._counters, {'outbound.frames': 0, 'outbound.coalesced': 0}
+        return counters
+
+    @classmethod
+    def report_interval(cls):
+        return _outbound_settings().get('REPORT_INTERVAL', 10)
+
+    async def release(self):
+        """Закрытие соединения: убираем его глубину из Redis и сбрасываем оставшиеся счетчики"""
+        self.close()
+        try:
+            await get_redis().hdel(DEPTH_KEY, self.channel_name)
+        except Exception as e:
+            logger.error(f"📤 [OUTBOUND] Error removing queue depth of {self.channel_name}: {e}")
+        await incr_counters(self.take_counters())
+
+    @classmethod
+    async def report(cls):
+        """Публикуем глубину очередей процесса и счетчики одним pipeline"""
+        if not cls._local_queues:
+            return
+
+        totals = {}
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for channel_name, queue in list(cls._local_queues.items()):
+                pipe.hset(DEPTH_KEY, channel_name, queue.depth)
+                for name, value in queue.take_counters().items():
+                    totals[name] = totals.get(name, 0) + value
+            pipe.expire(DEPTH_KEY, cls.report_interval() * 6)
+            await pipe.execute()
+        await incr_counters(totals)
+
+    @classmethod
+    def _ensure_reporter(cls):
+        loop = asyncio.get_running_loop()
+        task = cls._report_tasks.get(loop)
+        if task is None or task.done():
+            cls._report_tasks[loop] = loop.create_task(cls._report_loop())
+
+    @classmethod
+    async def _report_loop(cls):
+        while cls._local_queues:
+            await asyncio.sleep(cls.report_interval())
+            try:
+                await cls.report()
+            except Exception as e:
+                logger.error(f"📤 [OUTBOUND] Queue depth report failed: {e}")
+
+
+def get_queue_depths(min_depth=0):
+    """Глубина очередей соединений всех воркеров (синхронно, для REST), самые глубокие первыми"""
+    depths = get_sync_redis().hgetall(DEPTH_KEY)
+    return dict(sorted(
+        ((channel_name, int(depth)) for channel_name, depth in depths.items() if int(depth) >= min_depth),
+        key=lambda item: item[1],
+        reverse=True
+    ))
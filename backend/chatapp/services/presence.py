@@ -0,0 +1,342 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Case, DateTimeField, F, Value, When
+
+from .presence_fanout import broadcast_status
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger('chatapp.presence')
+
+
+def _presence_settings():
+    return getattr(settings, 'CHAT_PRESENCE', {})
+
+
+class PresenceRegistry:
+    """
+    Реестр активных WebSocket соединений пользователей, общий для всех воркеров.
+
+    Для каждого пользователя в Redis хранится ZSET presence:conn:<user_id>,
+    где member - channel_name соединения, score - момент истечения heartbeat.
+    Соединения упавших воркеров перестают продлеваться и отбрасываются по score,
+    а сам ключ удаляется Redis по TTL.
+
+    Redis - источник истины для статуса: онлайн - есть живое соединение, last_seen - hash
+    presence:last_seen. Поля CustomUser.is_online/last_seen только догоняют его:
+    изменения копятся в hash presence:dirty и раз в FLUSH_INTERVAL записываются одним UPDATE.
+
+    Пользователи, которым разослан статус онлайн, хранятся в SET presence:online. Оффлайн
+    рассылает воркер, закрывший последнее соединение; для соединений упавшего воркера это
+    делает sweep_offline на любом живом воркере.
+    """
+    KEY_PREFIX = 'presence:conn:'
+    STATUS_KEY_PREFIX = 'presence:status:'
+    LAST_SEEN_KEY = 'presence:last_seen'
+    DIRTY_KEY = 'presence:dirty'
+    ONLINE_KEY = 'presence:online'
+    SWEEP_LOCK_KEY = 'presence:sweep'
+
+    # Соединения текущего процесса, которые нужно продлевать: {channel_name: user_id}
+    _local_connections = {}
+    _heartbeat_tasks = {}
+    _flush_tasks = {}
+
+    @classmethod
+    def key(cls, user_id):
+        return f'{cls.KEY_PREFIX}{user_id}'
+
+    @classmethod
+    def status_key(cls, user_id):
+        return f'{cls.STATUS_KEY_PREFIX}{user_id}'
+
+    @classmethod
+    def connection_ttl(cls):
+        return _presence_settings().get('CONNECTION_TTL', 60)
+
+    @classmethod
+    def heartbeat_interval(cls):
+        return _presence_settings().get('HEARTBEAT_INTERVAL', 20)
+
+    @classmethod
+    def offline_grace(cls):
+        return _presence_settings().get('OFFLINE_GRACE', 5)
+
+    @classmethod
+    def sweep_interval(cls):
+        return _presence_settings().get('SWEEP_INTERVAL', cls.connection_ttl())
+
+    @classmethod
+    async def add_connection(cls, user_id, channel_name, connection_type="unknown"):
+        """
+        Регистрируем соединение пользователя.
+        Возвращает True, если это первое живое соединение пользователя.
+        """
+        now = time.time()
+        ttl = cls.connection_ttl()
+        key = cls.key(user_id)
+
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, '-inf', now)
+            pipe.zadd(key, {channel_name: now + ttl})
+            pipe.expire(key, ttl)
+            pipe.zcard(key)
+            *_, active = await pipe.execute()
+
+        cls._local_connections[channel_name] = user_id
+        cls._ensure_heartbeat()
+
+        logger.info("🔌 [PRESENCE] User %s connected (%s). Active connections: %s", user_id, connection_type, active)
+        return active == 1
+
+    @classmethod
+    async def remove_connection(cls, user_id, channel_name, connection_type="unknown"):
+        """
+        Удаляем соединение пользователя.
+        Возвращает True, если у пользователя не осталось живых соединений ни на одном воркере.
+        """
+        cls._local_connections.pop(channel_name, None)
+        key = cls.key(user_id)
+
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.zrem(key, channel_name)
+            pipe.zremrangebyscore(key, '-inf', time.time())
+            pipe.zcard(key)
+            *_, active = await pipe.execute()
+
+        if active:
+            logger.info("🔌 [PRESENCE] User %s disconnected (%s). Still has %s active connections.", user_id, connection_type, active)
+            return False
+
+        logger.info("🔌 [PRESENCE] User %s disconnected (%s). No active connections left.", user_id, connection_type)
+        return True
+
+    @classmethod
+    async def is_user_online(cls, user_id):
+        """Проверяем, есть ли у пользователя живые соединения"""
+        count = await get_redis().zcount(cls.key(user_id), time.time(), '+inf')
+        return count > 0
+
+    @classmethod
+    def is_user_online_sync(cls, user_id):
+        """То же для синхронного кода (Celery, REST)"""
+        return get_sync_redis().zcount(cls.key(user_id), time.time(), '+inf') > 0
+
+    @classmethod
+    async def get_online_users(cls, user_ids):
+        """Пакетная проверка: возвращает множество id пользователей, которые онлайн"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        now = time.time()
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(cls.key(user_id), now, '+inf')
+            counts = await pipe.execute()
+
+        return {user_id for user_id, count in zip(user_ids, counts) if count}
+
+    @classmethod
+    async def get_connection_count(cls, user_id):
+        """Получаем количество живых соединений пользователя"""
+        return await get_redis().zcount(cls.key(user_id), time.time(), '+inf')
+
+    @classmethod
+    async def announce_status(cls, user_id, status):
+        """
+        Запоминаем последний разосланный контактам статус.
+        Возвращает True, если статус изменился и его нужно разослать.
+        """
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.set(cls.status_key(user_id), status, get=True, ex=86400)
+            if status == 'online':
+                pipe.sadd(cls.ONLINE_KEY, user_id)
+            else:
+                pipe.srem(cls.ONLINE_KEY, user_id)
+            previous, _ = await pipe.execute()
+        return previous != status
+
+    @classmethod
+    async def record_status(cls, user_id, status):
+        """
+        Новый статус пользователя для записи в БД: только Redis, без запросов к БД.
+        Несколько изменений одного пользователя за интервал схлопываются в последнее.
+        """
+        now = time.time()
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(cls.DIRTY_KEY, user_id, f'{status}:{now}')
+            if status == 'offline':
+                pipe.hset(cls.LAST_SEEN_KEY, user_id, now)
+            await pipe.execute()
+        cls._ensure_flusher()
+
+    @classmethod
+    def live_status_sync(cls, user_ids):
+        """
+        Статус пользователей из Redis для REST: {user_id: (is_online, last_seen)}.
+        last_seen - None, если пользователь не отключался с момента появления hash.
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+
+        now = time.time()
+        with get_sync_redis().pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(cls.key(user_id), now, '+inf')
+            pipe.hmget(cls.LAST_SEEN_KEY, user_ids)
+            *counts, last_seen = pipe.execute()
+
+        return {
+            user_id: (
+                'online' if count else 'offline',
+                datetime.fromtimestamp(float(seen), tz=dt_timezone.utc) if seen else None
+            )
+            for user_id, count, seen in zip(user_ids, counts, last_seen)
+        }
+
+    @classmethod
+    def flush(cls):
+        """
+        Записывает накопленные статусы в CustomUser: один UPDATE на FLUSH_BATCH_SIZE пользователей.
+        Hash забирается и очищается атомарно, поэтому flush на нескольких воркерах не пишет дважды.
+        Возвращает число записанных пользователей.
+        """
+        redis = get_sync_redis()
+        with redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(cls.DIRTY_KEY)
+            pipe.delete(cls.DIRTY_KEY)
+            dirty, _ = pipe.execute()
+        if not dirty:
+            return 0
+
+        statuses = {}
+        for user_id, value in dirty.items():
+            status, _, ts = value.partition(':')
+            statuses[int(user_id)] = (status, datetime.fromtimestamp(float(ts), tz=dt_timezone.utc))
+
+        user_ids = list(statuses)
+        batch_size = _presence_settings().get('FLUSH_BATCH_SIZE', 500)
+        try:
+            for start in range(0, len(user_ids), batch_size):
+                cls._write_statuses({user_id: statuses[user_id] for user_id in user_ids[start:start + batch_size]})
+        except Exception:
+            # Возвращаем незаписанное, не затирая более свежие изменения
+            with redis.pipeline(transaction=False) as pipe:
+                for user_id, value in dirty.items():
+                    pipe.hsetnx(cls.DIRTY_KEY, user_id, value)
+                pipe.execute()
+            raise
+        return len(user_ids)
+
+    @staticmethod
+    def _write_statuses(statuses):
+        online_ids = [user_id for user_id, (status, _) in statuses.items() if status == 'online']
+        offline_at = [When(id=user_id, then=Value(ts)) for user_id, (status, ts) in statuses.items() if status != 'online']
+
+        if not online_ids:
+            update = {'is_online': 'offline'}
+        elif not offline_at:
+            update = {'is_online': 'online'}
+        else:
+            update = {'is_online': Case(When(id__in=online_ids, then=Value('online')), default=Value('offline'))}
+        if offline_at:
+            update['last_seen'] = Case(*offline_at, default=F('last_seen'), output_field=DateTimeField())
+        get_user_model().objects.filter(id__in=statuses).update(**update)
+
+    @classmethod
+    def _ensure_flusher(cls):
+        loop = asyncio.get_running_loop()
+        task = cls._flush_tasks.get(loop)
+        if task is None or task.done():
+            cls._flush_tasks[loop] = loop.create_task(cls._flush_loop())
+
+    @classmethod
+    async def _flush_loop(cls):
+        while True:
+            await asyncio.sleep(_presence_settings().get('FLUSH_INTERVAL', 10))
+            try:
+                written = await database_sync_to_async(cls.flush)()
+                if written:
+                    logger.debug("🔌 [PRESENCE] Flushed status of %s users", written)
+            except Exception as e:
+                logger.error(f"🔌 [PRESENCE] Status flush failed: {e}")
+
+    @classmethod
+    async def heartbeat(cls):
+        """
+        Продлеваем все соединения текущего процесса одним pipeline.
+        Соединения, пропавшие из Redis (рестарт, вытеснение ключа, heartbeat позже TTL),
+        регистрируются заново: пользователь на связи и должен оставаться онлайн.
+        """
+        if not cls._local_connections:
+            return
+
+        ttl = cls.connection_ttl()
+        expires_at = time.time() + ttl
+        connections = list(cls._local_connections.items())
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for channel_name, user_id in connections:
+                key = cls.key(user_id)
+                pipe.zadd(key, {channel_name: expires_at})
+                pipe.expire(key, ttl)
+            results = await pipe.execute()
+
+        restored = {user_id for (_, user_id), added in zip(connections, results[::2]) if added}
+        for user_id in restored:
+            logger.warning("🔌 [PRESENCE] Re-registered lost connections of user %s", user_id)
+            await cls.record_status(user_id, 'online')
+
+    @classmethod
+    async def sweep_offline(cls):
+        """
+        Объявляет оффлайн пользователей из presence:online без живых соединений: соединения
+        упавшего воркера истекли по score, а его announce_offline_later уже не выполнится.
+        Выполняется не чаще раза в SWEEP_INTERVAL на все воркеры. Возвращает число таких пользователей.
+        """
+        redis = get_redis()
+        if not await redis.set(cls.SWEEP_LOCK_KEY, 1, nx=True, ex=cls.sweep_interval()):
+            return 0
+
+        user_ids = [int(user_id) for user_id in await redis.smembers(cls.ONLINE_KEY)]
+        online_users = set()
+        batch_size = _presence_settings().get('FLUSH_BATCH_SIZE', 500)
+        for start in range(0, len(user_ids), batch_size):
+            online_users |= await cls.get_online_users(user_ids[start:start + batch_size])
+
+        swept = 0
+        channel_layer = get_channel_layer()
+        for user_id in user_ids:
+            # announce_status атомарно меняет статус: пользователя, которого уже объявил
+            # другой воркер или который переподключился, повторно не рассылаем
+            if user_id in online_users or not await cls.announce_status(user_id, 'offline'):
+                continue
+            logger.warning("🔌 [PRESENCE] User %s has no live connections left - set to offline", user_id)
+            await cls.record_status(user_id, 'offline')
+            await broadcast_status(channel_layer, user_id, 'offline')
+            swept += 1
+        return swept
+
+    @classmethod
+    def _ensure_heartbeat(cls):
+        loop = asyncio.get_running_loop()
+        task = cls._heartbeat_tasks.get(loop)
+        if task is None or task.done():
+            cls._heartbeat_tasks[loop] = loop.create_task(cls._heartbeat_loop())
+
+    @classmethod
+    async def _heartbeat_loop(cls):
+        while cls._local_connections:
+            await asyncio.sleep(cls.heartbeat_interval())
+            try:
+                await cls.heartbeat()
+                await cls.sweep_offline()
+            except Exception as e:
+                logger.error(f"🔌 [PRESENCE] Heartbeat failed: {e}")
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chatapp.models import PrivateChatRoom
+from .frames import with_frame
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger('chatapp.presence')
+
+
+def _presence_settings():
+    return getattr(settings, 'CHAT_PRESENCE', {})
+
+
+class ContactCache:
+    """
+    Кэш собеседников пользователя в Redis (SET contacts:<user_id>).
+    Сбрасывается при создании и удалении комнаты, поэтому статус при переподключении
+    рассылается без запросов к БД.
+    """
+    KEY_PREFIX = 'contacts:'
+    # Маркер пустого множества: у пользователя еще нет чатов, но это уже проверено
+    EMPTY = '-'
+
+    @classmethod
+    def key(cls, user_id):
+        return f'{cls.KEY_PREFIX}{user_id}'
+
+    @classmethod
+    async def get_contacts(cls, user_id):
+        """Множество id собеседников пользователя"""
+        redis = get_redis()
+        key = cls.key(user_id)
+
+        members = await redis.smembers(key)
+        if members:
+            return {int(member) for member in members if member != cls.EMPTY}
+
+        contacts = await database_sync_to_async(cls.load_contacts)(user_id)
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.sadd(key, *(contacts or [cls.EMPTY]))
+            pipe.expire(key, _presence_settings().get('CONTACTS_TTL', 3600))
+            await pipe.execute()
+        return contacts
+
+    @staticmethod
+    def load_contacts(user_id):
+        """Собеседники из БД одним запросом"""
+        contacts = set()
+        rooms = PrivateChatRoom.objects.filter(
+            Q(user1_id=user_id) | Q(user2_id=user_id)
+        ).values_list('user1_id', 'user2_id')
+        for user1_id, user2_id in rooms:
+            contacts.add(user2_id if user1_id == user_id else user1_id)
+        return contacts
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        get_sync_redis().delete(*[cls.key(user_id) for user_id in user_ids])
+
+
+async def fan_out(channel_layer, group_names, message):
+    """
+    Отправляем одно событие в несколько групп параллельно, а не по очереди.
+    Число одновременных group_send ограничено FANOUT_CONCURRENCY.
+    """
+    semaphore = asyncio.Semaphore(_presence_settings().get('FANOUT_CONCURRENCY', 50))
+
+    async def send(group_name):
+        async with semaphore:
+            await channel_layer.group_send(group_name, message)
+
+    results = await asyncio.gather(*(send(group_name) for group_name in group_names), return_exceptions=True)
+    failed = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        logger.error(f"🔌 [PRESENCE] Fan-out failed for {len(failed)} of {len(results)} groups: {failed[0]}")
+
+
+async def broadcast_status(channel_layer, user_id, status):
+    """Рассылаем статус пользователя всем его собеседникам (кэш контактов, параллельная рассылка)"""
+    contacts = await ContactCache.get_contacts(user_id)
+    await fan_out(
+        channel_layer,
+        [f'notifications_{contact_id}' for contact_id in contacts],
+        with_frame({
+            'type': 'user_status_update',
+            'user_id': user_id,
+            'status': status
+        })
+    )
+
+
+@receiver(post_save, sender=PrivateChatRoom)
+def invalidate_contacts_on_room_create(sender, instance, created, **kwargs):
+    if not created:
+        return
+    try:
+        ContactCache.invalidate(instance.user1_id, instance.user2_id)
+    except Exception as e:
+        logger.error(f"🔌 [PRESENCE] Error invalidating contacts cache: {e}")
+
+
+@receiver(post_delete, sender=PrivateChatRoom)
+def invalidate_contacts_on_room_delete(sender, instance, **kwargs):
+    try:
+        ContactCache.invalidate(instance.user1_id, instance.user2_id)
+    except Exception as e:
+        logger.error(f"🔌 [PRESENCE] Error invalidating contacts cache: {e}")
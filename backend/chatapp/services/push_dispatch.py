@@ -0,0 +1,56 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger('chatapp.push_dispatch')
+
+DEDUPE_KEY_PREFIX = 'chat:push:'
+
+
+def _push_settings():
+    return getattr(settings, 'CHAT_PUSH', {})
+
+
+def dedupe_key(message_id):
+    return f'{DEDUPE_KEY_PREFIX}{message_id}'
+
+
+def _enqueue(kwargs):
+    from chatapp.tasks import send_message_push_task
+
+    send_message_push_task.apply_async(kwargs=kwargs)
+
+
+async def dispatch_message_push(message, sender_name):
+    """
+    Ставит push-уведомление о сообщении в очередь Celery и сразу возвращается:
+    запрос к FCM выполняет воркер Celery, а не event loop отправителя.
+    Одно сообщение порождает не больше одного push: ключ chat:push:<message_id> захватывается
+    через SET NX до постановки задачи и держится DEDUPE_TTL секунд, в том числе на время ретраев.
+    """
+    key = dedupe_key(message.id)
+    redis = get_redis()
+    if not await redis.set(key, 'queued', nx=True, ex=_push_settings().get('DEDUPE_TTL', 3600)):
+        logger.debug("🔥 [PUSH] Push for message %s already dispatched - skipping", message.id)
+        return False
+
+    kwargs = {
+        'message_id': message.id,
+        'recipient_id': message.recipient_id,
+        'sender_name': sender_name,
+        'message_text': message.message or '',
+        'room_id': message.room_id,
+    }
+    try:
+        # Публикация в брокер - синхронный сетевой вызов, выполняем его вне event loop
+        await sync_to_async(_enqueue, thread_sensitive=False)(kwargs)
+    except Exception as e:
+        logger.error(f"🔥 [PUSH] ❌ Failed to enqueue push for message {message.id}: {e}")
+        await redis.delete(key)
+        return False
+
+    logger.debug("🔥 [PUSH] Push for message %s queued for user %s", message.id, message.recipient_id)
+    return True
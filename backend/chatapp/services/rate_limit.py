@@ -0,0 +1,103 @@
+import logging
+import weakref
+
+from django.conf import settings
+
+from .metrics import METRICS_KEY
+from .redis_client import get_redis
+
+logger = logging.getLogger('chatapp.rate_limit')
+
+# Тип входящего кадра -> бюджет, из которого он списывается
+FRAME_BUCKETS = {
+    'chat_message': 'message',
+    'media_message': 'message',
+    'mark_as_read': 'read',
+    'mark_multiple_as_read': 'read',
+}
+DEFAULT_BUCKET = 'control'
+
+DEFAULT_LIMITS = {
+    'message': {'RATE': 5, 'BURST': 20},
+    'read': {'RATE': 10, 'BURST': 50},
+    'control': {'RATE': 2, 'BURST': 10},
+}
+
+# Token bucket целиком на стороне Redis: один EVALSHA на кадр, время берется у Redis,
+# поэтому бюджет общий для всех воркеров и не зависит от их часов.
+# Отказ сразу учитывается в общем hash счетчиков метрик.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = math.ceil((1 - tokens) * 1000 / rate)
+    redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, retry_after}
+"""
+
+# Зарегистрированный скрипт на каждый клиент Redis (клиент создается на event loop)
+_scripts = weakref.WeakKeyDictionary()
+
+
+def _limits():
+    return getattr(settings, 'CHAT_RATE_LIMITS', DEFAULT_LIMITS)
+
+
+def bucket_for(frame_type):
+    return FRAME_BUCKETS.get(frame_type, DEFAULT_BUCKET)
+
+
+def key(user_id, bucket):
+    return f'ratelimit:{bucket}:{user_id}'
+
+
+async def consume(user_id, frame_type):
+    """
+    Списываем один токен из бюджета пользователя для кадра frame_type.
+    Возвращает None, если кадр можно обрабатывать, иначе словарь для ответа rate_limited.
+    При недоступности Redis кадры пропускаются.
+    """
+    bucket = bucket_for(frame_type)
+    limit = _limits().get(bucket) or DEFAULT_LIMITS[bucket]
+
+    redis = get_redis()
+    script = _scripts.get(redis)
+    if script is None:
+        script = _scripts[redis] = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    try:
+        allowed, retry_after = await script(
+            keys=[key(user_id, bucket), METRICS_KEY],
+            args=[limit['RATE'], limit['BURST'], f'ratelimit.{bucket}.dropped']
+        )
+    except Exception as e:
+        logger.error(f"🚦 [RATE-LIMIT] Error checking {bucket} budget for user {user_id}: {e}")
+        return None
+
+    if allowed:
+        return None
+
+    logger.warning(f"🚦 [RATE-LIMIT] User {user_id} exceeded {bucket} budget with {frame_type}")
+    return {
+        'type': 'rate_limited',
+        'frame_type': frame_type,
+        'bucket': bucket,
+        'retry_after_ms': int(retry_after),
+    }
@@ -0,0 +1,114 @@
+import logging
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chatapp.models import MessageDeletion, PrivateMessage
+from .chat_list import visible_messages
+from .db import supports_update_returning
+from .membership import RoomMemberships
+from .recent_messages import RecentMessages
+
+logger = logging.getLogger('chatapp.read_receipts')
+
+
+def _update_returning(room_id, reader_id, up_to_message_id, read_at):
+    """Один UPDATE ... RETURNING: помечает сообщения и сразу возвращает (id, sender_id, is_deleted)"""
+    qn = connection.ops.quote_name
+    table = qn(PrivateMessage._meta.db_table)
+    sql = (
+        f'UPDATE {table} SET {qn("read")} = %s, {qn("read_at")} = %s '
+        f'WHERE {qn("room_id")} = %s AND {qn("recipient_id")} = %s AND {qn("read")} = %s'
+    )
+    params = [True, connection.ops.adapt_datetimefield_value(read_at), room_id, reader_id, False]
+    if up_to_message_id is not None:
+        sql += f' AND {qn("id")} <= %s'
+        params.append(up_to_message_id)
+    sql += f' RETURNING {qn("id")}, {qn("sender_id")}, {qn("is_deleted")}'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _select_then_update(room_id, reader_id, up_to_message_id, read_at):
+    """Запасной вариант для БД без RETURNING: выборка с блокировкой и UPDATE в одной транзакции"""
+    unread = PrivateMessage.objects.filter(room_id=room_id, recipient_id=reader_id, read=False)
+    if up_to_message_id is not None:
+        unread = unread.filter(id__lte=up_to_message_id)
+
+    with transaction.atomic():
+        rows = list(unread.select_for_update().values_list('id', 'sender_id', 'is_deleted'))
+        if rows:
+            PrivateMessage.objects.filter(id__in=[row[0] for row in rows]).update(read=True, read_at=read_at)
+    return rows
+
+
+def _visible_read_counts(reader_id, rows):
+    """
+    {sender_id: количество} прочитанных строк (id, sender_id, is_deleted), которые видны читателю.
+    Прочтение помечает и удаленные, и скрытые читателем сообщения, но в RoomMembership.unread_count
+    и счетчиках уведомлений они не учитывались, поэтому и вычитать их нельзя.
+    """
+    ids = [message_id for message_id, _, is_deleted in rows if not is_deleted]
+    hidden = set(MessageDeletion.objects.filter(
+        user_id=reader_id, message_id__in=ids
+    ).values_list('message_id', flat=True)) if ids else set()
+
+    read_counts = {}
+    for message_id, sender_id, is_deleted in rows:
+        if not is_deleted and message_id not in hidden:
+            read_counts[sender_id] = read_counts.get(sender_id, 0) + 1
+    return read_counts
+
+
+def mark_read_up_to(room_id, reader_id, up_to_message_id=None):
+    """
+    Помечает прочитанными все непрочитанные сообщения комнаты, адресованные reader_id,
+    с id не больше up_to_message_id (None - все), и записывает read_at.
+
+    Возвращает None, если читать было нечего, иначе dict:
+    message_ids - отсортированные id прочитанных сообщений,
+    read_counts - {sender_id: количество} без удаленных и скрытых читателем сообщений,
+    up_to_message_id - водяной знак (максимальный прочитанный id),
+    read_at - время прочтения.
+    Счетчик непрочитанных и водяной знак RoomMembership меняются в той же транзакции.
+    """
+    read_at = timezone.now()
+    with transaction.atomic():
+        if supports_update_returning():
+            rows = _update_returning(room_id, reader_id, up_to_message_id, read_at)
+        else:
+            rows = _select_then_update(room_id, reader_id, up_to_message_id, read_at)
+        if not rows:
+            return None
+        read_counts = _visible_read_counts(reader_id, rows)
+        RoomMemberships.messages_read(room_id, reader_id, sum(read_counts.values()), max(row[0] for row in rows))
+
+    message_ids = sorted(row[0] for row in rows)
+    RecentMessages.mark_read(room_id, message_ids)
+
+    logger.debug("📖 [READ-RECEIPT] %s messages read by user %s in room %s up to %s",
+                 len(message_ids), reader_id, room_id, message_ids[-1])
+    return {
+        'message_ids': message_ids,
+        'read_counts': read_counts,
+        'up_to_message_id': message_ids[-1],
+        'read_at': read_at,
+    }
+
+
+def mark_message_read(message_id, room_id, reader_id):
+    """
+    Помечает прочитанным одно сообщение комнаты room_id, адресованное reader_id.
+    Возвращает True, если сообщение было непрочитанным; условие read=False защищает от гонки двух устройств.
+    """
+    with transaction.atomic():
+        updated = PrivateMessage.objects.filter(
+            id=message_id, room_id=room_id, recipient_id=reader_id, read=False
+        ).update(read=True, read_at=timezone.now())
+        if updated:
+            # Удаленное или скрытое читателем сообщение в unread_count не учитывалось
+            visible = visible_messages(reader_id).filter(id=message_id).exists()
+            RoomMemberships.messages_read(room_id, reader_id, 1 if visible else 0, message_id)
+    return bool(updated)
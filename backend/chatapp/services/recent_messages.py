@@ -0,0 +1,212 @@
+import json
+import logging
+
+from django.conf import settings
+from redis.exceptions import WatchError
+
+from chatapp.models import MessageDeletion, PrivateMessage
+from chatapp.serializers import MessageSerializer
+from .redis_client import get_sync_redis
+
+logger = logging.getLogger('chatapp.recent_messages')
+
+
+def _recent_settings():
+    return getattr(settings, 'CHAT_RECENT', {})
+
+
+class RecentMessages:
+    """
+    Последние SIZE сообщений комнаты в Redis: первая страница истории и кадр recent_messages
+    при подключении к комнате отдаются без запросов к БД.
+
+    chat:recent:<room_id> - список JSON в формате MessageSerializer, новые слева, не длиннее SIZE.
+    Служебные поля записи: _ts (время для сортировки), _recipient_id, _deleted (удалено для всех)
+    и _hidden_for (кто удалил сообщение для себя). Список короче SIZE содержит всю историю комнаты.
+
+    Отправка дописывает запись, прочтение и удаление правят существующие, промах пересобирает
+    список из БД. Каждое изменение увеличивает версию chat:recent:<room_id>:v: пересборка,
+    прочитавшая БД до изменения, список не перезаписывает.
+    """
+    KEY_PREFIX = 'chat:recent:'
+
+    @classmethod
+    def key(cls, room_id):
+        return f'{cls.KEY_PREFIX}{room_id}'
+
+    @classmethod
+    def version_key(cls, room_id):
+        return f'{cls.KEY_PREFIX}{room_id}:v'
+
+    @classmethod
+    def size(cls):
+        return _recent_settings().get('SIZE', 50)
+
+    @classmethod
+    def ttl(cls):
+        return _recent_settings().get('TTL', 86400)
+
+    @classmethod
+    def handshake_limit(cls):
+        return _recent_settings().get('HANDSHAKE_LIMIT', 15)
+
+    @staticmethod
+    def entry(message, hidden_for=()):
+        """Запись списка из сообщения с загруженным sender"""
+        data = dict(MessageSerializer(message).data)
+        data.update({
+            '_ts': message.timestamp.timestamp(),
+            '_recipient_id': message.recipient_id,
+            '_deleted': bool(message.is_deleted),
+            '_hidden_for': list(hidden_for),
+        })
+        return data
+
+    @staticmethod
+    def public(entry):
+        return {name: value for name, value in entry.items() if not name.startswith('_')}
+
+    @classmethod
+    def push(cls, message):
+        """Новое сообщение - в начало списка, если список комнаты уже собран"""
+        room_id = message.room_id
+        try:
+            with get_sync_redis().pipeline(transaction=True) as pipe:
+                pipe.incr(cls.version_key(room_id))
+                pipe.expire(cls.version_key(room_id), cls.ttl())
+                pipe.lpushx(cls.key(room_id), json.dumps(cls.entry(message)))
+                pipe.ltrim(cls.key(room_id), 0, cls.size() - 1)
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"🗂️ [RECENT] Error pushing message {message.id} to room {room_id}: {e}")
+
+    @classmethod
+    def mark_read(cls, room_id, message_ids):
+        ids = set(message_ids)
+
+        def apply(entry):
+            if entry['id'] in ids and not entry['read']:
+                entry['read'] = True
+                return True
+            return False
+
+        cls._patch(room_id, apply)
+
+    @classmethod
+    def mark_deleted(cls, room_id, message_ids, user_id, for_everyone):
+        """for_everyone - удалены свои сообщения user_id для всех, иначе только для себя"""
+        ids = set(message_ids)
+
+        def apply(entry):
+            if entry['id'] not in ids:
+                return False
+            if for_everyone:
+                if entry['sender_id'] != user_id or entry['_deleted']:
+                    return False
+                entry['_deleted'] = True
+                return True
+            if user_id in entry['_hidden_for']:
+                return False
+            entry['_hidden_for'].append(user_id)
+            return True
+
+        cls._patch(room_id, apply)
+
+    @classmethod
+    def _patch(cls, room_id, apply):
+        """apply(entry) -> True, если запись изменена. Чтение и запись списка под WATCH"""
+        key = cls.key(room_id)
+
+        def update(pipe):
+            entries = [json.loads(item) for item in pipe.lrange(key, 0, -1)]
+            changed = [(index, entry) for index, entry in enumerate(entries) if apply(entry)]
+            pipe.multi()
+            # Версию увеличиваем и без изменений в списке: идущая пересборка могла прочитать БД до них
+            pipe.incr(cls.version_key(room_id))
+            pipe.expire(cls.version_key(room_id), cls.ttl())
+            for index, entry in changed:
+                pipe.lset(key, index, json.dumps(entry))
+
+        try:
+            get_sync_redis().transaction(update, key)
+        except Exception as e:
+            # Устаревшая запись хуже промаха: сбрасываем список, следующий запрос соберет его из БД
+            logger.error(f"🗂️ [RECENT] Error patching recent messages of room {room_id}: {e}")
+            cls.invalidate(room_id)
+
+    @classmethod
+    def invalidate(cls, room_id):
+        try:
+            with get_sync_redis().pipeline(transaction=True) as pipe:
+                pipe.incr(cls.version_key(room_id))
+                pipe.expire(cls.version_key(room_id), cls.ttl())
+                pipe.delete(cls.key(room_id))
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"🗂️ [RECENT] Error invalidating recent messages of room {room_id}: {e}")
+
+    @classmethod
+    def entries(cls, room_id):
+        """Записи списка комнаты, при промахе список собирается из БД"""
+        items = get_sync_redis().lrange(cls.key(room_id), 0, -1)
+        if items:
+            return [json.loads(item) for item in items]
+        return cls.rebuild(room_id)
+
+    @classmethod
+    def rebuild(cls, room_id):
+        redis = get_sync_redis()
+        version = redis.get(cls.version_key(room_id))
+
+        messages = list(
+            PrivateMessage.objects.filter(room_id=room_id, is_deleted=False)
+            .select_related('sender').order_by('-timestamp')[:cls.size()]
+        )
+        hidden = {}
+        deletions = MessageDeletion.objects.filter(message_id__in=[message.id for message in messages])
+        for message_id, user_id in deletions.values_list('message_id', 'user_id'):
+            hidden.setdefault(message_id, []).append(user_id)
+        entries = [cls.entry(message, hidden.get(message.id, ())) for message in messages]
+
+        if entries:
+            cls._store(room_id, version, entries)
+        return entries
+
+    @classmethod
+    def _store(cls, room_id, version, entries):
+        """Записываем собранный список, только если с начала пересборки комнату никто не менял"""
+        version_key = cls.version_key(room_id)
+        with get_sync_redis().pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(version_key)
+                if pipe.get(version_key) != version:
+                    return
+                pipe.multi()
+                pipe.delete(cls.key(room_id))
+                pipe.rpush(cls.key(room_id), *[json.dumps(entry) for entry in entries])
+                pipe.expire(cls.key(room_id), cls.ttl())
+                pipe.execute()
+            except WatchError:
+                logger.debug("🗂️ [RECENT] Room %s changed during rebuild, list not stored", room_id)
+
+    @classmethod
+    def page(cls, room_id, user_id, limit):
+        """
+        Последние limit сообщений, видимых user_id, в формате MessageSerializer (новые первыми)
+        и признак has_more. None, если в списке не хватает записей или Redis недоступен -
+        тогда страницу нужно читать из БД.
+        """
+        try:
+            entries = cls.entries(room_id)
+        except Exception as e:
+            logger.error(f"🗂️ [RECENT] Error reading recent messages of room {room_id}: {e}")
+            return None
+
+        visible = sorted(
+            (entry for entry in entries if not entry['_deleted'] and user_id not in entry['_hidden_for']),
+            key=lambda entry: entry['_ts'], reverse=True
+        )
+        complete = len(entries) < cls.size()
+        if len(visible) < limit and not complete:
+            return None
+        return [cls.public(entry) for entry in visible[:limit]], len(visible) > limit or not complete
@@ -0,0 +1,36 @@
+import asyncio
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+_async_clients = {}
+_sync_client = None
+
+
+def get_redis_url():
+    return getattr(settings, 'CHAT_REDIS_URL', 'redis://127.0.0.1:6379/2')
+
+
+def get_redis():
+    """
+    Асинхронный клиент Redis для consumer'ов.
+    Пул соединений привязан к event loop, поэтому клиент создаётся на каждый loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        # Чистим клиенты закрытых loop'ов (тесты, async_to_sync)
+        for old_loop in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[old_loop]
+        client = aioredis.Redis.from_url(get_redis_url(), decode_responses=True)
+        _async_clients[loop] = client
+    return client
+
+
+def get_sync_redis():
+    """Синхронный клиент Redis для REST, Celery и management команд"""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(get_redis_url(), decode_responses=True)
+    return _sync_client
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+
+from django.conf import settings
+
+from .metrics import incr_counters
+
+logger = logging.getLogger('chatapp.refresh')
+
+
+def _refresh_settings():
+    return getattr(settings, 'CHAT_REFRESH', {})
+
+
+class RefreshCoalescer:
+    """
+    Схлопывает триггеры полного пересчета (уведомления, список чатов) одного consumer'а.
+
+    Первый триггер откладывает пересчет на окно COALESCE_WINDOW, все триггеры внутри окна
+    дают один запрос к БД и один кадр клиенту. Триггеры, пришедшие во время пересчета,
+    запускают еще один пересчет после следующего окна, поэтому последнее изменение не теряется,
+    а нагрузка на БД не превышает одного пересчета за окно на соединение.
+    """
+
+    def __init__(self, name, callback, window=None):
+        self.name = name
+        self.callback = callback
+        self.window = window if window is not None else _refresh_settings().get('COALESCE_WINDOW', 0.15)
+        self._pending = 0
+        self._task = None
+
+    @property
+    def active(self):
+        """Пересчет запланирован или выполняется"""
+        return self._task is not None and not self._task.done()
+
+    def trigger(self):
+        self._pending += 1
+        if not self.active:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def cancel(self):
+        if self.active:
+            self._task.cancel()
+        self._task = None
+        self._pending = 0
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.window)
+            triggers, self._pending = self._pending, 0
+
+            try:
+                await self.callback()
+            except Exception as e:
+                logger.error(f"🔄 [REFRESH] Error refreshing {self.name}: {e}")
+
+            await incr_counters({
+                f'refresh.{self.name}.triggers': triggers,
+                f'refresh.{self.name}.refreshes': 1,
+                f'refresh.{self.name}.collapsed': triggers - 1,
+            })
+            if triggers > 1:
+                logger.debug("🔄 [REFRESH] %s: %s triggers collapsed into one refresh", self.name, triggers)
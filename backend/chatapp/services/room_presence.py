@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+import weakref
+
+from django.conf import settings
+
+from .frames import with_frame
+from .redis_client import get_redis, get_sync_redis
+
+logger = logging.getLogger('chatapp.room_presence')
+
+
+def _room_presence_settings():
+    return getattr(settings, 'CHAT_ROOM_PRESENCE', {})
+
+
+# Снимаем соединение и убираем пользователя из комнаты, только если у него не осталось живых
+# соединений ни на одном воркере. Одним скриптом, чтобы вход на другом воркере не потерялся между проверками.
+LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+if redis.call('ZCARD', KEYS[1]) > 0 then
+    return 0
+end
+return redis.call('ZREM', KEYS[2], ARGV[2])
+"""
+
+# Зарегистрированный скрипт на каждый клиент Redis (клиент создается на event loop)
+_scripts = weakref.WeakKeyDictionary()
+
+
+class RoomPresence:
+    """
+    Кто сейчас в групповой комнате (Room), общий для всех воркеров.
+
+    ZSET room:online:<room_id>: member - имя пользователя, score - момент истечения heartbeat;
+    число онлайн - это ZCARD за O(1). ZSET room:conn:<room_id>:<username>: соединения пользователя
+    в комнате (channel_name) на всех воркерах. Пользователь выходит из комнаты, когда закрыто
+    его последнее соединение, где бы оно ни было.
+
+    Соединения текущего процесса продлеваются раз в HEARTBEAT_INTERVAL. Heartbeat возвращает
+    в комнату пропавших из ZSET пользователей (потеря ключа в Redis) и вычищает пользователей
+    упавших воркеров - и то и другое попадает в сводку как вход и выход.
+
+    Входы и выходы не рассылаются по одному: каждый воркер копит их и раз в SUMMARY_INTERVAL
+    отправляет в группу комнаты одно событие presence_summary ("N вошли, M вышли").
+    """
+    KEY_PREFIX = 'room:online:'
+    CONN_KEY_PREFIX = 'room:conn:'
+
+    # Соединения процесса: {channel_name: (room_id, room_name, username)}
+    _local_connections = {}
+    # Накопленные изменения: {room_id: {'joined': {username, ...}, 'left': {username, ...}}}
+    _pending = {}
+    _summary_tasks = {}
+    _heartbeat_tasks = {}
+
+    @classmethod
+    def key(cls, room_id):
+        return f'{cls.KEY_PREFIX}{room_id}'
+
+    @classmethod
+    def conn_key(cls, room_id, username):
+        return f'{cls.CONN_KEY_PREFIX}{room_id}:{username}'
+
+    @classmethod
+    def group_name(cls, room_name):
+        return f'chat_{room_name}'
+
+    @classmethod
+    def connection_ttl(cls):
+        return _room_presence_settings().get('CONNECTION_TTL', 60)
+
+    @classmethod
+    def heartbeat_interval(cls):
+        return _room_presence_settings().get('HEARTBEAT_INTERVAL', 20)
+
+    @classmethod
+    def summary_interval(cls):
+        return _room_presence_settings().get('SUMMARY_INTERVAL', 1)
+
+    @classmethod
+    async def join(cls, room_id, room_name, username, channel_name):
+        """Регистрирует соединение в комнате и ставит вход в ближайшую сводку. Возвращает число онлайн"""
+        cls._local_connections[channel_name] = (room_id, room_name, username)
+        cls._ensure_heartbeat()
+
+        now = time.time()
+        ttl = cls.connection_ttl()
+        key, conn_key = cls.key(room_id), cls.conn_key(room_id, username)
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(conn_key, '-inf', now)
+            pipe.zadd(conn_key, {channel_name: now + ttl})
+            pipe.expire(conn_key, ttl)
+            pipe.zadd(key, {username: now + ttl})
+            pipe.expire(key, ttl)
+            pipe.zcard(key)
+            *_, added, _, online = await pipe.execute()
+
+        # Второе соединение того же пользователя (другая вкладка, другой воркер) - не новость
+        if added:
+            cls._record(room_id, room_name, 'joined', username)
+        return online
+
+    @classmethod
+    async def leave(cls, room_id, room_name, username, channel_name):
+        """Снимает соединение; пользователь выходит из комнаты, когда не осталось его соединений ни на одном воркере"""
+        cls._local_connections.pop(channel_name, None)
+
+        redis = get_redis()
+        script = _scripts.get(redis)
+        if script is None:
+            script = _scripts[redis] = redis.register_script(LEAVE_SCRIPT)
+
+        left = await script(
+            keys=[cls.conn_key(room_id, username), cls.key(room_id)],
+            args=[channel_name, username, time.time()]
+        )
+        if left:
+            cls._record(room_id, room_name, 'left', username)
+
+    @classmethod
+    async def members(cls, room_id, limit=100):
+        """Имена пользователей в комнате (не больше limit) для начального списка клиента"""
+        return await get_redis().zrange(cls.key(room_id), 0, limit - 1)
+
+    @classmethod
+    async def count(cls, room_id):
+        return await get_redis().zcard(cls.key(room_id))
+
+    @classmethod
+    def count_sync(cls, room_id):
+        """То же для синхронного кода (админка, шаблоны)"""
+        return get_sync_redis().zcard(cls.key(room_id))
+
+    @classmethod
+    def _record(cls, room_id, room_name, change, username):
+        pending = cls._pending.setdefault(room_id, {'room_name': room_name, 'joined': set(), 'left': set()})
+        # Вошел и вышел в пределах одной сводки - для остальных ничего не изменилось
+        opposite = 'left' if change == 'joined' else 'joined'
+        if username in pending[opposite]:
+            pending[opposite].discard(username)
+        else:
+            pending[change].add(username)
+
+        task = cls._summary_tasks.get(room_id)
+        if task is None or task.done():
+            cls._summary_tasks[room_id] = asyncio.get_running_loop().create_task(cls._send_summary(room_id))
+
+    @classmethod
+    async def _send_summary(cls, room_id):
+        await asyncio.sleep(cls.summary_interval())
+        pending = cls._pending.pop(room_id, None)
+        if not pending or not (pending['joined'] or pending['left']):
+            return
+
+        from channels.layers import get_channel_layer
+
+        max_names = _room_presence_settings().get('SUMMARY_MAX_NAMES', 20)
+        try:
+            await get_channel_layer().group_send(cls.group_name(pending['room_name']), with_frame({
+                'type': 'presence_summary',
+                'joined': sorted(pending['joined'])[:max_names],
+                'left': sorted(pending['left'])[:max_names],
+                'joined_count': len(pending['joined']),
+                'left_count': len(pending['left']),
+                'online_count': await cls.count(room_id),
+            }))
+        except Exception as e:
+            logger.error(f"👥 [ROOM-PRESENCE] Error sending presence summary for room {room_id}: {e}")
+
+    @classmethod
+    async def heartbeat(cls):
+        """
+        Продлеваем соединения процесса, возвращаем пропавших из ZSET пользователей
+        и вычищаем истекших (их соединения остались на упавших воркерах)
+        """
+        if not cls._local_connections:
+            return
+
+        ttl = cls.connection_ttl()
+        now = time.time()
+        rooms = {}
+        for channel_name, (room_id, room_name, username) in list(cls._local_connections.items()):
+            room = rooms.setdefault(room_id, {'room_name': room_name, 'users': {}})
+            room['users'].setdefault(username, []).append(channel_name)
+
+        redis = get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for room_id in rooms:
+                pipe.zrangebyscore(cls.key(room_id), '-inf', now)
+            expired_by_room = await pipe.execute()
+
+        # {позиция команды в pipeline: изменение}, если zrem/zadd вернет 1 - пользователь
+        # действительно вышел (истек) или вернулся в комнату (ключ был потерян)
+        changes = {}
+        async with redis.pipeline(transaction=False) as pipe:
+            for (room_id, room), expired in zip(rooms.items(), expired_by_room):
+                key = cls.key(room_id)
+                for username in expired:
+                    # Свои живые соединения продлеваются ниже, их пользователи из комнаты не выходят
+                    if username not in room['users']:
+                        changes[len(pipe)] = (room_id, room['room_name'], 'left', username)
+                        pipe.zrem(key, username)
+                for username, channel_names in room['users'].items():
+                    conn_key = cls.conn_key(room_id, username)
+                    pipe.zadd(conn_key, {channel_name: now + ttl for channel_name in channel_names})
+                    pipe.expire(conn_key, ttl)
+                    changes[len(pipe)] = (room_id, room['room_name'], 'joined', username)
+                    pipe.zadd(key, {username: now + ttl})
+                pipe.expire(key, ttl)
+            results = await pipe.execute()
+
+        for position, change in changes.items():
+            if results[position]:
+                cls._record(*change)
+
+    @classmethod
+    def _ensure_heartbeat(cls):
+        loop = asyncio.get_running_loop()
+        task = cls._heartbeat_tasks.get(loop)
+        if task is None or task.done():
+            cls._heartbeat_tasks[loop] = loop.create_task(cls._heartbeat_loop())
+
+    @classmethod
+    async def _heartbeat_loop(cls):
+        while cls._local_connections:
+            await asyncio.sleep(cls.heartbeat_interval())
+            try:
+                await cls.heartbeat()
+            except Exception as e:
+                logger.error(f"👥 [ROOM-PRESENCE] Heartbeat failed: {e}")
@@ -0,0 +1,87 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Max
+
+from chatapp.models import MessageDeletion, PrivateChatRoom, PrivateMessage
+from .send_message import client_frame, message_event
+
+logger = logging.getLogger('chatapp.room_sync')
+
+
+def _sync_settings():
+    return getattr(settings, 'CHAT_SYNC', {})
+
+
+def resume_room(room_id, user_id, last_seq):
+    """
+    Что пропустил клиент, у которого есть сообщения комнаты до last_seq включительно.
+
+    Возвращает кадр resume:
+    messages - новые сообщения (seq > last_seq) в формате chat_message,
+    read_up_to - {recipient_id: seq}: все сообщения получателю с seq не больше прочитаны,
+    read_ids - прочитанные сообщения выше водяного знака,
+    deleted_ids - удаленные сообщения (глобально или пользователем для себя).
+    Прочтения и удаления считаются по последним RESUME_WINDOW сообщениям клиента.
+    Если новых сообщений больше RESUME_MAX_MESSAGES, возвращает resync_required:
+    клиенту дешевле перезагрузить историю.
+
+    last_seq кадра - наибольший seq сохраненных сообщений, а не PrivateChatRoom.last_seq:
+    в режиме write-behind номер резервируется при постановке в stream, до записи строки,
+    и клиент с курсором по счетчику комнаты больше не запросил бы еще не сохраненные сообщения.
+    """
+    room_seq = PrivateChatRoom.objects.filter(id=room_id).values_list('last_seq', flat=True).first()
+    if room_seq is None:
+        return {'type': 'error', 'room_id': room_id, 'error': 'Room not found'}
+
+    max_messages = _sync_settings().get('RESUME_MAX_MESSAGES', 500)
+    if last_seq < 0 or last_seq > room_seq or room_seq - last_seq > max_messages:
+        persisted_seq = PrivateMessage.objects.filter(room_id=room_id).aggregate(seq=Max('seq'))['seq']
+        return {'type': 'resync_required', 'room_id': room_id, 'reason': 'too_far_behind',
+                'last_seq': persisted_seq or 0}
+
+    window_start = max(0, last_seq - _sync_settings().get('RESUME_WINDOW', 200))
+    user_deleted_ids = set(MessageDeletion.objects.filter(
+        user_id=user_id, message__room_id=room_id, message__seq__gt=window_start
+    ).values_list('message_id', flat=True))
+
+    # Удаленные строки тоже читаем: они сдвигают курсор, но клиенту не отправляются
+    new_messages = list(PrivateMessage.objects.filter(
+        room_id=room_id, seq__gt=last_seq
+    ).select_related('sender', 'media_file').order_by('seq'))
+    persisted_seq = new_messages[-1].seq if new_messages else last_seq
+
+    window = PrivateMessage.objects.filter(
+        room_id=room_id, seq__gt=window_start, seq__lte=last_seq
+    ).values_list('id', 'seq', 'recipient_id', 'read', 'is_deleted')
+
+    first_unread = {}
+    read_rows = []
+    deleted_ids = set(user_deleted_ids)
+    for message_id, seq, recipient_id, read, is_deleted in window:
+        if is_deleted:
+            deleted_ids.add(message_id)
+        if read:
+            read_rows.append((message_id, seq, recipient_id))
+        elif seq < first_unread.get(recipient_id, last_seq + 1):
+            first_unread[recipient_id] = seq
+
+    read_up_to = {}
+    for _, _, recipient_id in read_rows:
+        read_up_to[recipient_id] = first_unread.get(recipient_id, last_seq + 1) - 1
+
+    return {
+        'type': 'resume',
+        'room_id': room_id,
+        'last_seq': persisted_seq,
+        'messages': [
+            client_frame(message_event(message, message.sender)) for message in new_messages
+            if not message.is_deleted and message.id not in user_deleted_ids
+        ],
+        'read_up_to': read_up_to,
+        'read_ids': [
+            message_id for message_id, seq, recipient_id in read_rows
+            if seq > read_up_to[recipient_id]
+        ],
+        'deleted_ids': sorted(deleted_ids),
+    }
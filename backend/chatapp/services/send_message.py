@@ -0,0 +1,301 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from chatapp.models import PrivateChatRoom, PrivateMessage
+from .db import supports_update_returning
+from .membership import RoomMemberships
+from .recent_messages import RecentMessages
+
+logger = logging.getLogger('chatapp.send_message')
+
+MEDIA_TYPES = ['image', 'video', 'audio', 'document', 'other']
+
+
+def _send_settings():
+    return getattr(settings, 'CHAT_SEND', {})
+
+
+class SendMessageError(Exception):
+    """Сообщение не может быть отправлено, текст ошибки возвращается клиенту"""
+
+
+class DuplicateClientMessage(Exception):
+    """Сообщение с этим client_msg_id отправителя уже сохранено, message_id - его id"""
+
+    def __init__(self, message_id):
+        super().__init__(f'Duplicate of message {message_id}')
+        self.message_id = message_id
+
+
+class RoomParticipantsCache:
+    """
+    Кэш room_id -> (user1_id, user2_id): LRU в памяти процесса перед Redis.
+    Участники комнаты не меняются, поэтому запись сбрасывается только при удалении комнаты.
+    """
+    _local = OrderedDict()  # {room_id: (user1_id, user2_id)}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(room_id):
+        return f'chat:room:participants:{room_id}'
+
+    @classmethod
+    def get_local(cls, room_id):
+        """Поиск только в памяти процесса - безопасно вызывать прямо из event loop"""
+        with cls._lock:
+            participants = cls._local.get(room_id)
+            if participants is not None:
+                cls._local.move_to_end(room_id)
+            return participants
+
+    @classmethod
+    def get(cls, room_id):
+        """Участники комнаты или None, если комнаты нет. Порядок поиска: память процесса, Redis, БД"""
+        participants = cls.get_local(room_id)
+        if participants is not None:
+            return participants
+
+        participants = cache.get(cls.cache_key(room_id))
+        if participants is None:
+            participants = PrivateChatRoom.objects.filter(id=room_id).values_list('user1_id', 'user2_id').first()
+            if participants is None:
+                return None
+            cache.set(cls.cache_key(room_id), participants, timeout=_send_settings().get('PARTICIPANTS_TTL', 86400))
+
+        participants = tuple(participants)
+        with cls._lock:
+            cls._local[room_id] = participants
+            while len(cls._local) > _send_settings().get('PARTICIPANTS_LOCAL_MAX_SIZE', 10000):
+                cls._local.popitem(last=False)
+        return participants
+
+    @classmethod
+    def invalidate(cls, room_id):
+        with cls._lock:
+            cls._local.pop(room_id, None)
+        cache.delete(cls.cache_key(room_id))
+
+
+def next_room_seq(room_id, count=1):
+    """
+    Резервирует count номеров в плотной последовательности комнаты и возвращает последний из них.
+    Вызывается внутри транзакции сохранения: строка комнаты заблокирована до коммита,
+    поэтому номера идут без пропусков и в порядке коммитов.
+    """
+    if supports_update_returning():
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {qn(PrivateChatRoom._meta.db_table)} SET {qn("last_seq")} = {qn("last_seq")} + %s '
+                f'WHERE {qn("id")} = %s RETURNING {qn("last_seq")}',
+                [count, room_id]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    if not PrivateChatRoom.objects.filter(id=room_id).update(last_seq=F('last_seq') + count):
+        return None
+    return PrivateChatRoom.objects.filter(id=room_id).values_list('last_seq', flat=True).get()
+
+
+def find_media_file(sender, media_type, media_hash, media_file_id=None):
+    """
+    Загруженный через media_api файл сообщения: явно указанный клиентом
+    или последний файл того же типа, загруженный отправителем за 30 минут.
+    """
+    from media_api.models import UploadedFile
+
+    if media_file_id:
+        media_file = UploadedFile.objects.filter(id=media_file_id, user=sender).first()
+        if media_file:
+            return media_file
+        logger.warning(f"💾 [DB] Media file {media_file_id} not found for sender {sender.id}")
+
+    if media_type not in MEDIA_TYPES or not media_hash:
+        return None
+
+    now = timezone.now()
+    media_file = UploadedFile.objects.filter(
+        user=sender,
+        file_type=media_type,
+        uploaded_at__gte=now - timedelta(minutes=30),
+        uploaded_at__lte=now + timedelta(minutes=1)
+    ).order_by('-uploaded_at').first()
+    if not media_file:
+        logger.warning(f"💾 [DB] Media file not found for hash {media_hash}, type={media_type}, sender={sender.id}")
+    return media_file
+
+
+def media_reference(media_file):
+    """Ссылка на медиа вместо самих данных: id, URL и MIME тип"""
+    return {
+        'mediaFileId': media_file.id if media_file else None,
+        'mediaUrl': media_file.file.url if media_file and media_file.file else None,
+        'mediaMimeType': media_file.mime_type if media_file else None,
+    }
+
+
+def message_event(message, sender):
+    """Событие chat_message для group_send, собранное из уже загруженных объектов без запросов к БД"""
+    event = {
+        'type': 'chat_message',
+        'message': message.message,
+        'sender__username': sender.username,
+        'sender_id': sender.id,
+        'recipient_id': message.recipient_id,
+        'timestamp': int(message.timestamp.timestamp()),
+        'id': message.id,
+        'read': message.read,
+        'room_id': message.room_id,
+        'seq': message.seq
+    }
+
+    if message.client_msg_id:
+        event['client_msg_id'] = message.client_msg_id
+
+    if message.reply_to_message_id:
+        event.update({
+            'reply_to_message_id': message.reply_to_message_id,
+            'reply_to_message_text': message.reply_to_message_text,
+            'reply_to_sender_name': message.reply_to_sender_name,
+            'reply_to_media_type': message.reply_to_media_type
+        })
+
+    if message.media_type != 'text':
+        event.update({
+            'mediaType': message.media_type,
+            'mediaHash': message.media_hash,
+            'mediaFileName': message.media_filename,
+            'mediaSize': message.media_size,
+        })
+        event.update(media_reference(message.media_file))
+
+    return event
+
+
+def client_frame(event):
+    """
+    Кадр сообщения для клиента из события chat_message.
+    Поля реплая переименовываются в названия, которые ожидает фронтенд.
+    """
+    frame = {
+        'message': event['message'],
+        'sender__username': event.get('sender__username', event.get('sender', 'Unknown')),
+        'timestamp': event['timestamp'],
+        'id': event.get('id', event.get('message_id')),
+        'sender_id': event.get('sender_id'),
+        'read': event.get('read', False),
+        'seq': event.get('seq'),
+    }
+
+    # Отправитель сопоставляет эхо своего сообщения с локальной копией
+    if event.get('client_msg_id'):
+        frame['client_msg_id'] = event['client_msg_id']
+
+    if event.get('reply_to_message_id'):
+        frame.update({
+            'reply_to_message_id': event['reply_to_message_id'],
+            'reply_to_message': event.get('reply_to_message_text'),
+            'reply_to_sender': event.get('reply_to_sender_name'),
+            'reply_to_media_type': event.get('reply_to_media_type')
+        })
+
+    if event.get('mediaType') and event.get('mediaHash'):
+        frame.update({
+            'mediaType': event['mediaType'],
+            'mediaHash': event['mediaHash'],
+            'mediaFileName': event.get('mediaFileName'),
+            'mediaSize': event.get('mediaSize')
+        })
+
+        # Ссылки на файл и временную inline-копию
+        for key in ('mediaFileId', 'mediaUrl', 'mediaMimeType', 'mediaInlineId', 'mediaInlineUrl'):
+            if event.get(key) is not None:
+                frame[key] = event[key]
+
+    return frame
+
+
+def send_message(sender, room_id, message_content, media_type='text', media_hash=None, media_filename=None,
+                 media_size=None, media_file_id=None, reply_to_message_id=None, reply_to_message_text=None,
+                 reply_to_sender_name=None, reply_to_media_type=None, client_msg_id=None):
+    """
+    Сохраняет сообщение в одной транзакции и возвращает (message, event).
+
+    Участники комнаты берутся из RoomParticipantsCache, получатель - второй участник.
+    Ответ допускается только на сообщение той же комнаты. Сообщение получает следующий
+    номер в последовательности комнаты (seq), счетчики RoomMembership обновляются
+    в той же транзакции. event - готовое событие chat_message
+    для group_send, дополнительных запросов при рассылке не требуется.
+    Если сообщение с тем же client_msg_id отправителя уже есть, транзакция откатывается
+    (номер seq не расходуется) и выбрасывается DuplicateClientMessage.
+    """
+    participants = RoomParticipantsCache.get(room_id)
+    if participants is None or sender.id not in participants:
+        raise SendMessageError('Not a room participant')
+    recipient_id = participants[1] if participants[0] == sender.id else participants[0]
+
+    try:
+        with transaction.atomic():
+            media_file = None
+            if media_type != 'text':
+                media_file = find_media_file(sender, media_type, media_hash, media_file_id)
+
+            if reply_to_message_id:
+                reply_to_message_id = PrivateMessage.objects.filter(
+                    id=reply_to_message_id, room_id=room_id
+                ).values_list('id', flat=True).first()
+                if reply_to_message_id is None:
+                    logger.warning(f"💾 [DB] Reply_to message not found in room {room_id}")
+
+            message = PrivateMessage.objects.create(
+                room_id=room_id,
+                seq=next_room_seq(room_id),
+                sender=sender,
+                recipient_id=recipient_id,
+                message=message_content,
+                timestamp=timezone.now(),
+                media_type=media_type,
+                media_hash=media_hash,
+                media_filename=media_filename,
+                media_size=media_size,
+                media_file=media_file,
+                reply_to_message_id=reply_to_message_id,
+                reply_to_message_text=reply_to_message_text if reply_to_message_id else None,
+                reply_to_sender_name=reply_to_sender_name if reply_to_message_id else None,
+                reply_to_media_type=reply_to_media_type if reply_to_message_id else None,
+                client_msg_id=client_msg_id,
+                is_deleted=False
+            )
+            RoomMemberships.message_saved(message)
+    except IntegrityError:
+        existing_id = None
+        if client_msg_id:
+            existing_id = PrivateMessage.objects.filter(
+                sender=sender, client_msg_id=client_msg_id
+            ).values_list('id', flat=True).first()
+        if existing_id is None:
+            raise
+        raise DuplicateClientMessage(existing_id)
+
+    logger.debug("💾 [DB] ✅ Message saved with ID: %s, media_file: %s", message.id, media_file.id if media_file else None)
+    RecentMessages.push(message)
+    return message, message_event(message, sender)
+
+
+@receiver(post_delete, sender=PrivateChatRoom)
+def invalidate_room_participants(sender, instance, **kwargs):
+    try:
+        RoomParticipantsCache.invalidate(instance.id)
+    except Exception as e:
+        logger.error(f"Error invalidating room participants cache: {e}")
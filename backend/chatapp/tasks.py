@@ -0,0 +1,61 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .push_notifications import PushNotificationService
+from .services.presence import PresenceRegistry
+from .services.push_dispatch import dedupe_key
+from .services.redis_client import get_sync_redis
+
+logger = logging.getLogger('chatapp.tasks')
+
+
+def _push_settings():
+    return getattr(settings, 'CHAT_PUSH', {})
+
+
+@shared_task(bind=True, max_retries=None, ignore_result=True)
+def send_message_push_task(self, message_id, recipient_id, sender_name, message_text, room_id):
+    """
+    Push-уведомление о новом сообщении через Firebase FCM.
+    Данные сообщения передаются в аргументах: в режиме write-behind строки в БД может еще не быть.
+    Если к моменту отправки получатель подключен хотя бы к одному воркеру, push не нужен -
+    сообщение уже пришло по WebSocket. Неудачная отправка повторяется с экспоненциальной паузой.
+    """
+    redis = get_sync_redis()
+    if redis.get(dedupe_key(message_id)) in ('sent', 'skipped'):
+        return
+
+    if PresenceRegistry.is_user_online_sync(recipient_id):
+        logger.info(f"🔥 [PUSH-TASK] User {recipient_id} is online - push for message {message_id} skipped")
+        redis.set(dedupe_key(message_id), 'skipped', xx=True, keepttl=True)
+        return
+
+    fcm_token = get_user_model().objects.filter(id=recipient_id).values_list('fcm_token', flat=True).first()
+    if not fcm_token:
+        logger.warning(f"🔥 [PUSH-TASK] ❌ No FCM token found for user {recipient_id}")
+        redis.set(dedupe_key(message_id), 'skipped', xx=True, keepttl=True)
+        return
+
+    try:
+        sent = PushNotificationService.send_message_notification(
+            fcm_tokens=[fcm_token],
+            sender_name=sender_name,
+            message_text=message_text,
+            chat_id=room_id
+        )
+    except Exception as e:
+        logger.error(f"🔥 [PUSH-TASK] ❌ Error sending push for message {message_id}: {e}")
+        sent = False
+
+    if sent:
+        redis.set(dedupe_key(message_id), 'sent', xx=True, keepttl=True)
+        return
+
+    # Недействительный токен сервис уже удалил, на следующей попытке задача завершится без отправки
+    if self.request.retries >= _push_settings().get('MAX_RETRIES', 3):
+        logger.error(f"🔥 [PUSH-TASK] ❌ Giving up push for message {message_id} after {self.request.retries} retries")
+        return
+    raise self.retry(countdown=_push_settings().get('RETRY_BACKOFF', 2) * 2 ** self.request.retries)
@@ -1,6 +1,5 @@
 from django import template
-from django.db.models import Q
-from chatapp.models import PrivateMessage
+from chatapp.services.membership import RoomMemberships
 
 register = template.Library()
 
@@ -9,10 +8,7 @@ register = template.Library()
 def unread_message_count(context):
     request = context['request']
     if request.user.is_authenticated:
-        unread_count = PrivateMessage.objects.filter(
-            Q(room__user1=request.user) | Q(room__user2=request.user),
-            read=False,
-        ).exclude(sender=request.user).count()
-        return unread_count
+        # Сумма счетчиков RoomMembership пользователя вместо подсчета сообщений
+        return RoomMemberships.unread_total(request.user.id)
     else:
         return 0
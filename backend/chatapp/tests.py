@@ -1,8 +1,36 @@
+import asyncio
+import json
+import re
+import uuid
+from pathlib import Path
+from unittest import mock
+
 from channels.testing import ChannelsLiveServerTestCase
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
 from selenium import webdriver
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.wait import WebDriverWait
 
+from authapp.models import CustomUser
+from chatapp.consumers import PrivateChatConsumer
+from chatapp.management.commands.chat_benchmark import create_chat_fixture
+from chatapp.models import MessageDeletion, PrivateChatRoom, PrivateMessage, RoomMembership
+from chatapp.services.chat_list import get_chat_list
+from chatapp.services import message_dedupe, rate_limit
+from chatapp.services.ingest import persist_batch, serialize
+from chatapp.services.media_blobs import inline_mime_type
+from chatapp.services.membership import RoomMemberships
+from chatapp.services.metrics import METRICS_KEY
+from chatapp.services.db import supports_update_returning
+from chatapp.services.outbound import OutboundQueue
+from chatapp.services.redis_client import get_redis, get_sync_redis
+from chatapp.services.read_receipts import mark_read_up_to
+from chatapp.services.recent_messages import RecentMessages
+from chatapp.services.room_sync import resume_room
+from chatapp.services.send_message import DuplicateClientMessage, SendMessageError, send_message
+
 class ChatTests(ChannelsLiveServerTestCase):
     serve_static = True  # emulate StaticLiveServerTestCase
 
@@ -90,4 +118,404 @@ class ChatTests(ChannelsLiveServerTestCase):
 
     @property
     def _chat_log_value(self):
-        return self.driver.find_element('#chat-log').get_property('value')
\ No newline at end of file
+        return self.driver.find_element('#chat-log').get_property('value')
+
+class ChatListQueryCountTests(TestCase):
+    """Число запросов списка чатов не зависит от количества комнат"""
+
+    def test_query_count_is_flat(self):
+        for rooms in (10, 100, 1000):
+            owner = create_chat_fixture(rooms)
+            with self.assertNumQueries(2):
+                chats = get_chat_list(owner)
+            self.assertTrue(chats)
+
+    def test_respects_deleted_messages_and_cursor(self):
+        owner = create_chat_fixture(30)
+        deleted_ids = set(MessageDeletion.objects.filter(user=owner).values_list('message_id', flat=True))
+
+        chats = get_chat_list(owner)
+        for chat in chats:
+            self.assertFalse(chat['last_message'].is_deleted)
+            self.assertNotIn(chat['last_message'].id, deleted_ids)
+
+        first_page = get_chat_list(owner, limit=10)
+        second_page = get_chat_list(owner, limit=10, before=first_page[-1]['last_message'].id)
+        self.assertEqual(
+            [chat['room'].id for chat in first_page + second_page],
+            [chat['room'].id for chat in chats[:20]]
+        )
+
+
+class SendMessageTests(TestCase):
+    """Сообщение сохраняется одной транзакцией, событие собирается без дополнительных запросов"""
+
+    def setUp(self):
+        self.owner = create_chat_fixture(2)
+        self.room = PrivateChatRoom.objects.filter(user1=self.owner).first()
+
+    def test_builds_event_without_extra_queries(self):
+        reply_to = PrivateMessage.objects.filter(room=self.room).first()
+        send_message(self.owner, self.room.id, 'warm up')
+
+        # SAVEPOINT/RELEASE транзакции, проверка реплая, номер seq, INSERT и счетчики участников
+        with self.assertNumQueries(6 if supports_update_returning() else 7):
+            message, event = send_message(self.owner, self.room.id, 'hello', reply_to_message_id=reply_to.id)
+
+        self.assertEqual(event['id'], message.id)
+        self.assertEqual(event['seq'], 5)
+        self.assertEqual(event['recipient_id'], self.room.user2_id)
+        self.assertEqual(event['reply_to_message_id'], reply_to.id)
+        self.assertEqual(event['room_id'], self.room.id)
+
+    def test_rejects_non_participant(self):
+        outsider = create_chat_fixture(1)
+        with self.assertRaises(SendMessageError):
+            send_message(outsider, self.room.id, 'hello')
+
+    def test_repeated_client_msg_id_returns_original_message(self):
+        message, event = send_message(self.owner, self.room.id, 'hello', client_msg_id='c-1')
+        self.assertEqual(event['client_msg_id'], 'c-1')
+
+        with self.assertRaises(DuplicateClientMessage) as raised:
+            send_message(self.owner, self.room.id, 'hello', client_msg_id='c-1')
+
+        self.assertEqual(raised.exception.message_id, message.id)
+        # Повтор не занимает номер seq
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_seq, message.seq)
+
+
+class RoomMembershipTests(TestCase):
+    """Счетчики RoomMembership меняются вместе с сообщениями и совпадают с пересчетом"""
+
+    def setUp(self):
+        self.owner = create_chat_fixture(3)
+        self.room = PrivateChatRoom.objects.filter(user1=self.owner).first()
+
+    def counters(self):
+        return dict(RoomMembership.objects.filter(room=self.room).values_list('user_id', 'unread_count'))
+
+    def test_send_and_read_keep_counters_in_sync_with_rebuild(self):
+        unread = self.counters()[self.owner.id]
+        message, _ = send_message(self.room.user2, self.room.id, 'hello')
+
+        self.assertEqual(self.counters()[self.owner.id], unread + 1)
+        membership = RoomMembership.objects.get(room=self.room, user=self.room.user2)
+        self.assertEqual(membership.last_message_id, message.id)
+
+        mark_read_up_to(self.room.id, self.owner.id)
+        membership = RoomMembership.objects.get(room=self.room, user=self.owner)
+        self.assertEqual(membership.unread_count, 0)
+        self.assertEqual(membership.last_read_message_id, message.id)
+
+        counters = self.counters()
+        RoomMemberships.rebuild([self.room.id])
+        self.assertEqual(self.counters(), counters)
+
+    def test_reading_hidden_message_does_not_change_counter(self):
+        hidden, _ = send_message(self.room.user2, self.room.id, 'hidden')
+        send_message(self.room.user2, self.room.id, 'visible')
+        MessageDeletion.objects.create(user=self.owner, message=hidden)
+        RoomMemberships.rebuild([self.room.id])
+        counters = self.counters()
+
+        # Частичное прочтение до скрытого сообщения: видимых непрочитанных не убавилось
+        mark_read_up_to(self.room.id, self.owner.id, hidden.id)
+        self.assertEqual(self.counters(), counters)
+        RoomMemberships.rebuild([self.room.id])
+        self.assertEqual(self.counters(), counters)
+
+
+class ResumeRoomTests(TestCase):
+    """После переподключения клиент получает пропущенное по номеру последнего сообщения"""
+
+    def setUp(self):
+        self.owner = create_chat_fixture(1, messages_per_room=6)
+        self.room = PrivateChatRoom.objects.get(user1=self.owner)
+
+    def test_returns_missed_messages_reads_and_deletions(self):
+        message, _ = send_message(self.owner, self.room.id, 'missed')
+        deleted = PrivateMessage.objects.get(room=self.room, seq=2)
+        deleted.is_deleted = True
+        deleted.save(update_fields=['is_deleted'])
+
+        frame = resume_room(self.room.id, self.owner.id, last_seq=6)
+
+        self.assertEqual(frame['type'], 'resume')
+        self.assertEqual(frame['last_seq'], 7)
+        self.assertEqual([m['id'] for m in frame['messages']], [message.id])
+        self.assertEqual(frame['messages'][0]['seq'], 7)
+        self.assertIn(deleted.id, frame['deleted_ids'])
+        # Сообщения собеседнику прочитаны все, входящие владельцу - нет
+        self.assertEqual(frame['read_up_to'], {self.room.user2_id: 6})
+
+    def test_cursor_stops_before_reserved_but_unsaved_message(self):
+        # Так номер резервирует reserve_message в режиме write-behind: счетчик комнаты уже 7, строки нет
+        PrivateChatRoom.objects.filter(id=self.room.id).update(last_seq=7)
+
+        frame = resume_room(self.room.id, self.owner.id, last_seq=6)
+        self.assertEqual((frame['last_seq'], frame['messages']), (6, []))
+
+        message = PrivateMessage.objects.create(room=self.room, sender=self.owner, recipient=self.room.user2,
+                                                message='persisted later', seq=7)
+        frame = resume_room(self.room.id, self.owner.id, last_seq=6)
+        self.assertEqual(frame['last_seq'], 7)
+        self.assertEqual([m['id'] for m in frame['messages']], [message.id])
+
+    def test_requires_resync_when_too_far_behind(self):
+        with self.settings(CHAT_SYNC={'RESUME_MAX_MESSAGES': 3}):
+            frame = resume_room(self.room.id, self.owner.id, last_seq=1)
+        self.assertEqual(frame['type'], 'resync_required')
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """Кадры-снимки схлопываются, переполненная очередь закрывает соединение"""
+
+    def make_queue(self):
+        self.sent = []
+        self.evicted = []
+
+        async def send_frame(text_data):
+            self.sent.append(text_data)
+
+        async def evict(text_data):
+            self.evicted.append(text_data)
+
+        queue = OutboundQueue('test.channel', send_frame, evict)
+        # Публикация глубины в Redis в тестах не нужна
+        OutboundQueue._report_tasks.pop(asyncio.get_running_loop()).cancel()
+        return queue
+
+    async def test_snapshot_replaces_unsent_one_and_keeps_order(self):
+        queue = self.make_queue()
+        await queue.put('message 1')
+        await queue.put('status online', coalesce_key='status')
+        await queue.put('message 2')
+        await queue.put('status offline', coalesce_key='status')
+        self.assertEqual(queue.depth, 3)
+
+        await queue._writer
+        queue.close()
+
+        self.assertEqual(self.sent, ['message 1', 'message 2', 'status offline'])
+        self.assertEqual(queue.take_counters(), {'outbound.frames': 3, 'outbound.coalesced': 1})
+
+    async def test_evicts_consumer_over_limit_for_too_long(self):
+        with self.settings(CHAT_OUTBOUND={'MAX_FRAMES': 2, 'EVICT_AFTER': 10}):
+            queue = self.make_queue()
+        with mock.patch('chatapp.services.outbound.time.monotonic', side_effect=[100, 111]):
+            for number in range(4):
+                await queue.put(f'message {number}')
+
+        self.assertEqual(self.sent, [])
+        self.assertEqual(len(self.evicted), 1)
+        self.assertIn('resync_required', self.evicted[0])
+        self.assertNotIn('test.channel', OutboundQueue._local_queues)
+
+        # После закрытия новые кадры не принимаются
+        await queue.put('late')
+        self.assertEqual(queue.depth, 0)
+
+
+class RateLimitTests(SimpleTestCase):
+    """Token bucket в Redis: отказ при исчерпании бюджета, учет отказов и пополнение со временем"""
+
+    user_id = 'rate-limit-test'
+
+    async def dropped(self):
+        return int(await get_redis().hget(METRICS_KEY, 'ratelimit.message.dropped') or 0)
+
+    async def test_drops_over_burst_and_refills(self):
+        redis = get_redis()
+        await redis.delete(rate_limit.key(self.user_id, 'message'))
+        dropped = await self.dropped()
+        try:
+            # 20 токенов в секунду: новый токен через 50 мс
+            with self.settings(CHAT_RATE_LIMITS={'message': {'RATE': 20, 'BURST': 2}}):
+                self.assertIsNone(await rate_limit.consume(self.user_id, 'chat_message'))
+                self.assertIsNone(await rate_limit.consume(self.user_id, 'media_message'))
+                limited = await rate_limit.consume(self.user_id, 'chat_message')
+
+                self.assertEqual(limited['type'], 'rate_limited')
+                self.assertEqual(limited['bucket'], 'message')
+                self.assertTrue(0 < limited['retry_after_ms'] <= 50)
+                self.assertEqual(await self.dropped(), dropped + 1)
+
+                await asyncio.sleep(0.1)
+                self.assertIsNone(await rate_limit.consume(self.user_id, 'chat_message'))
+                self.assertIsNone(await rate_limit.consume(self.user_id, 'chat_message'))
+                self.assertIsNotNone(await rate_limit.consume(self.user_id, 'chat_message'))
+                self.assertEqual(await self.dropped(), dropped + 2)
+        finally:
+            await redis.delete(rate_limit.key(self.user_id, 'message'))
+
+
+def create_private_room():
+    """Пустая личная комната двух новых пользователей"""
+    prefix = uuid.uuid4().hex[:8]
+    # bulk_create не вызывает CustomUser.save(), который копирует файл аватара по умолчанию
+    user1, user2 = CustomUser.objects.bulk_create([
+        CustomUser(username=f'test_{prefix}_{i}', email=f'test_{prefix}_{i}@test.local') for i in (1, 2)
+    ])
+    return PrivateChatRoom.objects.create(user1=user1, user2=user2)
+
+
+class PersistBatchTests(TestCase):
+    """Воркер ingest сохраняет пачку stream без повторов и с номерами seq"""
+
+    def setUp(self):
+        self.room = create_private_room()
+        self.next_id = (PrivateMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1000
+
+    def entry(self, room=None, seq=None, client_msg_id=None):
+        room = room or self.room
+        self.next_id += 1
+        message = PrivateMessage(
+            id=self.next_id, seq=seq, room_id=room.id, sender_id=room.user1_id, recipient_id=room.user2_id,
+            message=f'message {self.next_id}', timestamp=timezone.now(), client_msg_id=client_msg_id
+        )
+        return f'{self.next_id}-0', {'message': json.dumps(serialize(message))}
+
+    def unread(self):
+        return RoomMembership.objects.get(room=self.room, user_id=self.room.user2_id).unread_count
+
+    def test_redelivered_entry_and_repeated_client_msg_id_are_saved_once(self):
+        first = self.entry(seq=1, client_msg_id='c-1')
+        persist_batch([first])
+        # Повтор той же записи после падения воркера и повтор клиента с новым id
+        persist_batch([first, self.entry(seq=2, client_msg_id='c-1')])
+
+        self.assertEqual(list(PrivateMessage.objects.filter(room=self.room).values_list('id', flat=True)),
+                         [int(first[0].split('-')[0])])
+        self.assertEqual(self.unread(), 1)
+
+    def test_assigns_seq_to_entries_without_one_in_stream_order(self):
+        self.room.last_seq = 1
+        self.room.save(update_fields=['last_seq'])
+        persist_batch([self.entry(seq=1), self.entry(), self.entry()])
+
+        self.assertEqual(
+            list(PrivateMessage.objects.filter(room=self.room).order_by('id').values_list('seq', flat=True)),
+            [1, 2, 3]
+        )
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_seq, 3)
+
+    def test_skips_messages_of_deleted_room(self):
+        deleted_room = create_private_room()
+        orphan = self.entry(room=deleted_room, seq=1)
+        deleted_room_id = deleted_room.id
+        deleted_room.delete()
+
+        rows = persist_batch([orphan, self.entry(seq=1)])
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(PrivateMessage.objects.filter(room=self.room).count(), 1)
+        self.assertFalse(PrivateMessage.objects.filter(room_id=deleted_room_id).exists())
+        self.assertEqual(self.unread(), 1)
+
+
+class RepeatedSendTests(SimpleTestCase):
+    """Повтор кадра с тем же client_msg_id получает message_ack с id исходного сообщения"""
+
+    client_msg_id = 'dedupe-test'
+
+    def make_consumer(self):
+        consumer = PrivateChatConsumer()
+        consumer.user = CustomUser(id=-1, username='dedupe_test')
+        consumer.room_id = 7
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    def last_frame(self, consumer):
+        return json.loads(consumer.send.call_args.kwargs['text_data'])
+
+    async def test_resend_is_acked_with_original_message_id(self):
+        consumer = self.make_consumer()
+        key = message_dedupe.dedupe_key(consumer.user.id, self.client_msg_id)
+        await get_redis().delete(key)
+        try:
+            self.assertFalse(await consumer.is_repeated_send(self.client_msg_id))
+
+            # Первая попытка еще сохраняется
+            self.assertTrue(await consumer.is_repeated_send(self.client_msg_id))
+            self.assertEqual(self.last_frame(consumer)['status'], 'pending')
+
+            await consumer.remember_client_msg_id(self.client_msg_id, 42)
+            self.assertTrue(await consumer.is_repeated_send(self.client_msg_id))
+            self.assertEqual(self.last_frame(consumer), {
+                'type': 'message_ack', 'client_msg_id': self.client_msg_id, 'room_id': 7,
+                'status': 'duplicate', 'id': 42,
+            })
+
+            # После неудачного сохранения повтор проходит как новое сообщение
+            await consumer.release_client_msg_id(self.client_msg_id)
+            self.assertFalse(await consumer.is_repeated_send(self.client_msg_id))
+        finally:
+            await get_redis().delete(key)
+
+
+class RecentMessagesTests(TestCase):
+    """Первая страница истории из Redis и пересборка списка после изменений комнаты"""
+
+    def setUp(self):
+        self.room = create_private_room()
+        self.messages = [
+            PrivateMessage.objects.create(room=self.room, sender=self.room.user1, recipient=self.room.user2,
+                                          message=f'message {seq}', seq=seq)
+            for seq in (1, 2, 3)
+        ]
+        keys = (RecentMessages.key(self.room.id), RecentMessages.version_key(self.room.id))
+        get_sync_redis().delete(*keys)
+        self.addCleanup(get_sync_redis().delete, *keys)
+
+    def page_ids(self, limit):
+        messages, has_more = RecentMessages.page(self.room.id, self.room.user2_id, limit)
+        return [message['id'] for message in messages], has_more
+
+    def test_page_is_served_from_redis_after_rebuild(self):
+        newest = [message.id for message in reversed(self.messages)]
+        self.assertEqual(self.page_ids(2), (newest[:2], True))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page_ids(5), (newest, False))
+
+    def test_rebuild_started_before_version_bump_is_not_stored(self):
+        version = get_sync_redis().get(RecentMessages.version_key(self.room.id))
+        stale_entries = [RecentMessages.entry(message) for message in reversed(self.messages)]
+
+        deleted = self.messages[-1]
+        deleted.is_deleted = True
+        deleted.save(update_fields=['is_deleted'])
+        RecentMessages.mark_deleted(self.room.id, [deleted.id], self.room.user1_id, for_everyone=True)
+
+        RecentMessages._store(self.room.id, version, stale_entries)
+        self.assertEqual(get_sync_redis().llen(RecentMessages.key(self.room.id)), 0)
+
+        # Следующее чтение пересобирает список из БД уже без удаленного сообщения
+        self.assertEqual(self.page_ids(5), ([self.messages[1].id, self.messages[0].id], False))
+        self.assertEqual(get_sync_redis().llen(RecentMessages.key(self.room.id)), 2)
+
+
+class InlineMediaTypeTests(SimpleTestCase):
+    """Inline отдаются только изображения, видео и аудио, которые браузер не исполняет"""
+
+    def test_only_passive_media_is_inline(self):
+        self.assertEqual(inline_mime_type('Image/JPEG; charset=binary'), 'image/jpeg')
+        self.assertEqual(inline_mime_type('video/mp4'), 'video/mp4')
+        for mime_type in ('text/html', 'image/svg+xml', 'application/xhtml+xml', 'image/png\r\nX: 1', '', None):
+            self.assertIsNone(inline_mime_type(mime_type))
+
+
+class HotPathLoggersTests(SimpleTestCase):
+    """Логгеры сервисов чата пишут через фильтр горячего пути"""
+
+    def test_service_loggers_are_hot_path(self):
+        names = {
+            name
+            for path in (Path(__file__).parent / 'services').glob('*.py')
+            for name in re.findall(r"getLogger\('(chatapp\.[\w.]+)'\)", path.read_text(encoding='utf-8'))
+        }
+        self.assertTrue(names)
+        self.assertEqual(names - set(settings.HOT_PATH_LOGGERS), set())
@@ -4,7 +4,8 @@ from rest_framework.routers import DefaultRouter
 
 from .apps import ChatappConfig
 from .models import PrivateChatRoom
-from .view_api import ChatViewSet, get_room_info, save_push_token, delete_messages
+from .view_api import ChatViewSet, get_room_info, save_push_token, delete_messages, chat_metrics, \
+    chat_queue_metrics, get_inline_media
 from .views import IndexView, room_view, get_private_room, private_chat_view, get_chat_history, \
     user_dialog_list
 
@@ -24,5 +25,8 @@ urlpatterns = [
     path('api/room/<int:room_id>/info/', get_room_info, name='get_room_info'),
     path('api/save-push-token/', save_push_token, name='save_push_token'),
     path('api/messages/delete/', delete_messages, name='delete_messages'),
+    path('api/metrics/', chat_metrics, name='chat_metrics'),
+    path('api/metrics/queues/', chat_queue_metrics, name='chat_queue_metrics'),
+    path('api/media/inline/<str:blob_id>/', get_inline_media, name='inline_media'),
 
 ]
@@ -1,15 +1,23 @@
 import logging
 
 from django.contrib.auth import get_user_model
-from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.utils.http import content_disposition_header
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q, F, IntegerField, Case, When, Subquery, OuterRef, Count, CharField, Value
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from django.db import transaction
+from django.db.models import Q
 from .models import PrivateChatRoom, PrivateMessage
-from .serializers import ChatRoomSerializer, ChatPreviewSerializer
+from .serializers import ChatRoomSerializer, ChatPreviewSerializer, live_presence
+from .services.chat_list import get_chat_list, format_chat_preview
+from .services.media_blobs import get_inline_blob, inline_mime_type
+from .services.membership import RoomMemberships
+from .services.metrics import get_counters
+from .services.outbound import get_queue_depths
+from .services.recent_messages import RecentMessages
 
 logger = logging.getLogger(__name__)
 
@@ -29,77 +37,29 @@ class ChatViewSet(viewsets.GenericViewSet,
 
     @action(detail=False, methods=['get'],url_path='list-preview')
     def list_preview(self, request):
-        user = self.request.user
-
-        # Подзапрос для последнего сообщения с учетом типа медиа
-        last_message_subquery = Subquery(
-            PrivateMessage.objects.filter(
-                room=OuterRef('pk')
-            ).order_by('-timestamp')[:1].annotate(
-                formatted_message=Case(
-                    When(media_type='image', then=Value('📷 Изображение')),
-                    When(media_type='video', then=Value('🎥 Видео')),
-                    When(media_type='document', then=Value('📄 Документ')),
-                    When(media_type='other', then=Value('📎 Файл')),
-                    default=F('message'),
-                    output_field=CharField(),
-                )
-            ).values('formatted_message')
-        )
-
-        # Подзапрос для времени последнего сообщения
-        last_message_time_subquery = Subquery(
-            PrivateMessage.objects.filter(
-                room=OuterRef('pk')
-            ).order_by('-timestamp')[:1].values('timestamp')
-        )
-
-        # Подзапрос для подсчета непрочитанных сообщений
-        unread_count_subquery = Subquery(
-            PrivateMessage.objects.filter(
-                room=OuterRef('pk'),
-                recipient=user,
-                read=False
-            ).values('room')
-            .annotate(count=Count('id'))
-            .values('count')
-        )
-
-        # Получаем все чаты пользователя с дополнительной информацией
-        chats = PrivateChatRoom.objects.filter(
-            Q(user1=user) | Q(user2=user)
-        ).annotate(
-            other_user=Case(
-                When(user1=user, then=F('user2')),
-                When(user2=user, then=F('user1')),
-                output_field=IntegerField(),
-            ),
-            last_message=last_message_subquery,
-            last_message_time=last_message_time_subquery,
-            unread_count=Coalesce(unread_count_subquery, 0)
-        ).select_related('user1', 'user2')
-
-        # Подготавливаем данные для сериализации
-        chat_previews = []
-        for chat in chats:
-            # Теперь включаем чаты даже если last_message пустое или None
-            # Это может произойти для совсем новых чатов
-            if chat.last_message_time:  # Проверяем наличие хотя бы времени
-                chat_preview = {
-                    'id': chat.id,
-                    'other_user': chat.user2 if chat.user1 == user else chat.user1,
-                    'last_message': chat.last_message or '📎 Медиафайл',  # Fallback для пустых сообщений
-                    'last_message_time': chat.last_message_time,
-                    'unread_count': chat.unread_count
-                }
-                chat_previews.append(chat_preview)
-
-        serializer = ChatPreviewSerializer(chat_previews, many=True)
+        """
+        Список чатов с последним сообщением и числом непрочитанных.
+        Необязательная пагинация: ?limit=N&before=<last_message_id последнего чата страницы>
+        """
+        try:
+            limit = request.query_params.get('limit')
+            before = request.query_params.get('before')
+            limit = int(limit) if limit else None
+            before = int(before) if before else None
+        except ValueError:
+            return Response({'error': 'Invalid limit or before'}, status=status.HTTP_400_BAD_REQUEST)
+
+        chat_previews = [
+            format_chat_preview(chat)
+            for chat in get_chat_list(request.user, limit=limit, before=before)
+        ]
+
+        # Статус собеседников из Redis одним pipeline на весь список
+        presence = live_presence(chat['other_user'].id for chat in chat_previews)
+        serializer = ChatPreviewSerializer(chat_previews, many=True, context={'live_presence': presence})
         return Response(serializer.data)
 
 
-
-
 User = get_user_model()
 
 
@@ -161,6 +121,70 @@ def save_push_token(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_inline_media(request, blob_id):
+    """
+    Временная inline-копия медиа, отправленного через WebSocket.
+    Доступна только участникам комнаты и живет CHAT_MEDIA['INLINE_TTL'] секунд.
+    """
+    blob = get_inline_blob(blob_id)
+    if blob is None:
+        return Response({'error': 'Media expired or not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    user = request.user
+    is_participant = PrivateChatRoom.objects.filter(
+        Q(user1=user) | Q(user2=user),
+        id=blob['room_id']
+    ).exists()
+    if not is_participant:
+        return Response({'error': 'Access denied'}, status=status.HTTP_403_FORBIDDEN)
+
+    # Тип и имя файла задал отправитель: HTML, SVG и прочее отдаем только на скачивание
+    mime_type = inline_mime_type(blob['mime_type'])
+    response = HttpResponse(blob['content'], content_type=mime_type or 'application/octet-stream')
+    response['Content-Length'] = len(blob['content'])
+    response['Cache-Control'] = 'private, max-age=300'
+    response['X-Content-Type-Options'] = 'nosniff'
+    # Управляющие символы (CR/LF) в имени файла ломали бы заголовок
+    filename = ''.join(char for char in blob.get('filename') or '' if char.isprintable())
+    disposition = content_disposition_header(as_attachment=mime_type is None, filename=filename)
+    if disposition:
+        response['Content-Disposition'] = disposition
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def chat_metrics(request):
+    """
+    Счетчики WebSocket слоя всех воркеров (например, сколько триггеров пересчета было схлопнуто)
+    """
+    try:
+        return Response(get_counters(request.query_params.get('prefix', '')))
+    except Exception as e:
+        logger.error(f"Error reading chat metrics: {str(e)}")
+        return Response({'error': 'Metrics unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def chat_queue_metrics(request):
+    """
+    Глубина исходящих очередей WebSocket соединений всех воркеров: {channel_name: кадров в очереди}
+    """
+    try:
+        min_depth = int(request.query_params.get('min_depth', 0))
+    except ValueError:
+        return Response({'error': 'Invalid min_depth'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        return Response(get_queue_depths(min_depth))
+    except Exception as e:
+        logger.error(f"Error reading outbound queue metrics: {str(e)}")
+        return Response({'error': 'Metrics unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_room_info(request, room_id):
@@ -169,6 +193,7 @@ def get_room_info(request, room_id):
 
         # Определяем, кто является получателем для текущего пользователя
         other_user = room.user2 if room.user1 == request.user else room.user1
+        is_online = live_presence([other_user.id]).get(other_user.id, (other_user.is_online, None))[0]
 
         return Response({
             'user1_id': room.user1.id,
@@ -177,7 +202,7 @@ def get_room_info(request, room_id):
                 'id': other_user.id,
                 'username': other_user.username,
                 'avatar': other_user.avatar.url if other_user.avatar else None,
-                'is_online': other_user.is_online
+                'is_online': is_online
             }
         })
     except PrivateChatRoom.DoesNotExist:
@@ -242,14 +267,17 @@ def delete_messages(request):
                     'error': 'No messages found or you can only delete your own messages for everyone'
                 }, status=status.HTTP_404_NOT_FOUND)
 
-            # Помечаем сообщения как полностью удаленные
-            updated_count = messages_to_delete.update(
-                is_deleted=True,
-                deleted_at=timezone.now(),
-                deleted_by=user
-            )
+            # Помечаем сообщения как полностью удаленные; счетчики участников пересчитываем в той же транзакции
+            with transaction.atomic():
+                updated_count = messages_to_delete.update(
+                    is_deleted=True,
+                    deleted_at=timezone.now(),
+                    deleted_by=user
+                )
+                RoomMemberships.rebuild([room.id])
 
             logger.info(f"User {user.username} deleted {updated_count} messages for everyone in room {room_id}")
+            RecentMessages.mark_deleted(room.id, [int(mid) for mid in message_ids], user.id, for_everyone=True)
 
         else:  # delete_type == 'for_me'
             # Удаление только для себя - можно удалять любые сообщения в чате
@@ -268,18 +296,23 @@ def delete_messages(request):
             from .models import MessageDeletion
             deleted_count = 0
 
-            for message in messages_to_process:
-                deletion, created = MessageDeletion.objects.get_or_create(
-                    message=message,
-                    user=user,
-                    defaults={
-                        'deleted_at': timezone.now()
-                    }
-                )
-                if created:
-                    deleted_count += 1
+            with transaction.atomic():
+                for message in messages_to_process:
+                    deletion, created = MessageDeletion.objects.get_or_create(
+                        message=message,
+                        user=user,
+                        defaults={
+                            'deleted_at': timezone.now()
+                        }
+                    )
+                    if created:
+                        deleted_count += 1
+                if deleted_count:
+                    RoomMemberships.rebuild([room.id])
 
             logger.info(f"User {user.username} deleted {deleted_count} messages for self in room {room_id}")
+            RecentMessages.mark_deleted(room.id, [message.id for message in messages_to_process], user.id,
+                                        for_everyone=False)
             updated_count = deleted_count
 
         return Response({
@@ -4,7 +4,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Max, Count, Q, F, Subquery, OuterRef, IntegerField, Case, When, CharField
+from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.http import JsonResponse
@@ -13,6 +13,7 @@ from django.views.generic import ListView
 
 from authapp.models import CustomUser
 from chatapp.models import Room, PrivateChatRoom, PrivateMessage
+from chatapp.services.chat_list import get_chat_list
 
 
 class IndexView(ListView, LoginRequiredMixin):
@@ -101,7 +102,7 @@ def get_chat_history(request, room_id):
         Q(is_deleted=True) |  # Глобально удаленные сообщения
         Q(id__in=user_deleted_message_ids)  # Сообщения, удаленные пользователем для себя
     ).order_by('-timestamp').values(  # ИСПРАВЛЕНО: сортировка от новых к старым
-        'id', 'sender__username', 'sender_id', 'message', 'timestamp',
+        'id', 'seq', 'sender__username', 'sender_id', 'message', 'timestamp',
         'media_type', 'media_hash', 'media_filename', 'media_size'
     )
 
@@ -124,45 +125,15 @@ def get_chat_history(request, room_id):
 
 @login_required(login_url='auth:login')
 def user_dialog_list(request):
-    user = request.user
-
-    # Подзапрос для последнего времени сообщения
-    last_message_time_subquery = Subquery(
-        PrivateMessage.objects.filter(
-            room=OuterRef('room')
-        ).order_by('-timestamp')[:1].values('timestamp')
-    )
-
-    # Подзапрос для последнего сообщения
-    last_message_text_subquery = Subquery(
-        PrivateMessage.objects.filter(
-            room=OuterRef('room')
-        ).order_by('-timestamp')[:1].values('message')
-    )
-
-
-    user_dialogs = PrivateMessage.objects.filter(
-        Q(sender=user) | Q(recipient=user)
-    ).values('room', 'sender', 'recipient').annotate(
-        other_user_id=Case(
-            When(sender=user, then=F('recipient_id')),
-            When(recipient=user, then=F('sender_id')),
-            output_field=IntegerField()
-        ),
-        last_message_time=last_message_time_subquery,
-        last_message=last_message_text_subquery
-    ).order_by('-last_message_time').values('other_user_id', 'room', 'last_message_time', 'last_message').distinct()
-
-
     context = {
         'dialogs': [
             {
-                'id': chat['room'],
-                'other_user': CustomUser.objects.get(id=chat['other_user_id']),
-                'last_message_time': chat['last_message_time'],
-                'last_message': chat['last_message'],
-                'other_user_username': CustomUser.objects.get(id=chat['other_user_id']).username
-            } for chat in user_dialogs
+                'id': chat['room'].id,
+                'other_user': chat['other_user'],
+                'last_message_time': chat['last_message'].timestamp,
+                'last_message': chat['last_message'].message,
+                'other_user_username': chat['other_user'].username
+            } for chat in get_chat_list(request.user)
         ]
     }
 
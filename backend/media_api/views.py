@@ -1,5 +1,6 @@
 import base64
 import json
+import logging
 import mimetypes
 import os
 from pathlib import Path
@@ -16,12 +17,16 @@ from django.http import Http404
 from django.db import models
 from django.utils import timezone
 
+from backend.logutils import lazy
+
 from .models import UploadedFile, ImageFile, VideoFile
 from .serializers import (
     FileUploadSerializer, ImageUploadSerializer, VideoUploadSerializer,
     FileResponseSerializer, ImageResponseSerializer, VideoResponseSerializer
 )
 
+logger = logging.getLogger(__name__)
+
 
 class BaseUploadView(APIView):
     """Базовый класс для загрузки файлов."""
@@ -193,7 +198,7 @@ class BatchMediaUrlView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            print(f'⚡ [BATCH-API] Processing batch request for {len(message_ids)} messages')
+            logger.debug('⚡ [BATCH-API] Processing batch request for %s messages', len(message_ids))
 
             results = {}
             cache_hits = 0
@@ -212,7 +217,7 @@ class BatchMediaUrlView(APIView):
 
             # Если есть промахи кэша, запускаем фоновую задачу для предзагрузки
             if cache_misses:
-                print(f'⚡ [BATCH-API] Cache misses: {len(cache_misses)}, starting prefetch task')
+                logger.debug('⚡ [BATCH-API] Cache misses: %s, starting prefetch task', len(cache_misses))
                 prefetch_media_urls_task.apply_async(args=[cache_misses])
 
             return Response(
@@ -294,7 +299,7 @@ class MessageMediaUrlView(APIView):
             cached_data = cache.get(cache_key)
 
             if cached_data:
-                print(f'⚡ [REDIS-CACHE] ✅ Cache HIT for message {message_id}')
+                logger.debug('⚡ [REDIS-CACHE] ✅ Cache HIT for message %s', message_id)
 
                 # Проверяем валидность кэша (есть ли все необходимые данные)
                 if 'file_url' in cached_data and cached_data.get('file_id'):
@@ -307,14 +312,14 @@ class MessageMediaUrlView(APIView):
                     cached_data['success'] = True
                     cached_data['cached'] = True
 
-                    print(f'⚡ [REDIS-CACHE] ✅ Valid cache data, returning from cache')
+                    logger.debug('⚡ [REDIS-CACHE] ✅ Valid cache data, returning from cache')
                     return Response(cached_data, status=status.HTTP_200_OK)
                 else:
                     # Невалидные данные в кэше - удаляем и загружаем с сервера
-                    print(f'⚡ [REDIS-CACHE] ⚠️ Invalid cache data, deleting and loading from server')
+                    logger.warning('⚡ [REDIS-CACHE] ⚠️ Invalid cache data, deleting and loading from server')
                     cache.delete(cache_key)
 
-            print(f'⚡ [REDIS-CACHE] ❌ Cache MISS for message {message_id} - loading from database')
+            logger.debug('⚡ [REDIS-CACHE] ❌ Cache MISS for message %s - loading from database', message_id)
 
             # Импортируем модель сообщения из chatapp
             from chatapp.models import Message, PrivateMessage
@@ -341,19 +346,19 @@ class MessageMediaUrlView(APIView):
             # Пользователь - отправитель сообщения
             if hasattr(message, 'sender') and message.sender == request.user:
                 has_access = True
-                print(f"🔐 [ACCESS] ✅ User is message sender")
+                logger.debug('🔐 [ACCESS] ✅ User is message sender')
 
             # Пользователь - получатель сообщения (для приватных чатов)
             elif hasattr(message, 'recipient') and message.recipient == request.user:
                 has_access = True
-                print(f"🔐 [ACCESS] ✅ User is message recipient")
+                logger.debug('🔐 [ACCESS] ✅ User is message recipient')
 
             # Проверка доступа к комнате (для групповых чатов)
             elif hasattr(message, 'room'):
                 room = message.room
                 if hasattr(room, 'users') and request.user in room.users.all():
                     has_access = True
-                    print(f"🔐 [ACCESS] ✅ User is room member")
+                    logger.debug('🔐 [ACCESS] ✅ User is room member')
 
             # Для приватных диалогов проверяем через room_id
             elif hasattr(message, 'room_id'):
@@ -362,12 +367,12 @@ class MessageMediaUrlView(APIView):
                     room = PrivateChatRoom.objects.get(id=message.room_id)
                     if room.user1 == request.user or room.user2 == request.user:
                         has_access = True
-                        print(f"🔐 [ACCESS] ✅ User is private chat participant")
+                        logger.debug('🔐 [ACCESS] ✅ User is private chat participant')
                 except Exception as room_error:
-                    print(f"🔐 [ACCESS] ⚠️ Error checking room access: {room_error}")
+                    logger.error('🔐 [ACCESS] ⚠️ Error checking room access: %s', room_error)
 
             if not has_access:
-                print(f"🔐 [ACCESS] ❌ Access denied for user {request.user.id} to message {message_id}")
+                logger.warning('🔐 [ACCESS] ❌ Access denied for user %s to message %s', request.user.id, message_id)
                 return Response(
                     {
                         'success': False,
@@ -377,8 +382,8 @@ class MessageMediaUrlView(APIView):
                 )
 
             # Логирование для отладки
-            print(f"🔍 [DEBUG] MessageMediaUrlView: Processing message_id={message_id}")
-            print(f"🔍 [DEBUG] Message found: id={message.id}, sender={getattr(message, 'sender', None)}")
+            logger.debug('🔍 [DEBUG] MessageMediaUrlView: Processing message_id=%s', message_id)
+            logger.debug('🔍 [DEBUG] Message found: id=%s, sender=%s', message.id, getattr(message, 'sender_id', None))
 
             # Получаем медиафайл, связанный с сообщением
             uploaded_file = None
@@ -386,16 +391,16 @@ class MessageMediaUrlView(APIView):
             # КРИТИЧЕСКИ ВАЖНО: Сначала проверяем прямую связь с файлом в сообщении
             if hasattr(message, 'media_file') and message.media_file:
                 uploaded_file = message.media_file
-                print(f"🔍 [DEBUG] ✅ Found media_file directly in message: {uploaded_file.id}")
-                print(f"🔍 [DEBUG] File details: type={uploaded_file.file_type}, name={uploaded_file.original_name}")
+                logger.debug('🔍 [DEBUG] ✅ Found media_file directly in message: %s', uploaded_file.id)
+                logger.debug('🔍 [DEBUG] File details: type=%s, name=%s', uploaded_file.file_type, uploaded_file.original_name)
 
             # Fallback для старых сообщений без прямой связи: поиск по медиа хэшу
             elif not uploaded_file and hasattr(message, 'media_hash') and message.media_hash:
                 sender = getattr(message, 'sender', None)
                 media_type = getattr(message, 'media_type', None)
 
-                print(f"🔍 [DEBUG] No direct media_file link, searching by hash: {message.media_hash}")
-                print(f"🔍 [DEBUG] Message details: sender={sender.id if sender else None}, media_type={media_type}")
+                logger.debug('🔍 [DEBUG] No direct media_file link, searching by hash: %s', message.media_hash)
+                logger.debug('🔍 [DEBUG] Message details: sender=%s, media_type=%s', sender.id if sender else None, media_type)
 
                 if sender and media_type in ['image', 'video', 'document', 'other']:
                     from datetime import timedelta
@@ -407,7 +412,7 @@ class MessageMediaUrlView(APIView):
                         start_time = message_time - time_window
                         end_time = message_time + time_window
 
-                        print(f"🔍 [DEBUG] Searching files: type={media_type}, time_window={start_time} to {end_time}")
+                        logger.debug('🔍 [DEBUG] Searching files: type=%s, time_window=%s to %s', media_type, start_time, end_time)
 
                         potential_files = UploadedFile.objects.filter(
                             user=sender,
@@ -416,23 +421,23 @@ class MessageMediaUrlView(APIView):
                             uploaded_at__lte=end_time
                         ).order_by('-uploaded_at')
 
-                        print(f"🔍 [DEBUG] Found {potential_files.count()} potential files")
+                        logger.debug('🔍 [DEBUG] Found %s potential files', lazy(potential_files.count))
 
                         if potential_files.exists():
                             uploaded_file = potential_files.first()
-                            print(f"🔍 [DEBUG] ✅ Found file by hash/time: {uploaded_file.id}")
+                            logger.debug('🔍 [DEBUG] ✅ Found file by hash/time: %s', uploaded_file.id)
 
                             # Обновляем сообщение для будущих запросов
                             try:
                                 message.media_file = uploaded_file
                                 message.save(update_fields=['media_file'])
-                                print(f"🔍 [DEBUG] ✅ Updated message with media_file link")
+                                logger.debug('🔍 [DEBUG] ✅ Updated message with media_file link')
                             except Exception as update_error:
-                                print(f"🔍 [DEBUG] ⚠️ Could not update message: {update_error}")
+                                logger.warning('🔍 [DEBUG] ⚠️ Could not update message: %s', update_error)
 
             # Если ничего не найдено - пробуем расширенный поиск
             if not uploaded_file:
-                print(f"🔍 [DEBUG] ❌ No media file found, trying extended search for message_id={message_id}")
+                logger.warning('🔍 [DEBUG] ❌ No media file found, trying extended search for message_id=%s', message_id)
 
                 # Расширенный поиск: все файлы отправителя за последний час
                 if sender:
@@ -442,24 +447,24 @@ class MessageMediaUrlView(APIView):
                         uploaded_at__gte=timezone.now() - timedelta(hours=1)
                     ).order_by('-uploaded_at')
 
-                    print(f"🔍 [DEBUG] Extended search found {recent_files.count()} files in last hour")
+                    logger.debug('🔍 [DEBUG] Extended search found %s files in last hour', lazy(recent_files.count))
 
                     if recent_files.exists():
                         # Берем самый последний файл
                         uploaded_file = recent_files.first()
-                        print(f"🔍 [DEBUG] Using most recent file: {uploaded_file.id} ({uploaded_file.original_name})")
+                        logger.debug('🔍 [DEBUG] Using most recent file: %s (%s)', uploaded_file.id, uploaded_file.original_name)
 
                         # Обновляем сообщение для будущих запросов
                         try:
                             message.media_file = uploaded_file
                             message.save(update_fields=['media_file'])
-                            print(f"🔍 [DEBUG] ✅ Updated message with media_file link")
+                            logger.debug('🔍 [DEBUG] ✅ Updated message with media_file link')
                         except Exception as update_error:
-                            print(f"🔍 [DEBUG] ⚠️ Could not update message: {update_error}")
+                            logger.warning('🔍 [DEBUG] ⚠️ Could not update message: %s', update_error)
 
                 # Если все равно не найдено - возвращаем ошибку
                 if not uploaded_file:
-                    print(f"🔍 [DEBUG] ❌ No media file found even after extended search")
+                    logger.warning('🔍 [DEBUG] ❌ No media file found even after extended search')
                     return Response(
                         {
                             'success': False,
@@ -468,7 +473,7 @@ class MessageMediaUrlView(APIView):
                         status=status.HTTP_404_NOT_FOUND
                     )
 
-            print(f"🔍 [DEBUG] Final uploaded_file: id={uploaded_file.id}, url={uploaded_file.file.url}")
+            logger.debug('🔍 [DEBUG] Final uploaded_file: id=%s, url=%s', uploaded_file.id, lazy(lambda: uploaded_file.file.url))
 
             # Проверяем права доступа к файлу
             file_has_access = False
@@ -476,7 +481,7 @@ class MessageMediaUrlView(APIView):
             # Пользователь - владелец файла
             if uploaded_file.user == request.user:
                 file_has_access = True
-                print(f"🔐 [FILE-ACCESS] ✅ User is file owner")
+                logger.debug('🔐 [FILE-ACCESS] ✅ User is file owner')
 
             # Файл используется в сообщении, к которому пользователь имеет доступ
             # Так как мы уже проверили доступ к сообщению выше, то имеем право на файл
@@ -486,7 +491,7 @@ class MessageMediaUrlView(APIView):
                     # Приватный диалог
                     if message.sender == request.user or message.recipient == request.user:
                         file_has_access = True
-                        print(f"🔐 [FILE-ACCESS] ✅ User is participant of private chat")
+                        logger.debug('🔐 [FILE-ACCESS] ✅ User is participant of private chat')
                 elif hasattr(message, 'room_id'):
                     # Проверяем через room_id
                     try:
@@ -494,21 +499,22 @@ class MessageMediaUrlView(APIView):
                         room = PrivateChatRoom.objects.get(id=message.room_id)
                         if room.user1 == request.user or room.user2 == request.user:
                             file_has_access = True
-                            print(f"🔐 [FILE-ACCESS] ✅ User is participant via room_id")
+                            logger.debug('🔐 [FILE-ACCESS] ✅ User is participant via room_id')
                     except Exception as room_check_error:
-                        print(f"🔐 [FILE-ACCESS] ⚠️ Error checking room: {room_check_error}")
+                        logger.error('🔐 [FILE-ACCESS] ⚠️ Error checking room: %s', room_check_error)
 
                 # Проверка для групповых чатов
                 if not file_has_access and hasattr(message, 'room'):
                     room = message.room
                     if hasattr(room, 'users') and request.user in room.users.all():
                         file_has_access = True
-                        print(f"🔐 [FILE-ACCESS] ✅ User is group chat member")
+                        logger.debug('🔐 [FILE-ACCESS] ✅ User is group chat member')
 
             if not file_has_access:
-                print(f"🔐 [FILE-ACCESS] ❌ File access denied for user {request.user.id} to file {uploaded_file.id}")
-                print(f"🔐 [FILE-ACCESS] File owner: {uploaded_file.user.id}, requesting user: {request.user.id}")
-                print(f"🔐 [FILE-ACCESS] Message sender: {getattr(message, 'sender', None)}, recipient: {getattr(message, 'recipient', None)}")
+                logger.warning('🔐 [FILE-ACCESS] ❌ File access denied for user %s to file %s', request.user.id, uploaded_file.id)
+                logger.debug('🔐 [FILE-ACCESS] File owner: %s, requesting user: %s', uploaded_file.user_id, request.user.id)
+                logger.debug('🔐 [FILE-ACCESS] Message sender: %s, recipient: %s',
+                             getattr(message, 'sender_id', None), getattr(message, 'recipient_id', None))
                 return Response(
                     {
                         'success': False,
@@ -517,7 +523,7 @@ class MessageMediaUrlView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-            print(f"🔐 [FILE-ACCESS] ✅ Access granted to file {uploaded_file.id} for user {request.user.id}")
+            logger.debug('🔐 [FILE-ACCESS] ✅ Access granted to file %s for user %s', uploaded_file.id, request.user.id)
 
             # Формируем полный URL к файлу
             file_url = request.build_absolute_uri(uploaded_file.file.url)
@@ -564,7 +570,7 @@ class MessageMediaUrlView(APIView):
                 }
 
                 # Логируем для отладки
-                print(f'📄 [MEDIA-API] Returning document/file URL: {uploaded_file.file_type}')
+                logger.debug('📄 [MEDIA-API] Returning document/file URL: %s', uploaded_file.file_type)
 
             # Кэшируем результат в Redis для быстрого доступа при повторных запросах
             # TTL берем из настроек (по умолчанию 24 часа)
@@ -574,7 +580,7 @@ class MessageMediaUrlView(APIView):
             cache_key = f'media_url_{message_id}'
             cache.set(cache_key, response_data, timeout=cache_ttl)
 
-            print(f'⚡ [REDIS-CACHE] ✅ Cached media URL for message {message_id} (TTL: {cache_ttl}s)')
+            logger.debug('⚡ [REDIS-CACHE] ✅ Cached media URL for message %s (TTL: %ss)', message_id, cache_ttl)
 
             return Response(response_data, status=status.HTTP_200_OK)
 
@@ -3,9 +3,10 @@ from pathlib import Path
 
 from rest_framework import serializers
 from authapp.models import CustomUser
+from chatapp.serializers import LivePresenceListSerializer, LivePresenceMixin
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(LivePresenceMixin, serializers.ModelSerializer):
     age = serializers.SerializerMethodField()
     avatar_url = serializers.SerializerMethodField()
 
@@ -87,8 +88,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return value
 
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(LivePresenceMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['id', 'username', 'first_name', 'last_name', 'avatar', 'is_online', 'last_seen', 'gender']
         read_only_fields = ['id', 'username', 'avatar', 'is_online', 'last_seen']
+        list_serializer_class = LivePresenceListSerializer
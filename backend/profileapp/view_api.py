@@ -2,7 +2,7 @@ import json
 import logging
 
 from rest_framework import generics, permissions, status
-from rest_framework.authentication import TokenAuthentication
+from authapp.authentication import CachedTokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import IsAuthenticated
@@ -11,11 +11,14 @@ from django.shortcuts import get_object_or_404
 from authapp.models import CustomUser
 from chatapp.models import Message, PrivateMessage, PrivateChatRoom
 from chatapp.serializers import MessageSerializer
+from chatapp.services.recent_messages import RecentMessages
+from chatapp.services.send_message import RoomParticipantsCache
+from backend.logutils import lazy
 from .serializers import UserProfileSerializer, UserListSerializer
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def bulk_users_info(request):
     """
@@ -66,7 +69,7 @@ def bulk_users_info(request):
         users_list = list(users)
 
         # Логируем для отладки
-        print(f"Bulk users request: IDs {user_ids}, found {len(users_list)} users")
+        logger.debug('Bulk users request: IDs %s, found %s users', user_ids, len(users_list))
 
         return Response(users_list, status=status.HTTP_200_OK)
 
@@ -76,7 +79,7 @@ def bulk_users_info(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     except Exception as e:
-        print(f"Error in bulk_users_info: {str(e)}")
+        logger.error('Error in bulk_users_info: %s', e)
         return Response(
             {'error': 'Внутренняя ошибка сервера'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -204,15 +207,20 @@ class ChatHistoryView(generics.ListAPIView):
         page = int(request.GET.get('page', 1))
         limit = min(int(request.GET.get('limit', 15)), 50)
 
-        logger = logging.getLogger(__name__)
-        logger.info(f"📜 [CHAT-HISTORY] User {request.user.id} requesting history for room {room_id}")
-        logger.info(f"📜 [CHAT-HISTORY] Parameters: page={page}, limit={limit}")
+        logger.debug("📜 [CHAT-HISTORY] User %s requesting history for room %s: page=%s, limit=%s",
+                     request.user.id, room_id, page, limit)
+
+        # Первая страница - из списка последних сообщений комнаты в Redis
+        if page == 1:
+            recent = self.recent_page(room_id, limit)
+            if recent is not None:
+                return Response(recent)
 
         # Получаем QuerySet с предзагрузкой связанных объектов
         queryset = self.get_queryset().select_related('reply_to_message', 'reply_to_message__sender')
 
         if not queryset.exists():
-            logger.warning(f"📜 [CHAT-HISTORY] No messages or access denied for room {room_id}")
+            logger.warning("📜 [CHAT-HISTORY] No messages or access denied for room %s", room_id)
             return Response({
                 'messages': [],
                 'has_more': False,
@@ -220,11 +228,10 @@ class ChatHistoryView(generics.ListAPIView):
                 'total_pages': 0
             })
 
-        logger.info(f"📜 [CHAT-HISTORY] Found {queryset.count()} total messages")
-
         # Пагинация
         from django.core.paginator import Paginator
         paginator = Paginator(queryset, limit)
+        logger.debug("📜 [CHAT-HISTORY] Found %s total messages", lazy(lambda: paginator.count))
 
         if page > paginator.num_pages and paginator.num_pages > 0:
             page = paginator.num_pages
@@ -235,39 +242,16 @@ class ChatHistoryView(generics.ListAPIView):
         serializer = self.get_serializer(page_obj, many=True)
         serialized_data = serializer.data
 
-        # Проверяем и логируем данные реплаев
-        reply_count = 0
-        for i, msg_data in enumerate(serialized_data):
-            msg_obj = page_obj[i]
-
-            # Логируем каждое сообщение с реплаем
-            if msg_obj.reply_to_message_id:
-                reply_count += 1
-                logger.info(f"📜 [REPLY] Message {msg_obj.id} -> reply_to={msg_obj.reply_to_message_id}")
-                logger.info(f"📜 [REPLY] Serialized data: {msg_data.get('reply_to_message_id')}, text='{msg_data.get('reply_to_message', 'NONE')[:30]}', sender='{msg_data.get('reply_to_sender', 'NONE')}'")
-
-                # Проверяем что reply_to_message_text не пустой
-                if msg_obj.reply_to_message_text:
-                    logger.info(f"📜 [REPLY] DB reply_to_message_text: '{msg_obj.reply_to_message_text[:50]}'")
-                else:
-                    logger.warning(f"📜 [REPLY] ⚠️ reply_to_message_text is empty for message {msg_obj.id}")
+        reply_count = sum(1 for msg in page_obj if msg.reply_to_message_id)
+        media_count = sum(1 for msg in page_obj if msg.is_media_message)
 
-                # Проверяем что reply_to_sender_name не пустой
-                if msg_obj.reply_to_sender_name:
-                    logger.info(f"📜 [REPLY] DB reply_to_sender_name: '{msg_obj.reply_to_sender_name}'")
-                else:
-                    logger.warning(f"📜 [REPLY] ⚠️ reply_to_sender_name is empty for message {msg_obj.id}")
+        # Реплаи без сохраненного текста или отправителя - признак бага на стороне отправки
+        for msg in page_obj:
+            if msg.reply_to_message_id and not (msg.reply_to_message_text and msg.reply_to_sender_name):
+                logger.warning("📜 [REPLY] ⚠️ Incomplete reply data for message %s -> %s", msg.id, msg.reply_to_message_id)
 
-        # Подсчитываем медиа-сообщения
-        media_messages = [msg for msg in page_obj if msg.is_media_message]
-        media_count = len(media_messages)
-
-        logger.info(f"📜 [CHAT-HISTORY] Returning {len(serialized_data)} messages, {media_count} with media, {reply_count} with replies")
-
-        # Логируем примеры медиа-сообщений
-        if media_count > 0:
-            for i, msg in enumerate(media_messages[:3]):
-                logger.info(f"📜 [CHAT-HISTORY] Media message {i+1}: ID={msg.id}, type={msg.media_type}, hash={msg.media_hash}")
+        logger.debug("📜 [CHAT-HISTORY] Returning %s messages, %s with media, %s with replies",
+                     len(serialized_data), media_count, reply_count)
 
         return Response({
             'messages': serialized_data,
@@ -278,9 +262,38 @@ class ChatHistoryView(generics.ListAPIView):
             'reply_messages_count': reply_count
         })
 
+    def recent_page(self, room_id, limit):
+        """
+        Первая страница из RecentMessages: без count(), OFFSET и сериализации.
+        None - отдаем страницу обычным путем (не участник комнаты, в списке не хватает сообщений).
+        """
+        participants = RoomParticipantsCache.get(room_id)
+        if participants is None or self.request.user.id not in participants:
+            return None
+
+        result = RecentMessages.page(room_id, self.request.user.id, limit)
+        if result is None:
+            return None
+        messages, has_more = result
+
+        # Точное число страниц без count() неизвестно: оценка по номеру последнего сообщения
+        total_pages = 1 if messages else 0
+        if has_more:
+            total_pages = max(2, -(-(messages[0]['seq'] or 0) // limit))
+
+        logger.debug("📜 [CHAT-HISTORY] Returning %s recent messages for room %s from cache", len(messages), room_id)
+        return {
+            'messages': messages,
+            'has_more': has_more,
+            'current_page': 1,
+            'total_pages': total_pages,
+            'media_messages_count': sum(1 for msg in messages if msg['mediaType'] != 'text'),
+            'reply_messages_count': sum(1 for msg in messages if msg['reply_to_message_id'])
+        }
+
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def get_last_messages_by_senders(request):
     """
@@ -320,9 +333,9 @@ def get_last_messages_by_senders(request):
                     'chat_id': last_message.room_id
                 }
 
-        print(f"Last messages API response: {result}")
+        logger.debug('Last messages API response: %s', result)
         return Response(result, status=200)
 
     except Exception as e:
-        print(f"Error in get_last_messages_by_senders: {str(e)}")
+        logger.error('Error in get_last_messages_by_senders: %s', e)
         return Response({'error': 'Внутренняя ошибка сервера'}, status=500)
@@ -86,22 +86,26 @@ function connect() {
                 break;
 
             case "user_list":
+                onlineUsersSelector.innerHTML = "";
                 for (let i = 0; i < data.users.length; i++) {
                     onlineUsersSelectorAdd(data.users[i]);
                 }
                 break;
-            case "user_join":
-                myDiv.appendChild( myDivMess = document.createElement('div'));
-                myDivMess.className = 'joinedTheRoom';
-                myDivMess.textContent += data.user + " joined the room.\n";
-                myDiv.scrollTop = myDiv.scrollHeight;
-                onlineUsersSelectorAdd(data.user);
-                break;
-            case "user_leave":
+            case "presence_summary":
+                for (let i = 0; i < data.joined.length; i++) {
+                    onlineUsersSelectorRemove(data.joined[i]);
+                    onlineUsersSelectorAdd(data.joined[i]);
+                }
+                for (let i = 0; i < data.left.length; i++) {
+                    onlineUsersSelectorRemove(data.left[i]);
+                }
                 myDiv.appendChild(myDivMess = document.createElement('div'));
                 myDivMess.className = 'joinedTheRoom';
-                myDivMess.textContent += data.user + " left the room.\n";
-                onlineUsersSelectorRemove(data.user);
+                if (data.joined_count + data.left_count === 1) {
+                    myDivMess.textContent += (data.joined_count ? data.joined[0] + " joined the room.\n" : data.left[0] + " left the room.\n");
+                } else {
+                    myDivMess.textContent += data.joined_count + " joined, " + data.left_count + " left (" + data.online_count + " online).\n";
+                }
                 break;
 
 